@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+asm-build: incremental build driver for VM guest programs
+
+Assembles a set of programs (given on the command line or in a manifest)
+and only rebuilds the binaries whose sources changed. The .include graph
+found while assembling each program is recorded in a state file together
+with the size, mtime and content hash of every source. A target is up to
+date when its output exists and every recorded source still matches: a
+source whose mtime changed but whose content hash did not (e.g. after a
+checkout or `touch`) does not cause a rebuild. A Make/Ninja depfile is
+written next to every output.
+
+With --watch the sources are polled and changed targets are rebuilt in
+process as soon as a change is seen.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import time
+
+from assembler import (Verbosity, assemble_many, assembler_fingerprint, assembler_options,
+                       read_manifest, write_depfile, DEFAULT_CACHE_SIZE)
+
+STATE_VERSION = 1
+DEFAULT_STATE_FILE = ".asm-build.json"
+
+def file_signature(path):
+    """Return [mtime_ns, size, sha256] of a file, or None if it does not exist."""
+    try:
+        st = os.stat(path)
+        with open(path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size, digest]
+
+class BuildState:
+    """Sources, include graph and flags each target was last built from."""
+    def __init__(self, path):
+        self.path = path
+        self.targets = {}
+        try:
+            with open(path, 'r') as f:
+                state = json.load(f)
+            if state.get("version") == STATE_VERSION and state.get("assembler") == assembler_fingerprint():
+                self.targets = state["targets"]
+        except (OSError, ValueError, KeyError):
+            # Missing or stale state: everything is rebuilt
+            self.targets = {}
+
+    def save(self):
+        state = {"version": STATE_VERSION, "assembler": assembler_fingerprint(), "targets": self.targets}
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def is_up_to_date(self, output_file, input_file, flags):
+        """
+        Check a target against its recorded sources. Unchanged mtime and size
+        are trusted; otherwise the content hash decides.
+        """
+        entry = self.targets.get(output_file)
+        if not entry or entry["input"] != input_file or entry["flags"] != flags or entry.get("failed"):
+            return False
+        if not os.path.exists(output_file):
+            return False
+
+        for path, recorded in entry["sources"].items():
+            try:
+                st = os.stat(path)
+            except OSError:
+                return False
+            if [st.st_mtime_ns, st.st_size] == recorded[:2]:
+                continue
+            signature = file_signature(path)
+            if signature is None or signature[2] != recorded[2]:
+                return False
+            # Touched but not modified: remember the new mtime
+            entry["sources"][path] = signature
+        return True
+
+    def record(self, output_file, input_file, flags, include_graph, success):
+        """Record the sources of a target that was just built."""
+        sources = {}
+        for path in [os.path.abspath(input_file)] + sorted({p for files in include_graph.values() for p in files}):
+            signature = file_signature(path)
+            if signature:
+                sources[path] = signature
+        self.targets[output_file] = {
+            "input": input_file,
+            "flags": flags,
+            "sources": sources,
+            "include_graph": include_graph,
+            "failed": not success,
+        }
+
+    def watched_files(self):
+        """Return every recorded source with its recorded mtime."""
+        files = {}
+        for entry in self.targets.values():
+            for path, recorded in entry["sources"].items():
+                files[path] = recorded[0]
+        return files
+
+class Builder:
+    def __init__(self, targets, args, level):
+        self.targets = targets  # [(input_file, output_file)]
+        self.args = args
+        self.level = level
+        self.state = BuildState(args.state)
+        self.options = assembler_options(args)
+        self.flags = dict(self.options, compile=args.compile, debug_output=int(self.options["debug_output"]))
+
+    def log(self, level, message):
+        if level <= self.level:
+            print(message, file=sys.stderr)
+
+    def build(self, force=False):
+        """Rebuild every out-of-date target; returns (rebuilt, failed)."""
+        dirty = [(input_file, output_file) for input_file, output_file in self.targets
+                 if force or not self.state.is_up_to_date(output_file, input_file, self.flags)]
+        if not dirty:
+            self.log(Verbosity.VERBOSE, f"All {len(self.targets)} targets are up to date")
+            self.state.save()
+            return 0, 0
+
+        cache_dir = self.args.cache_dir if not self.args.no_cache else None
+        jobs = []
+        for input_file, output_file in dirty:
+            os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+            jobs.append((input_file, output_file, self.args.compile, self.options, cache_dir,
+                         DEFAULT_CACHE_SIZE, Verbosity.QUIET))
+
+        start = time.perf_counter()
+        results = assemble_many(jobs, self.args.jobs)
+        elapsed = time.perf_counter() - start
+
+        failed = 0
+        for (input_file, output_file), (success, log, _, include_graph) in zip(dirty, results):
+            sys.stderr.write(log)
+            self.state.record(output_file, input_file, self.flags, include_graph, success)
+            if success:
+                if not self.args.no_depfiles:
+                    write_depfile(output_file + ".d", output_file, list(self.state.targets[output_file]["sources"]))
+                self.log(Verbosity.VERBOSE, f"Built {output_file}")
+            else:
+                failed += 1
+        self.state.save()
+
+        self.log(Verbosity.NORMAL, f"Rebuilt {len(dirty) - failed} of {len(self.targets)} targets "
+                                   f"in {elapsed * 1000:.0f} ms ({failed} failed)")
+        return len(dirty), failed
+
+    def watch(self, interval):
+        """Poll the sources and rebuild changed targets until interrupted."""
+        self.log(Verbosity.NORMAL, f"Watching {len(self.targets)} targets (Ctrl-C to stop)")
+        known = self.state.watched_files()
+        inputs = {os.path.abspath(input_file) for input_file, _ in self.targets}
+        try:
+            while True:
+                time.sleep(interval)
+                changed = False
+                for path in set(known) | inputs:
+                    try:
+                        mtime = os.stat(path).st_mtime_ns
+                    except OSError:
+                        mtime = None
+                    if known.get(path) != mtime:
+                        changed = True
+                        break
+                if changed:
+                    self.build()
+                    known = self.state.watched_files()
+                    for path in inputs - set(known):
+                        known[path] = None
+        except KeyboardInterrupt:
+            pass
+
+    def print_graph(self):
+        """Print the include tree of every target."""
+        for input_file, output_file in self.targets:
+            entry = self.state.targets.get(output_file)
+            print(output_file)
+            if not entry:
+                print("  (not built yet)")
+                continue
+            graph = entry["include_graph"]
+
+            def walk(path, depth, seen):
+                print("  " * depth + path)
+                for child in graph.get(path, []):
+                    if child not in seen:
+                        walk(child, depth + 1, seen | {child})
+            root = os.path.abspath(input_file)
+            walk(root, 1, {root})
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Incremental build driver for VM guest programs')
+    parser.add_argument('inputs', nargs='*', metavar='input', help='Input assembly files')
+    parser.add_argument('-m', '--manifest', help='Project manifest listing "input [output]" per line')
+    parser.add_argument('--output-dir', help='Directory for the outputs (default: next to each input)')
+    parser.add_argument('-c', '--compile', action='store_true', help='Build relocatable object files instead of binaries')
+    parser.add_argument('-O', '--optimize', action='store_true', help='Run the peephole optimizer')
+    parser.add_argument('--merge-strings', action='store_true', help='Share identical strings and string tails')
+    parser.add_argument('--pack-data', action='store_true', help='Reorder data objects by alignment to minimize padding')
+    parser.add_argument('--no-literal-pool', action='store_true',
+                        help='Truncate (with a warning) immediates that do not fit instead of pooling them')
+    debug_group = parser.add_mutually_exclusive_group()
+    debug_group.add_argument('--split-debug', action='store_true', help='Write debug information to .vmdbg files')
+    debug_group.add_argument('--strip', action='store_true', help='Do not include any debug information')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of parallel workers (default: all cores)')
+    parser.add_argument('--state', default=DEFAULT_STATE_FILE, help='Build state file (default: %(default)s)')
+    parser.add_argument('-B', '--always-make', action='store_true', help='Rebuild every target')
+    parser.add_argument('--no-depfiles', action='store_true', help='Do not write <output>.d depfiles')
+    parser.add_argument('-w', '--watch', action='store_true', help='Keep polling the sources and rebuild on change')
+    parser.add_argument('--interval', type=float, default=0.2, help='Watch polling interval in seconds (default: %(default)s)')
+    parser.add_argument('--graph', action='store_true', help='Print the recorded include graph of every target')
+    parser.add_argument('--cache-dir', default=os.environ.get("VMASM_CACHE_DIR"), help='Build cache directory')
+    parser.add_argument('--no-cache', action='store_true', help='Do not use the build cache')
+    parser.add_argument('-v', '--verbose', action='count', default=0, help='Show verbose output')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Only report errors')
+
+    args = parser.parse_args()
+
+    if args.quiet:
+        level = Verbosity.QUIET
+    else:
+        level = min(Verbosity.NORMAL + args.verbose, Verbosity.TRACE)
+
+    entries = [(input_file, None) for input_file in args.inputs]
+    if args.manifest:
+        try:
+            entries.extend(read_manifest(args.manifest))
+        except OSError as e:
+            parser.error(f"cannot read manifest: {e}")
+    if not entries:
+        parser.error("no input files")
+
+    extension = '.o' if args.compile else '.bin'
+    targets = []
+    for input_file, output_file in entries:
+        if not output_file:
+            output_file = os.path.splitext(input_file)[0] + extension
+            if args.output_dir:
+                output_file = os.path.join(args.output_dir, os.path.basename(output_file))
+        targets.append((input_file, output_file))
+
+    builder = Builder(targets, args, level)
+    if args.graph:
+        builder.print_graph()
+        return
+
+    _, failed = builder.build(force=args.always_make)
+    if args.watch:
+        builder.watch(args.interval)
+        return
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,21 @@
 #!/usr/bin/env python3
 
+import bisect
+import collections
+import concurrent.futures
+import functools
+import hashlib
+import io
+import json
+import math
 import re
 import struct
 import sys
 import os
+import tempfile
+import time
+from array import array
+from contextlib import contextmanager
 from enum import IntEnum
 
 # Addressing modes
@@ -16,6 +28,28 @@ class AddressingMode(IntEnum):
     STK = 0x5   # Stack Relative: [SP + Offset]
     BAS = 0x6   # Base Relative: [BP + Offset]
 
+# Modes that use the combined reg2+immediate field as a 16-bit immediate
+WIDE_IMMEDIATE_MODES = frozenset((AddressingMode.IMM, AddressingMode.MEM, AddressingMode.STK, AddressingMode.BAS))
+
+def encode_instruction(opcode, mode, reg1, reg2, immediate):
+    """Encode a VM instruction into a 32-bit value."""
+    # Ensure fields are within their bit limits
+    opcode = opcode & 0xFF        # 8 bits
+    mode = mode & 0x0F            # 4 bits
+    reg1 = reg1 & 0x0F            # 4 bits
+    
+    # If in immediate mode, split 16-bit immediate across reg2 and immediate fields
+    if mode in WIDE_IMMEDIATE_MODES:
+        reg2 = (immediate >> 12) & 0xF  # High 4 bits
+        immediate = immediate & 0xFFF   # Low 12 bits
+    else:
+        reg2 = reg2 & 0x0F            # 4 bits
+        immediate = immediate & 0xFFF  # 12 bits
+    
+    # Build the instruction
+    instruction = (opcode << 24) | (mode << 20) | (reg1 << 16) | (reg2 << 12) | immediate
+    return instruction
+
 # Register definitions
 class Register(IntEnum):
     R0_ACC = 0  # Accumulator
@@ -38,6 +72,7 @@ class Register(IntEnum):
 # Memory segment base addresses
 CODE_SEGMENT_BASE = 0x0000
 DATA_SEGMENT_BASE = 0x4000
+DATA_SEGMENT_SIZE = 0x4000
 STACK_SEGMENT_BASE = 0x8000
 HEAP_SEGMENT_BASE = 0xC000
 
@@ -281,29 +316,2413 @@ class InstructionFormat:
         
         return True, ""
 
-class Assembler:
+# Literal pool: instructions that read a 32-bit source operand the same way
+# in IMM and MEM mode, so a constant too wide for the immediate field can be
+# loaded from the data segment instead
+LITERAL_POOL_OPS = frozenset((
+    Opcode.LOAD, Opcode.ADD, Opcode.SUB, Opcode.MUL, Opcode.DIV, Opcode.MOD, Opcode.ADDC, Opcode.SUBC,
+    Opcode.CMP, Opcode.AND, Opcode.OR, Opcode.XOR, Opcode.TEST,
+))
+LITERAL_PREFIX = ".L_literal_"
+
+def immediate_fits(mode, value):
+    """
+    Check that an immediate survives encoding. Values are zero-extended by
+    the VM; 16-bit addresses and BP/SP offsets wrap around, so they may be
+    negative too.
+    """
+    if mode == AddressingMode.IMM:
+        return 0 <= value <= 0xFFFF
+    if mode in WIDE_IMMEDIATE_MODES:
+        return -0x8000 <= value <= 0xFFFF
+    return 0 <= value <= 0xFFF
+
+def data_value_fits(value, size):
+    """Check that a data value fits in size bytes, as a signed or an unsigned number."""
+    bits = size * 8
+    return -(1 << (bits - 1)) <= value < (1 << bits)
+
+# Command dispatch tables (.dispatch)
+#
+# A table maps string keys to labels through a perfect hash the guest can
+# compute in a few instructions:
+#     h = 0; for every byte c of the key: h = h * 33 + c      (32 bits)
+#     slot = (h * name.seed) >> name.shift                    (32 bits)
+# Each of the 2**(32 - shift) slots holds two dwords: the address of the
+# key string (0 for an unused slot) and the address of its label.
+DISPATCH_ENTRY_SIZE = 8
+DISPATCH_MAX_EXTRA_BITS = 2   # Up to 4 times more slots than the smallest table
+
+def dispatch_hash(key):
+    """Hash of a dispatch key (bytes), as computed by the guest."""
+    h = 0
+    for byte in key:
+        h = (h * 33 + byte) & 0xFFFFFFFF
+    return h
+
+def perfect_hash(hashes):
+    """
+    Find the smallest table for a set of distinct key hashes: returns
+    (bits, seed) such that (h * seed mod 2**32) >> (32 - bits) differs for
+    every hash, or None if there is none within DISPATCH_MAX_EXTRA_BITS.
+    """
+    min_bits = max(1, (len(hashes) - 1).bit_length())
+    for bits in range(min_bits, min_bits + DISPATCH_MAX_EXTRA_BITS + 1):
+        shift = 32 - bits
+        for seed in range(1, 0x10000, 2):
+            if len({((h * seed) & 0xFFFFFFFF) >> shift for h in hashes}) == len(hashes):
+                return bits, seed
+    return None
+
+# Register names mapping (case-sensitive, as written in source)
+REGISTER_NAMES = {
+    "R0": 0, "ACC": 0, "R0_ACC": 0,
+    "R1": 1, "BP": 1, "R1_BP": 1,
+    "R2": 2, "SP": 2, "R2_SP": 2,
+    "R3": 3, "PC": 3, "R3_PC": 3,
+    "R4": 4, "SR": 4, "R4_SR": 4,
+    "R5": 5, "R6": 6, "R7": 7, "R8": 8, "R9": 9,
+    "R10": 10, "R11": 11, "R12": 12, "R13": 13, "R14": 14,
+    "R15": 15, "LR": 15, "R15_LR": 15
+}
+
+# Token types produced by the lexer
+class TokenType(IntEnum):
+    LABEL = 0      # Label definition: name:
+    DIRECTIVE = 1  # Assembler directive: .name
+    MNEMONIC = 2   # Instruction mnemonic
+    REGISTER = 3   # Register operand: R0-R15 and aliases
+    IMMEDIATE = 4  # Numeric literal: 123, #0xFF
+    SYMBOL = 5     # Label or constant reference: loop, #BUFSIZE
+    BRACKET = 6    # Memory operand: [expr]
+    STRING = 7     # Quoted string literal
+    INVALID = 8    # Anything the lexer could not classify
+    EXPRESSION = 9 # Constant expression: BUFSIZE*2, (1 << 4) | 1
+
+class Token:
+    """
+    A single typed token of an assembly line.
+    value depends on type: register number, integer, symbol name, decoded
+    string bytes, expression tree, or (base, sign, offset) for bracket
+    operands.
+    """
+    __slots__ = ('type', 'text', 'value')
+
+    def __init__(self, type, text, value=None):
+        self.type = type
+        self.text = text
+        self.value = value
+
+    def __repr__(self):
+        return f"Token({self.type.name}, {self.text!r}, {self.value!r})"
+
+# Output fields a symbol value can be stored into
+class FixupType(IntEnum):
+    IMM16 = 0   # Instruction reg2+immediate field (IMM, MEM, STK, BAS modes)
+    IMM12 = 1   # Instruction immediate field (IDX mode)
+    DATA8 = 2   # Data byte (.byte)
+    DATA16 = 3  # Data word (.word)
+    DATA32 = 4  # Data double word (.dword)
+
+class Fixup:
+    """
+    A symbol reference recorded while encoding. Resolving it is a direct
+    store of (symbol value, negated if requested, plus addend) into the field
+    at the given byte offset of its section.
+    """
+    __slots__ = ('type', 'section', 'offset', 'symbol', 'addend', 'negate', 'file', 'line')
+
+    def __init__(self, type, section, offset, symbol, addend=0, negate=False, file="", line=0):
+        self.type = type
+        self.section = section
+        self.offset = offset
+        self.symbol = symbol
+        self.addend = addend
+        self.negate = negate
+        self.file = file
+        self.line = line
+
+    def __repr__(self):
+        return f"Fixup({self.type.name}, {self.section}+0x{self.offset:X}, {self.symbol!r}, {self.addend})"
+
+# Intermediate representation
+#
+# Pass 1 parses every line once into the nodes below, appended to the node
+# list of their section. Every node knows its source location and is placed
+# (given an address) as it is appended; place() returns the address that
+# follows the node. Later passes (encoding, debug info, listings, optimizers)
+# walk the nodes instead of re-parsing the source.
+
+class Node:
+    """Base class of the IR nodes."""
+    __slots__ = ('address', 'file', 'line', 'text')
+    
     def __init__(self):
+        self.address = 0
+        self.file = ""
+        self.line = 0
+        self.text = ""
+
+class Label(Node):
+    """A label definition. Data labels are aligned to 4 bytes; pad is the padding before it."""
+    __slots__ = ('name', 'align', 'pad')
+    
+    def __init__(self, name, align=1):
+        Node.__init__(self)
+        self.name = name
+        self.align = align
+        self.pad = 0
+    
+    def place(self, address, in_text):
+        self.pad = -address & (self.align - 1)
+        self.address = address + self.pad
+        return self.address
+    
+    def __repr__(self):
+        return f"Label({self.name!r} @ 0x{self.address:04X})"
+
+class Instruction(Node):
+    """
+    An instruction with its parsed fields. ref is the symbol reference
+    (symbol, addend, negate) stored into the immediate field, if any.
+    """
+    __slots__ = ('opcode', 'mode', 'reg1', 'reg2', 'imm', 'ref', 'word')
+    
+    def __init__(self, opcode, mode, reg1, reg2, imm, ref=None):
+        Node.__init__(self)
+        self.opcode = opcode
+        self.mode = mode
+        self.reg1 = reg1
+        self.reg2 = reg2
+        self.imm = imm
+        self.ref = ref
+        self.word = 0
+    
+    def place(self, address, in_text):
+        self.address = address
+        return address + 4
+    
+    def __repr__(self):
+        return f"Instruction({Opcode(self.opcode).name} @ 0x{self.address:04X})"
+
+class Data(Node):
+    """
+    Initialized data. value holds the bytes, align the required alignment
+    (padding before it is pad bytes) and refs the symbolic values as
+    (offset, FixupType, (symbol, addend, negate)) or None.
+    """
+    __slots__ = ('value', 'align', 'pad', 'refs')
+    
+    def __init__(self, value, align=1, refs=None):
+        Node.__init__(self)
+        self.value = value
+        self.align = align
+        self.pad = 0
+        self.refs = refs
+    
+    def place(self, address, in_text):
+        self.pad = -address & (self.align - 1)
+        self.address = address + self.pad
+        return self.address + len(self.value)
+    
+    def __repr__(self):
+        return f"Data({len(self.value)} bytes @ 0x{self.address:04X})"
+
+class Fill(Node):
+    """
+    Space from .space, .align or .org: NOP words in .text, zero bytes in
+    .data, and address space only in .bss. The size is recomputed from the
+    directive argument whenever the node is placed.
+    """
+    __slots__ = ('kind', 'arg', 'size')
+    
+    def __init__(self, kind, arg):
+        Node.__init__(self)
+        self.kind = kind
+        self.arg = arg
+        self.size = 0
+    
+    def place(self, address, in_text):
+        self.address = address
+        if self.kind == ".align":
+            size = -address & (self.arg - 1)
+        elif self.kind == ".org":
+            size = max(self.arg - address, 0)
+        else:
+            size = self.arg
+        if in_text:
+            # Code is filled with whole NOP words
+            size = (size + 3) & ~3
+        self.size = size
+        return address + size
+    
+    def __repr__(self):
+        return f"Fill({self.kind} {self.arg} @ 0x{self.address:04X})"
+
+class Alias(Node):
+    """
+    A label redirected into the storage of another node by the string pool:
+    it takes the address of target plus offset and occupies no space. It
+    always follows its target in the section.
+    """
+    __slots__ = ('name', 'target', 'offset')
+    
+    def __init__(self, name, target, offset):
+        Node.__init__(self)
+        self.name = name
+        self.target = target
+        self.offset = offset
+    
+    def place(self, address, in_text):
+        self.address = self.target.address + self.offset
+        return address
+    
+    def __repr__(self):
+        return f"Alias({self.name!r} @ 0x{self.address:04X})"
+
+class Section:
+    """A program section: its base address and IR nodes in order."""
+    __slots__ = ('name', 'base', 'nodes', 'size')
+    
+    def __init__(self, name, base):
+        self.name = name
+        self.base = base
+        self.nodes = []
+        self.size = 0
+    
+    def layout(self, labels=None):
+        """Place every node again from the section base; updates label values."""
+        address = self.base
+        in_text = self.name == ".text"
+        for node in self.nodes:
+            address = node.place(address, in_text)
+            if labels is not None and (type(node) is Label or type(node) is Alias):
+                labels[node.name] = node.address
+        self.size = address - self.base
+        return address
+
+# String pool (--merge-strings)
+#
+# Identical .asciiz strings are stored once and a string that is the tail of
+# a longer one ("\n" of "Goodbye!\n") points into it. Only strings a
+# program cannot reach by walking past a neighbour are merged: the string is
+# the only thing between its labels and the next label (or the end of the
+# section), and the data before its labels is not an unterminated .ascii
+# that runs into it.
+
+def poolable_strings(section, strings):
+    """Return [(labels, node)] for the .asciiz nodes in strings that can be merged."""
+    nodes = section.nodes
+    candidates = []
+    for i, node in enumerate(nodes):
+        if id(node) not in strings:
+            continue
+        j = i
+        while j > 0 and type(nodes[j - 1]) is Label:
+            j -= 1
+        if j == i or (i + 1 < len(nodes) and type(nodes[i + 1]) is not Label):
+            continue
+        previous = nodes[j - 1] if j > 0 else None
+        if type(previous) is Data and not previous.value.endswith(b"\0"):
+            continue
+        candidates.append((nodes[j:i], node))
+    return candidates
+
+def merge_strings(section, strings):
+    """
+    Merge the poolable strings of a section, longest first: each string
+    is kept or redirected to a kept string it ends, which may be any .asciiz
+    of the section. The labels of merged strings become Alias nodes after
+    their target. Returns (merged, poolable).
+    """
+    candidates = poolable_strings(section, strings)
+    poolable = {id(node) for _, node in candidates}
+    pool = candidates + [((), node) for node in section.nodes if id(node) in strings and id(node) not in poolable]
+    tails = {}      # Every suffix of a kept string -> (node, offset)
+    removed = set() # ids of the merged nodes and their labels
+    aliases = {}    # id of a kept node -> [Alias]
+    merged = 0
+    for labels, node in sorted(pool, key=lambda entry: (-len(entry[1].value), id(entry[1]) in poolable)):
+        value = bytes(node.value)
+        if value in tails and id(node) in poolable:
+            target, offset = tails[value]
+            removed.add(id(node))
+            merged += 1
+            for label in labels:
+                removed.add(id(label))
+                alias = Alias(label.name, target, offset)
+                alias.file, alias.line, alias.text = label.file, label.line, label.text
+                aliases.setdefault(id(target), []).append(alias)
+            continue
+        for start in range(len(value)):
+            tails.setdefault(value[start:], (node, start))
+    
+    if removed:
+        nodes = []
+        for node in section.nodes:
+            if id(node) not in removed:
+                nodes.append(node)
+                nodes.extend(aliases.get(id(node), ()))
+        section.nodes = nodes
+    return merged, len(candidates)
+
+# Data layout (--pack-data)
+#
+# A data object is a run of labels and everything after them up to the next
+# label. Every data label is normally aligned to 4 bytes; the packer gives
+# each object only the alignment its contents need (.word 2, .dword 4,
+# .align n, bytes and strings 1) and reorders the objects to avoid padding.
+# Objects named in an access profile are grouped ahead of the others,
+# hottest first where alignment allows, so they share as few cache lines
+# and pages as possible.
+
+def data_objects(section):
+    """Split a data section into (nodes before the first label, [[labels, ..., contents]])."""
+    leading = []
+    objects = []
+    for node in section.nodes:
+        if type(node) is Label and (not objects or type(objects[-1][-1]) is not Label):
+            objects.append([])
+        (objects[-1] if objects else leading).append(node)
+    return leading, objects
+
+def node_end(node):
+    """Address just past the bytes of a placed IR node."""
+    node_type = type(node)
+    if node_type is Data:
+        return node.address + len(node.value)
+    if node_type is Fill:
+        return node.address + node.size
+    if node_type is Instruction:
+        return node.address + 4
+    return node.address
+
+def object_alignment(nodes):
+    """Alignment required by the contents of a data object."""
+    align = 1
+    for node in nodes:
+        node_type = type(node)
+        if node_type is Data:
+            align = max(align, node.align)
+        elif node_type is Fill and node.kind == ".align":
+            align = max(align, node.arg)
+    return align
+
+def pack_objects(objects, address):
+    """
+    Order objects [(nodes, align, size)] from address: at each step take the
+    most aligned object that needs no padding, or pad for the most aligned
+    one left when none fits. Returns (ordered objects, end address).
+    """
+    buckets = {}
+    for obj in objects:
+        buckets.setdefault(obj[1], collections.deque()).append(obj)
+    alignments = sorted(buckets, reverse=True)
+    order = []
+    while len(order) < len(objects):
+        remaining = [align for align in alignments if buckets[align]]
+        align = next((align for align in remaining if address % align == 0), remaining[0])
+        obj = buckets[align].popleft()
+        order.append(obj)
+        address = ((address + align - 1) & -align) + obj[2]
+    return order, address
+
+def pack_data(section, profile=None):
+    """
+    Reorder the labeled objects of a data section to minimize padding, the
+    objects named in profile (name -> rank, 0 hottest) first. Objects with
+    no contents (end markers) stay at the end. Returns the number of hot
+    objects, or None if the section uses .org and cannot be reordered.
+    """
+    if any(type(node) is Fill and node.kind == ".org" for node in section.nodes):
+        return None
+    profile = profile or {}
+    leading, objects = data_objects(section)
+    address = section.base
+    for node in leading:
+        address = node.place(address, False)
+    
+    hot, cold, markers = [], [], []
+    for nodes in objects:
+        align = object_alignment(nodes)
+        size = 0
+        for node in nodes:
+            if type(node) is Label:
+                node.align = align
+            size = node.place(size, False)
+        if not any(type(node) is not Label for node in nodes):
+            markers.append(nodes)
+            continue
+        rank = min((profile[node.name] for node in nodes if type(node) is Label and node.name in profile), default=None)
+        if rank is None:
+            cold.append((nodes, align, size))
+        else:
+            hot.append((rank, len(hot), (nodes, align, size)))
+    
+    hot_order, address = pack_objects([obj for _, _, obj in sorted(hot)], address)
+    cold_order, address = pack_objects(cold, address)
+    section.nodes = leading + [node for nodes, _, _ in hot_order + cold_order for node in nodes]
+    section.nodes += [node for nodes in markers for node in nodes]
+    return len(hot)
+
+def read_data_profile(path):
+    """
+    Read a data access profile: one "label [count]" per line, '#' starts a
+    comment. Returns label -> rank, 0 for the most accessed; labels without
+    a count rank in file order after those with one.
+    """
+    counts = []
+    with open(path, 'r') as f:
+        for line in f:
+            fields = line.split('#', 1)[0].split()
+            if fields:
+                count = int(fields[1], 0) if len(fields) > 1 else -1
+                counts.append((-count if count >= 0 else 1, len(counts), fields[0]))
+    return {name: rank for rank, (_, _, name) in enumerate(sorted(counts))}
+
+def write_data_map(path, sections, profile=None):
+    """Write the layout of the data sections: one line per data object."""
+    profile = profile or {}
+    with open(path, 'w') as f:
+        for section in sections:
+            _, objects = data_objects(section)
+            size = max((node_end(node) for node in section.nodes), default=section.base) - section.base
+            padding = sum(node.pad for node in section.nodes if type(node) is Label or type(node) is Data)
+            f.write(f"{section.name}: 0x{section.base:04X}, {size} bytes, {padding} bytes of padding\n")
+            f.write("  Address   Size  Align  Pad  Hot  Symbols\n")
+            for nodes in objects:
+                labels = [node for node in nodes if type(node) is Label]
+                start = labels[0].address
+                end = max(node_end(node) for node in nodes)
+                aliases = [node.name for node in nodes if type(node) is Alias]
+                names = ", ".join(node.name for node in labels)
+                if aliases:
+                    names += " (shared: " + ", ".join(aliases) + ")"
+                hot = "*" if any(node.name in profile for node in labels) else ""
+                f.write(f"  0x{start:04X} {end - start:6d} {labels[0].align:6d} {labels[0].pad:4d}  {hot:3}  {names}\n")
+            f.write("\n")
+
+# Peephole optimizer (-O)
+#
+# Flags are tracked as a bit mask of the condition codes below. Every rewrite
+# changes some register or flag compared to the original sequence, so each
+# one is only applied when that register or flag is dead: overwritten on
+# every path before it is read. The check scans forward from the rewrite,
+# following branches to labels of this section, and assumes everything is
+# live at calls, returns, syscalls, indirect jumps and unknown instructions.
+
+FLAG_C = 1
+FLAG_Z = 2
+FLAG_N = 4
+FLAG_O = 8
+ALL_FLAGS = FLAG_C | FLAG_Z | FLAG_N | FLAG_O
+
+# Flags read by each instruction
+FLAG_READS = {
+    Opcode.JZ: FLAG_Z, Opcode.JNZ: FLAG_Z, Opcode.JN: FLAG_N, Opcode.JP: FLAG_N | FLAG_Z,
+    Opcode.JO: FLAG_O, Opcode.JC: FLAG_C, Opcode.JBE: FLAG_C | FLAG_Z, Opcode.JA: FLAG_C | FLAG_Z,
+    Opcode.ADDC: FLAG_C, Opcode.SUBC: FLAG_C, Opcode.PUSHF: ALL_FLAGS,
+}
+
+# Flags every instruction of a kind is guaranteed to overwrite. Instructions
+# missing here do not touch the flags; those not in REGISTER_EFFECTS either
+# are never looked through.
+FLAG_WRITES = {
+    Opcode.ADD: ALL_FLAGS, Opcode.SUB: ALL_FLAGS, Opcode.CMP: ALL_FLAGS,
+    Opcode.ADDC: ALL_FLAGS, Opcode.SUBC: ALL_FLAGS,
+    Opcode.MUL: FLAG_O | FLAG_Z | FLAG_N, Opcode.INC: FLAG_O | FLAG_Z | FLAG_N,
+    Opcode.DEC: FLAG_O | FLAG_Z | FLAG_N, Opcode.NEG: FLAG_O | FLAG_Z | FLAG_N,
+    Opcode.DIV: FLAG_Z | FLAG_N, Opcode.MOD: FLAG_Z | FLAG_N,
+    Opcode.AND: FLAG_Z | FLAG_N, Opcode.OR: FLAG_Z | FLAG_N, Opcode.XOR: FLAG_Z | FLAG_N,
+    Opcode.NOT: FLAG_Z | FLAG_N, Opcode.TEST: FLAG_Z | FLAG_N,
+    Opcode.SHL: FLAG_Z | FLAG_N, Opcode.SHR: FLAG_Z | FLAG_N, Opcode.SAR: FLAG_Z | FLAG_N,
+    Opcode.ROL: FLAG_Z | FLAG_N, Opcode.ROR: FLAG_Z | FLAG_N,
+}
+
+# Operations that store their result in reg1 and set Z and N from it, the
+# same way CMP reg1, #0 would
+RESULT_FLAG_OPS = frozenset((
+    Opcode.ADD, Opcode.SUB, Opcode.MUL, Opcode.DIV, Opcode.MOD, Opcode.ADDC, Opcode.SUBC,
+    Opcode.INC, Opcode.DEC, Opcode.NEG, Opcode.AND, Opcode.OR, Opcode.XOR, Opcode.NOT,
+    Opcode.SHL, Opcode.SHR, Opcode.SAR, Opcode.ROL, Opcode.ROR,
+))
+
+# How each instruction uses reg1: (reads it, writes it). The registers of the
+# source operand are read as well.
+REGISTER_EFFECTS = {
+    Opcode.NOP: (False, False),
+    Opcode.LOAD: (False, True), Opcode.LOADB: (False, True), Opcode.LOADW: (False, True),
+    Opcode.LEA: (False, True), Opcode.MOVE: (False, True),
+    Opcode.STORE: (True, False), Opcode.STOREB: (True, False), Opcode.STOREW: (True, False),
+    Opcode.CMP: (True, False), Opcode.TEST: (True, False),
+    Opcode.MEMCPY: (True, False), Opcode.MEMSET: (True, False),
+    Opcode.INC: (True, True), Opcode.DEC: (True, True), Opcode.NEG: (True, True), Opcode.NOT: (True, True),
+}
+SINGLE_OPERAND_OPS = frozenset((Opcode.INC, Opcode.DEC, Opcode.NEG, Opcode.NOT))
+JUMP_OPS = frozenset((Opcode.JMP, Opcode.JZ, Opcode.JNZ, Opcode.JN, Opcode.JP,
+                      Opcode.JO, Opcode.JC, Opcode.JBE, Opcode.JA))
+REGISTER_EFFECTS.update({opcode: (True, True) for opcode in RESULT_FLAG_OPS if opcode not in REGISTER_EFFECTS})
+REGISTER_EFFECTS.update(dict.fromkeys(JUMP_OPS, (False, False)))
+
+# Bound on the instructions visited by one liveness check
+LIVENESS_SCAN_LIMIT = 64
+
+class Peephole:
+    """
+    Rewrites the instruction nodes of a .text section in place:
+
+      LOAD Rt, #1 ; SUB Rd, Rt   ->  DEC Rd   (ADD -> INC)
+      LOAD Rd, #0 ; ADD Rd, Rs   ->  MOVE Rd, Rs
+      CALL f ; RET               ->  JMP f
+      J.. L1 ... L1: JMP L2      ->  J.. L2
+      JMP next                   ->  (removed)
+      <op> Rd, .. ; CMP Rd, #0   ->  <op> Rd, ..
+
+    Labels are never removed and no pattern spans a label. The section has
+    to be laid out again afterwards.
+    """
+    
+    def __init__(self, section):
+        self.section = section
+        self.nodes = section.nodes
+        self.targets = {}
+        self.counts = {"dec_inc": 0, "move": 0, "tail_calls": 0, "threaded": 0,
+                       "jumps": 0, "compares": 0}
+    
+    def run(self, max_rounds=8):
+        """Apply the patterns until nothing changes; returns the number of instructions removed."""
+        before = self.instruction_count()
+        for _ in range(max_rounds):
+            self.targets = {node.name: i for i, node in enumerate(self.nodes) if type(node) is Label}
+            changed = self.optimize_round()
+            self.nodes = [node for node in self.nodes if node is not None]
+            if not changed:
+                break
+        self.section.nodes = self.nodes
+        return before - self.instruction_count()
+    
+    def instruction_count(self):
+        return sum(1 for node in self.nodes if type(node) is Instruction)
+    
+    def next_index(self, i):
+        """Index of the node after i, skipping removed nodes."""
+        i += 1
+        while i < len(self.nodes) and self.nodes[i] is None:
+            i += 1
+        return i
+    
+    def next_instruction(self, i):
+        """The instruction directly following node i (no label in between), or None."""
+        j = self.next_index(i)
+        if j < len(self.nodes) and type(self.nodes[j]) is Instruction:
+            return j
+        return None
+    
+    def jump_target(self, node):
+        """Node index of the label a direct jump goes to, or None."""
+        if node.mode != AddressingMode.IMM or not node.ref:
+            return None
+        symbol, addend, negate = node.ref
+        if addend or negate:
+            return None
+        return self.targets.get(symbol)
+    
+    def first_instruction(self, i):
+        """Index of the first instruction at or after node i, looking only through labels."""
+        while i < len(self.nodes):
+            node = self.nodes[i]
+            if type(node) is Instruction:
+                return i
+            if node is not None and type(node) is not Label:
+                return None
+            i += 1
+        return None
+    
+    @staticmethod
+    def registers(node):
+        """Return (read mask, write mask) of the registers of an instruction, or None if unknown."""
+        opcode = node.opcode
+        effects = REGISTER_EFFECTS.get(opcode)
+        if effects is None:
+            return None
+        if opcode in JUMP_OPS:
+            return (0, 0) if node.mode == AddressingMode.IMM else None
+        if opcode == Opcode.NOP:
+            return 0, 0
+        
+        reads = writes = 0
+        if opcode in SINGLE_OPERAND_OPS:
+            if node.mode != AddressingMode.REG:
+                return None
+        elif node.mode in (AddressingMode.REG, AddressingMode.REGM, AddressingMode.IDX):
+            reads |= 1 << node.reg2
+        elif node.mode == AddressingMode.STK:
+            reads |= 1 << Register.R2_SP
+        elif node.mode == AddressingMode.BAS:
+            reads |= 1 << Register.R1_BP
+        
+        reads_reg1, writes_reg1 = effects
+        if reads_reg1:
+            reads |= 1 << node.reg1
+        if writes_reg1:
+            if node.reg1 == Register.R3_PC:
+                # Writing the program counter is a jump
+                return None
+            writes |= 1 << node.reg1
+        return reads, writes
+    
+    def is_dead(self, start, registers, flags):
+        """
+        True if the registers (bit mask) and flags are overwritten before
+        being read on every path starting at node index start.
+        """
+        work = [(start, registers, flags)]
+        seen = set()
+        steps = 0
+        while work:
+            i, registers, flags = work.pop()
+            while registers or flags:
+                if (i, registers, flags) in seen:
+                    break
+                seen.add((i, registers, flags))
+                steps += 1
+                if steps > LIVENESS_SCAN_LIMIT or i >= len(self.nodes):
+                    return False
+                
+                node = self.nodes[i]
+                node_type = type(node)
+                if node is None or node_type is Label:
+                    i += 1
+                    continue
+                if node_type is Fill:
+                    i += 1  # NOP words
+                    continue
+                if node_type is not Instruction:
+                    return False
+                
+                opcode = node.opcode
+                if opcode == Opcode.HALT:
+                    break
+                effects = self.registers(node)
+                if effects is None:
+                    return False
+                reads, writes = effects
+                if registers & reads or flags & FLAG_READS.get(opcode, 0):
+                    return False
+                registers &= ~writes
+                flags &= ~FLAG_WRITES.get(opcode, 0)
+                
+                if opcode in JUMP_OPS:
+                    target = self.jump_target(node)
+                    if target is None:
+                        return False
+                    if opcode == Opcode.JMP:
+                        i = target
+                        continue
+                    work.append((target, registers, flags))
+                i += 1
+        return True
+    
+    def remove(self, i):
+        self.nodes[i] = None
+    
+    def replace(self, i, opcode, mode, reg1, reg2, imm, ref=None, source=None):
+        """Replace node i with a new instruction, keeping the source location of source (default: node i)."""
+        source = source or self.nodes[i]
+        node = Instruction(opcode, mode, reg1, reg2, imm, ref)
+        node.file, node.line, node.text = source.file, source.line, source.text
+        self.nodes[i] = node
+    
+    def optimize_round(self):
+        """One pass over the section; returns True if anything changed."""
+        changed = False
+        nodes = self.nodes
+        for i in range(len(nodes)):
+            node = nodes[i]
+            if type(node) is not Instruction:
+                continue
+            opcode = node.opcode
+            
+            if opcode in JUMP_OPS or opcode == Opcode.CALL:
+                if self.thread_jump(i):
+                    changed = True
+                    continue
+            
+            j = self.next_instruction(i)
+            if j is None:
+                continue
+            following = nodes[j]
+            
+            if opcode == Opcode.LOAD and node.mode == AddressingMode.IMM and not node.ref:
+                if self.fold_constant_load(i, j):
+                    changed = True
+            elif opcode == Opcode.CALL:
+                if (following.opcode == Opcode.RET and following.mode == AddressingMode.IMM
+                        and not following.imm and not following.ref):
+                    # The callee returns straight to our caller
+                    self.replace(i, Opcode.JMP, node.mode, node.reg1, node.reg2, node.imm, node.ref)
+                    self.remove(j)
+                    self.counts["tail_calls"] += 1
+                    changed = True
+            elif opcode in RESULT_FLAG_OPS:
+                if (following.opcode == Opcode.CMP and following.mode == AddressingMode.IMM
+                        and not following.imm and not following.ref and following.reg1 == node.reg1
+                        and (opcode not in SINGLE_OPERAND_OPS or node.mode == AddressingMode.REG)
+                        and self.is_dead(self.next_index(j), 0, FLAG_C | FLAG_O)):
+                    # Z and N already describe the register; CMP would also clear C and O
+                    self.remove(j)
+                    self.counts["compares"] += 1
+                    changed = True
+        return changed
+    
+    def fold_constant_load(self, i, j):
+        """LOAD of #0 or #1 followed by an ADD or SUB of that register."""
+        load, op = self.nodes[i], self.nodes[j]
+        if op.mode != AddressingMode.REG or Register.R3_PC in (load.reg1, op.reg1):
+            return False
+        
+        if load.imm == 1 and op.opcode in (Opcode.ADD, Opcode.SUB) and op.reg2 == load.reg1 != op.reg1:
+            # INC/DEC set the same O, Z and N as ADD/SUB #1 but leave C alone,
+            # and the constant register is no longer loaded
+            if not self.is_dead(self.next_index(j), 1 << load.reg1, FLAG_C):
+                return False
+            opcode = Opcode.INC if op.opcode == Opcode.ADD else Opcode.DEC
+            self.replace(j, opcode, AddressingMode.REG, op.reg1, 0, 0)
+            self.remove(i)
+            self.counts["dec_inc"] += 1
+            return True
+        
+        if load.imm == 0 and op.opcode == Opcode.ADD and op.reg1 == load.reg1 != op.reg2:
+            # MOVE sets no flags at all
+            if not self.is_dead(self.next_index(j), 0, ALL_FLAGS):
+                return False
+            self.replace(i, Opcode.MOVE, AddressingMode.REG, op.reg1, op.reg2, 0, source=op)
+            self.remove(j)
+            self.counts["move"] += 1
+            return True
+        return False
+    
+    def thread_jump(self, i):
+        """
+        Retarget a direct jump or call whose target is another JMP; drop a
+        jump to the instruction that follows it anyway. Returns True if the
+        jump was removed.
+        """
+        node = self.nodes[i]
+        target = self.jump_target(node)
+        if target is None:
+            return False
+        
+        seen = {target}
+        while True:
+            k = self.first_instruction(target)
+            if k is None:
+                break
+            hop = self.nodes[k]
+            next_target = self.jump_target(hop) if hop.opcode == Opcode.JMP else None
+            if next_target is None or next_target in seen:
+                break
+            seen.add(next_target)
+            node.ref = hop.ref
+            target = next_target
+        if len(seen) > 1:
+            self.counts["threaded"] += 1
+        
+        if node.opcode != Opcode.CALL:
+            # Only labels between the jump and its target
+            k = self.next_index(i)
+            while k < len(self.nodes) and type(self.nodes[k]) is Label:
+                if k == target:
+                    self.remove(i)
+                    self.counts["jumps"] += 1
+                    return True
+                k = self.next_index(k)
+        return False
+
+# Precompiled patterns used by the lexer
+LABEL_RE = re.compile(r'([A-Za-z_.][A-Za-z0-9_.]*):')
+DIRECTIVE_RE = re.compile(r'\.[a-zA-Z0-9_]+')
+SYMBOL_RE = re.compile(r'[A-Za-z_.][A-Za-z0-9_.]*\Z')
+STRING_RE = re.compile(r'"((?:[^"\\]|\\.)*)"')
+FIELD_RE = re.compile(r'(?:"(?:[^"\\]|\\.)*"|[^,"])*')
+
+# Escape sequences recognised inside string literals
+STRING_ESCAPES = {'n': 10, 't': 9, 'r': 13, '0': 0, '\\': 92, '"': 34}
+
+def parse_number(text):
+    """Parse a numeric literal (decimal, 0x hex, 0b binary, 0 octal). Returns None if invalid."""
+    try:
+        if text.startswith('0x') or text.startswith('0X'):
+            return int(text, 16)
+        elif text.startswith('0b') or text.startswith('0B'):
+            return int(text, 2)
+        elif text.startswith('0') and len(text) > 1 and text[1] not in 'xXbB':
+            return int(text, 8)
+        else:
+            return int(text)
+    except ValueError:
+        return None
+
+def decode_string(body):
+    """Process escape sequences in the body of a string literal."""
+    if '\\' not in body:
+        return body.encode('latin-1')
+    result = bytearray()
+    i = 0
+    while i < len(body):
+        c = body[i]
+        if c == '\\' and i + 1 < len(body):
+            escaped = body[i + 1]
+            result.append(STRING_ESCAPES.get(escaped, ord(escaped)))
+            i += 2
+        else:
+            result.append(ord(c))
+            i += 1
+    return bytes(result)
+
+def strip_comment(line):
+    """Remove a trailing ; comment, ignoring semicolons inside string literals."""
+    pos = line.find(';')
+    if pos < 0:
+        return line
+    if '"' not in line[:pos]:
+        return line[:pos]
+    in_string = False
+    i = 0
+    while i < len(line):
+        c = line[i]
+        if in_string:
+            if c == '\\':
+                i += 1
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c == ';':
+            return line[:i]
+        i += 1
+    return line
+
+def is_register_name(text):
+    """Check whether text names a register (R<n> or an alias)."""
+    return text in REGISTER_NAMES or (text.startswith('R') and text[1:].isdigit())
+
+def classify_value(text):
+    """Classify a plain value: register, symbol, numeric literal or expression."""
+    if is_register_name(text):
+        return Token(TokenType.REGISTER, text, REGISTER_NAMES.get(text))
+    if SYMBOL_RE.match(text):
+        return Token(TokenType.SYMBOL, text, text)
+    value = parse_number(text)
+    if value is None:
+        return classify_expression(text)
+    return Token(TokenType.IMMEDIATE, text, value)
+
+def classify_expression(text, token_text=None):
+    """Parse an expression into an EXPRESSION token (INVALID, with the reason, if it does not parse)."""
+    try:
+        return Token(TokenType.EXPRESSION, token_text or text, parse_expression(text))
+    except ValueError as e:
+        return Token(TokenType.INVALID, token_text or text, str(e))
+
+@functools.lru_cache(maxsize=8192)
+def classify_operand(text):
+    """Turn a single operand or directive argument into a token."""
+    first = text[0]
+
+    # Immediate value or symbol: #123, #0xFF, #label
+    if first == '#':
+        value = text[1:]
+        if SYMBOL_RE.match(value):
+            return Token(TokenType.SYMBOL, text, value)
+        number = parse_number(value)
+        if number is None:
+            return classify_expression(value, text)
+        return Token(TokenType.IMMEDIATE, text, number)
+
+    # String literal
+    if first == '"':
+        match = STRING_RE.match(text)
+        if not match:
+            return Token(TokenType.INVALID, text)
+        return Token(TokenType.STRING, text, decode_string(match.group(1)))
+
+    # Memory bracket notation: [base], [base+offset], [base-offset]
+    if first == '[':
+        end = text.rfind(']')
+        if end < 0:
+            return Token(TokenType.INVALID, text)
+        expr = text[1:end].strip()
+        for sign, op in ((1, '+'), (-1, '-')):
+            pos = expr.find(op)
+            if pos >= 0 and is_register_name(expr[:pos].strip()):
+                base = expr[:pos].strip()
+                offset = classify_value(expr[pos + 1:].strip())
+                if offset.type == TokenType.EXPRESSION:
+                    # [R0-4+1]: the sign belongs to the first term only
+                    offset = classify_expression(expr[pos:].strip())
+                    sign = 1
+                value = (classify_value(base), sign, offset)
+                return Token(TokenType.BRACKET, text, value)
+        # [1234], [LABEL], [LABEL+4], [BUFFER+SIZE*2]
+        return Token(TokenType.BRACKET, text, (classify_value(expr), 1, None))
+
+    return classify_value(text)
+
+def split_operands(text):
+    """Split an operand list on top-level commas, keeping string literals and parentheses intact."""
+    if '(' in text or "'" in text:
+        return split_nested_operands(text)
+    if '"' not in text:
+        return [field.strip() for field in text.split(',')]
+    fields = []
+    pos = 0
+    while True:
+        match = FIELD_RE.match(text, pos)
+        pos = match.end()
+        if pos < len(text) and text[pos] == '"':
+            # Unterminated string literal: keep the rest of the line as one field
+            fields.append(text[match.start():].strip())
+            break
+        fields.append(match.group(0).strip())
+        if pos >= len(text):
+            break
+        pos += 1  # Skip the comma
+    return fields
+
+def split_nested_operands(text):
+    """Split an operand list with function calls or character literals on top-level commas."""
+    fields = []
+    start = 0
+    depth = 0
+    quote = None
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if quote:
+            if c == '\\':
+                i += 1
+            elif c == quote:
+                quote = None
+        elif c == '"' or c == "'":
+            quote = c
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == ',' and depth <= 0:
+            fields.append(text[start:i].strip())
+            start = i + 1
+        i += 1
+    fields.append(text[start:].strip())
+    return fields
+
+def tokenize_line(line):
+    """
+    Tokenize one source line in a single pass.
+    Returns a list of tokens: any LABELs, then a DIRECTIVE or MNEMONIC
+    followed by one token per operand.
+    """
+    line = strip_comment(line).strip()
+    tokens = []
+
+    # Leading label definitions
+    while line and ':' in line:
+        match = LABEL_RE.match(line)
+        if not match:
+            break
+        tokens.append(Token(TokenType.LABEL, match.group(0), match.group(1)))
+        line = line[match.end():].strip()
+
+    if not line:
+        return tokens
+
+    if line[0] == '.':
+        match = DIRECTIVE_RE.match(line)
+        if not match:
+            tokens.append(Token(TokenType.INVALID, line))
+            return tokens
+        name = match.group(0)
+        tokens.append(Token(TokenType.DIRECTIVE, name, name.lower()))
+        rest = line[match.end():].strip()
+    else:
+        parts = line.split(None, 1)
+        tokens.append(Token(TokenType.MNEMONIC, parts[0], parts[0].upper()))
+        rest = parts[1] if len(parts) > 1 else ""
+
+    if rest:
+        for field in split_operands(rest):
+            if field:
+                tokens.append(classify_operand(field))
+
+    return tokens
+
+# Constant expressions
+#
+# Operands and directive arguments that are more than a number or a symbol
+# are parsed once by the lexer into a tree of tuples: ('num', value),
+# ('sym', name), (unary_op, a), (binary_op, a, b), ('?', cond, a, b) and
+# ('call', name, args). Operators and precedence follow C.
+
+EXPRESSION_TOKEN_RE = re.compile(r"\s*(?:(\d\w*)|([A-Za-z_.][A-Za-z0-9_.]*)|'((?:\\.|[^'\\])+)'"
+                                 r"|(<<|>>|<=|>=|==|!=|[-+*/%&|^~!()<>?:,]))")
+
+# Binary operators by precedence, loosest first (the ?: operator is below all of them)
+BINARY_PRECEDENCE = {
+    '|': 1, '^': 2, '&': 3,
+    '==': 4, '!=': 4,
+    '<': 5, '>': 5, '<=': 5, '>=': 5,
+    '<<': 6, '>>': 6,
+    '+': 7, '-': 7,
+    '*': 8, '/': 8, '%': 8,
+}
+UNARY_OPERATORS = {'-': 'neg', '+': 'pos', '~': 'not', '!': 'lnot'}
+
+def crc32_entry(value):
+    """Entry of the reflected CRC-32 lookup table (polynomial 0xEDB88320) for a byte."""
+    crc = value & 0xFF
+    for _ in range(8):
+        crc = (crc >> 1) ^ (0xEDB88320 if crc & 1 else 0)
+    return crc
+
+def scaled_wave(function, x, period, scale):
+    """function(2*pi*x/period) scaled to an integer amplitude."""
+    if period == 0:
+        raise ValueError("Zero period")
+    return round(scale * function(2 * math.pi * x / period))
+
+# Functions callable in constant expressions: name -> (argument count, function)
+EXPRESSION_FUNCTIONS = {
+    "abs": (1, abs),
+    "min": (2, min),
+    "max": (2, max),
+    "sin": (3, lambda x, period, scale: scaled_wave(math.sin, x, period, scale)),
+    "cos": (3, lambda x, period, scale: scaled_wave(math.cos, x, period, scale)),
+    "crc32": (1, crc32_entry),
+}
+
+class ExpressionParser:
+    """Recursive descent parser turning the text of an expression into its tree."""
+    def __init__(self, text):
+        self.tokens = []
+        pos = 0
+        text = text.rstrip()
+        while pos < len(text):
+            match = EXPRESSION_TOKEN_RE.match(text, pos)
+            if not match:
+                raise ValueError(f"Unexpected character {text[pos:].strip()[0]!r}")
+            pos = match.end()
+            number, symbol, char, operator = match.groups()
+            if number:
+                value = parse_number(number)
+                if value is None:
+                    raise ValueError(f"Invalid number {number}")
+                self.tokens.append(('num', value))
+            elif symbol:
+                self.tokens.append(('sym', symbol))
+            elif char:
+                value = decode_string(char)
+                if len(value) != 1:
+                    raise ValueError(f"Invalid character literal '{char}'")
+                self.tokens.append(('num', value[0]))
+            else:
+                self.tokens.append(('op', operator))
+        self.pos = 0
+    
+    def parse(self):
+        """Parse the whole text; raises ValueError on a syntax error."""
+        tree = self.conditional()
+        if self.pos < len(self.tokens):
+            raise ValueError(f"Unexpected {self.tokens[self.pos][1]!r}")
+        return tree
+    
+    def peek_operator(self):
+        if self.pos < len(self.tokens) and self.tokens[self.pos][0] == 'op':
+            return self.tokens[self.pos][1]
+        return None
+    
+    def expect(self, operator):
+        if self.peek_operator() != operator:
+            raise ValueError(f"Expected {operator!r}")
+        self.pos += 1
+    
+    def conditional(self):
+        tree = self.binary(1)
+        if self.peek_operator() == '?':
+            self.pos += 1
+            if_true = self.conditional()
+            self.expect(':')
+            return ('?', tree, if_true, self.conditional())
+        return tree
+    
+    def binary(self, precedence):
+        tree = self.unary()
+        while True:
+            operator = self.peek_operator()
+            operator_precedence = BINARY_PRECEDENCE.get(operator, 0)
+            if operator_precedence < precedence:
+                return tree
+            self.pos += 1
+            tree = (operator, tree, self.binary(operator_precedence + 1))
+    
+    def unary(self):
+        operator = self.peek_operator()
+        if operator in UNARY_OPERATORS:
+            self.pos += 1
+            return (UNARY_OPERATORS[operator], self.unary())
+        return self.primary()
+    
+    def primary(self):
+        if self.pos >= len(self.tokens):
+            raise ValueError("Unexpected end of expression")
+        kind, value = self.tokens[self.pos]
+        self.pos += 1
+        if kind == 'num':
+            return ('num', value)
+        if kind == 'sym':
+            if self.peek_operator() != '(':
+                return ('sym', value)
+            # Function call
+            self.pos += 1
+            args = []
+            if self.peek_operator() != ')':
+                args.append(self.conditional())
+                while self.peek_operator() == ',':
+                    self.pos += 1
+                    args.append(self.conditional())
+            self.expect(')')
+            return ('call', value, tuple(args))
+        if value == '(':
+            tree = self.conditional()
+            self.expect(')')
+            return tree
+        raise ValueError(f"Unexpected {value!r}")
+
+def parse_expression(text):
+    """Parse the text of a constant expression into its tree; raises ValueError."""
+    return ExpressionParser(text).parse()
+
+def divide(a, b, remainder=False):
+    """C integer division and remainder: the quotient is truncated toward zero."""
+    if b == 0:
+        raise ValueError("Division by zero")
+    quotient = abs(a) // abs(b)
+    if (a < 0) != (b < 0):
+        quotient = -quotient
+    return a - quotient * b if remainder else quotient
+
+def evaluate_expression(tree, resolve):
+    """
+    Evaluate an expression tree. resolve(name) returns the value of a symbol,
+    or None to leave it symbolic (a label placed later or by the linker).
+    Returns (value, symbol, negate) meaning value + symbol, or value - symbol
+    if negate; symbol is None when the result is a constant. Only + and - can
+    be applied to a symbolic value. Raises ValueError.
+    """
+    kind = tree[0]
+    if kind == 'num':
+        return tree[1], None, False
+    if kind == 'sym':
+        value = resolve(tree[1])
+        if value is None:
+            return 0, tree[1], False
+        return value, None, False
+    
+    if kind == 'call':
+        name, args = tree[1], tree[2]
+        if name not in EXPRESSION_FUNCTIONS:
+            raise ValueError(f"Unknown function {name}()")
+        arity, function = EXPRESSION_FUNCTIONS[name]
+        if len(args) != arity:
+            raise ValueError(f"{name}() takes {arity} argument{'s' if arity > 1 else ''}")
+        return function(*(constant_operand(arg, resolve) for arg in args)), None, False
+    
+    if kind == '?':
+        condition = constant_operand(tree[1], resolve)
+        return evaluate_expression(tree[2] if condition else tree[3], resolve)
+    
+    if kind == 'neg':
+        value, symbol, negate = evaluate_expression(tree[1], resolve)
+        return -value, symbol, symbol is not None and not negate
+    if kind == 'pos':
+        return evaluate_expression(tree[1], resolve)
+    
+    if kind == '+' or kind == '-':
+        value_a, symbol_a, negate_a = evaluate_expression(tree[1], resolve)
+        value_b, symbol_b, negate_b = evaluate_expression(tree[2], resolve)
+        if kind == '-':
+            value_b, negate_b = -value_b, not negate_b
+        if symbol_a is None:
+            return value_a + value_b, symbol_b, symbol_b is not None and negate_b
+        if symbol_b is None:
+            return value_a + value_b, symbol_a, negate_a
+        if symbol_a == symbol_b and negate_a != negate_b:
+            return value_a + value_b, None, False  # label - label
+        raise ValueError(f"Cannot combine {symbol_a} and {symbol_b} before they are placed "
+                         f"(use an .equ after both labels)")
+    
+    if kind == 'not':
+        return ~constant_operand(tree[1], resolve), None, False
+    if kind == 'lnot':
+        return int(not constant_operand(tree[1], resolve)), None, False
+    
+    a = constant_operand(tree[1], resolve)
+    b = constant_operand(tree[2], resolve)
+    if kind == '*':
+        return a * b, None, False
+    if kind == '/' or kind == '%':
+        return divide(a, b, kind == '%'), None, False
+    if kind == '<<' or kind == '>>':
+        if not 0 <= b < 64:
+            raise ValueError(f"Shift count out of range: {b}")
+        return (a << b if kind == '<<' else a >> b), None, False
+    if kind == '&':
+        return a & b, None, False
+    if kind == '|':
+        return a | b, None, False
+    if kind == '^':
+        return a ^ b, None, False
+    return int({'==': a == b, '!=': a != b, '<': a < b, '>': a > b, '<=': a <= b, '>=': a >= b}[kind]), None, False
+
+def constant_operand(tree, resolve):
+    """Evaluate an operand that must be a constant."""
+    value, symbol, _ = evaluate_expression(tree, resolve)
+    if symbol is not None:
+        raise ValueError(f"{symbol} is not a constant here (only + and - can be applied to it)")
+    return value
+
+# Diagnostic verbosity levels
+class Verbosity(IntEnum):
+    QUIET = 0    # Errors only
+    NORMAL = 1   # Build summary
+    VERBOSE = 2  # Phase statistics, included files
+    TRACE = 3    # Every label and symbol
+
+class Diagnostics:
+    """
+    Collects assembler diagnostics: leveled messages, per-phase counters and
+    timings. Messages go to stderr and are only formatted when their level is
+    enabled. Counters are taken from the assembler's own tables once per phase,
+    so nothing is done per source line.
+    """
+    def __init__(self, level=Verbosity.QUIET, stream=None):
+        self.level = level
+        self.stream = stream
+        # Hot paths test these flags before building a message
+        self.verbose = level >= Verbosity.VERBOSE
+        self.trace = level >= Verbosity.TRACE
+        self.phases = {}
+        self.errors = []
+        self.warnings = []
+    
+    def reset(self):
+        """Forget the statistics of a previous run."""
+        self.phases = {}
+        self.errors = []
+        self.warnings = []
+    
+    def log(self, level, message):
+        """Print a message if the given level is enabled."""
+        if level <= self.level:
+            print(message, file=self.stream or sys.stderr)
+    
+    def error(self, message):
+        """Record and print an error; errors are shown at every level."""
+        self.errors.append(message)
+        print(f"Error: {message}", file=self.stream or sys.stderr)
+    
+    def warning(self, message):
+        """Record a warning; printed unless only errors are reported."""
+        self.warnings.append(message)
+        if self.level >= Verbosity.NORMAL:
+            print(f"Warning: {message}", file=self.stream or sys.stderr)
+    
+    @contextmanager
+    def phase(self, name):
+        """Time a phase; the yielded dict receives the phase counters."""
+        counters = {}
+        start = time.perf_counter()
+        try:
+            yield counters
+        finally:
+            counters["seconds"] = round(time.perf_counter() - start, 6)
+            self.phases[name] = counters
+            if self.verbose:
+                stats = ", ".join(f"{key}={value}" for key, value in counters.items())
+                self.log(Verbosity.VERBOSE, f"[{name}] {stats}")
+    
+    def to_dict(self):
+        """Return the collected statistics as a JSON-serializable dict."""
+        return {
+            "phases": self.phases,
+            "errors": self.errors,
+            "warnings": self.warnings,
+        }
+    
+    def write_json(self, path):
+        """Write the statistics as JSON to a file, or to stdout for '-'."""
+        text = json.dumps(self.to_dict(), indent=2)
+        if path == '-':
+            print(text)
+        else:
+            with open(path, 'w') as f:
+                f.write(text + "\n")
+
+# VM32 container (v2): a fixed header followed by a table of sections.
+#     "VM32", u16 major, u16 minor, u32 header_size, u32 entry, u32 section_count
+#     sections: u32 type, u32 address, u32 offset, u32 size
+# header_size covers the header and the section table; offsets are from the
+# start of the file. Loaders skip section types they do not know, so new
+# kinds of sections can be added without bumping the major version.
+VM32_MAGIC = b"VM32"
+VM32_VERSION = (2, 0)
+VM32_HEADER = struct.Struct("<4sHHIII")
+VM32_SECTION = struct.Struct("<IIII")
+VM32_V1_HEADER = struct.Struct("<4sHHIIIIII")
+
+class SectionType(IntEnum):
+    CODE = 1     # Loaded at its address in the code segment
+    DATA = 2     # Loaded at its address in the data segment
+    STRINGS = 3  # Debug string table
+    SYMBOLS = 4  # Debug symbols
+    LINES = 5    # Debug source line ranges
+    BUILD_ID = 6 # Identifies the build, to match a binary with its .vmdbg file
+    ZERO = 7     # Zero-filled memory (.bss, long runs of zeros): no bytes in the file
+
+# Segment sections, in memory order
+LOAD_SECTIONS = (SectionType.CODE, SectionType.DATA, SectionType.ZERO)
+
+# Runs of zero bytes at least this long are written as ZERO sections. Each
+# split adds two 16-byte section entries, so shorter runs do not pay off.
+SPARSE_MIN_ZERO_RUN = 64
+ZERO_RUN_RE = re.compile(b"\0{%d,}" % SPARSE_MIN_ZERO_RUN)
+
+DEBUG_SECTIONS = (SectionType.STRINGS, SectionType.SYMBOLS, SectionType.LINES)
+
+# Split debug information (.vmdbg): the same container with its own magic,
+# holding the BUILD_ID of the binary it belongs to and its debug sections
+VMDBG_MAGIC = b"VMDB"
+VMDBG_EXTENSION = ".vmdbg"
+BUILD_ID_SIZE = 16
+
+class DebugOutput(IntEnum):
+    EMBED = 0   # Debug sections in the binary
+    SPLIT = 1   # Debug sections in a .vmdbg file next to the binary
+    STRIP = 2   # No debug information
+
+# v1 binaries have no section table: their symbol table is reported as one
+# section of this (never written) type by parse_vm32
+LEGACY_SYMBOLS = 0xFFFF
+
+# Records of the v1 symbol tables; strings are a u16 length and the bytes
+#   v1.0: u32 count, symbols (name, u32 address, u8 type, u32 line, file),
+#         u32 count, source lines (u32 address, u32 line, text, file)
+#   v1.1: u32 count, strings; u32 count, symbols (name, u32 address, u8 type,
+#         u32 line, u32 file); u32 count, line ranges (u32 start, u32 end,
+#         u32 line, u32 text, u32 file), the u32 fields indexing the strings
+LEGACY_COUNT = struct.Struct("<I")
+LEGACY_LENGTH = struct.Struct("<H")
+LEGACY_SYMBOL = struct.Struct("<IBI")
+LEGACY_SYMBOL_V11 = struct.Struct("<IBII")
+LEGACY_LINE = struct.Struct("<II")
+LEGACY_RANGE = struct.Struct("<IIIII")
+
+def uleb128(value):
+    """Encode an unsigned integer as LEB128."""
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return out
+
+def sleb128(value):
+    """Encode a signed integer as LEB128."""
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if (value == 0 and not byte & 0x40) or (value == -1 and byte & 0x40):
+            out.append(byte)
+            return out
+        out.append(byte | 0x80)
+
+def build_debug_sections(symbols, line_ranges, diag=None):
+    """
+    Build the debug sections of a VM32 binary.
+    symbols is a sequence of (name, address, line, source_file) and
+    line_ranges a sequence of (start, end, line, source_text, source_file)
+    mapping the addresses start..end-1 to a source line.
+    
+    Returns [(SectionType, bytes)]. Every count, index and number is LEB128:
+        STRINGS: count, strings: length, bytes
+        SYMBOLS: count, symbols sorted by address:
+                 name, address - previous address, type, line, file
+        LINES:   count, ranges sorted by address:
+                 start - previous end, end - start, line - previous line (signed), text, file
+    name, text and file index the string table, which holds every symbol
+    name, source text (limited to 255 characters) and file basename once.
+    Ranges overlapping the previous one (only possible when the code runs
+    past the code segment into the data addresses) are left out.
+    """
+    trace = diag is not None and diag.trace
+    strings = {}
+    
+    def intern(text):
+        index = strings.get(text)
+        if index is None:
+            index = strings[text] = len(strings)
+        return index
+    
+    # Labels: type 0=code, 1=data
+    symbol_records = uleb128(len(symbols))
+    previous = 0
+    for name, addr, line_num, source_file_path in sorted(symbols, key=lambda symbol: symbol[1]):
+        # Use basename to avoid path encoding issues
+        basename = os.path.basename(source_file_path) if source_file_path else ""
+        if trace and basename:
+            diag.log(Verbosity.TRACE, f"Symbol {name} at 0x{addr:04X} from file {basename}")
+        symbol_records += uleb128(intern(name))
+        symbol_records += uleb128(addr - previous)
+        symbol_records += uleb128(1 if addr >= DATA_SEGMENT_BASE else 0)
+        symbol_records += uleb128(line_num)
+        symbol_records += uleb128(intern(basename))
+        previous = addr
+    
+    # Source line ranges, in address order
+    line_ranges = sorted(line_ranges)
+    ordered = []
+    previous_end = 0
+    for line_range in line_ranges:
+        if line_range[0] >= previous_end:
+            ordered.append(line_range)
+            previous_end = line_range[1]
+    range_records = uleb128(len(ordered))
+    previous_end = previous_line = 0
+    for start, end, line_num, source, source_file_path in ordered:
+        basename = os.path.basename(source_file_path) if source_file_path else ""
+        range_records += uleb128(start - previous_end)
+        range_records += uleb128(end - start)
+        range_records += sleb128(line_num - previous_line)
+        range_records += uleb128(intern(source[:255]))
+        range_records += uleb128(intern(basename))
+        previous_end, previous_line = end, line_num
+    
+    string_records = uleb128(len(strings))
+    for text in strings:
+        text_bytes = text.encode('utf-8')
+        string_records += uleb128(len(text_bytes)) + text_bytes
+    
+    sections = [(SectionType.STRINGS, string_records),
+                (SectionType.SYMBOLS, symbol_records),
+                (SectionType.LINES, range_records)]
+    
+    # Report some stats
+    if diag is not None and diag.verbose:
+        code_ranges = sum(1 for line_range in line_ranges if line_range[0] < DATA_SEGMENT_BASE)
+        diag.log(Verbosity.VERBOSE, f"Debug info: {sum(len(payload) for _, payload in sections)} bytes")
+        diag.log(Verbosity.VERBOSE, f"  - {len(strings)} strings ({len(string_records)} bytes)")
+        diag.log(Verbosity.VERBOSE, f"  - {len(symbols)} symbols ({len(symbol_records)} bytes)")
+        diag.log(Verbosity.VERBOSE, f"  - {len(line_ranges)} source line ranges "
+                                    f"({code_ranges} code, {len(line_ranges) - code_ranges} data; "
+                                    f"{len(range_records)} bytes)")
+    
+    return sections
+
+# Segment buffers: code is an array of 32-bit words, data a bytearray.
+# Both are written out with a single tobytes()/extend at output time.
+
+def new_code_buffer(blob=b""):
+    """Return a code word buffer, optionally filled from little-endian bytes."""
+    words = array('I')  # 4-byte items on every supported platform
+    words.frombytes(blob)
+    if sys.byteorder == 'big':
+        words.byteswap()
+    return words
+
+def code_to_bytes(instructions):
+    """Serialize code words (an array('I') or a list of ints) as little-endian bytes."""
+    if type(instructions) is not array or sys.byteorder == 'big':
+        instructions = array('I', instructions)
+        if sys.byteorder == 'big':
+            instructions.byteswap()
+    return instructions.tobytes()
+
+# Disassembly
+#
+# The top 12 bits of an instruction word (opcode and addressing mode) index a
+# precomputed table of 4096 format strings over (reg1, reg2, immediate), so
+# decoding a word is a table lookup and a str.format call.
+
+NO_OPERAND_OPS = frozenset((Opcode.NOP, Opcode.PUSHF, Opcode.POPF, Opcode.PUSHA, Opcode.POPA, Opcode.LEAVE,
+                            Opcode.HALT, Opcode.CLI, Opcode.STI, Opcode.IRET, Opcode.CPUID, Opcode.RESET,
+                            Opcode.DEBUG))
+SINGLE_REGISTER_OPS = frozenset((Opcode.INC, Opcode.DEC, Opcode.NEG, Opcode.NOT, Opcode.POP))
+BRANCH_OPS = frozenset((Opcode.JMP, Opcode.JZ, Opcode.JNZ, Opcode.JN, Opcode.JP, Opcode.JO, Opcode.JC, Opcode.JBE,
+                        Opcode.JA, Opcode.CALL))
+IMMEDIATE_OPS = frozenset((Opcode.ENTER, Opcode.INT, Opcode.SYSCALL))
+TWO_OPERAND_OPS = frozenset((Opcode.LOAD, Opcode.LOADB, Opcode.LOADW, Opcode.LEA, Opcode.ADD, Opcode.SUB, Opcode.MUL,
+                             Opcode.DIV, Opcode.MOD, Opcode.AND, Opcode.OR, Opcode.XOR, Opcode.SHL, Opcode.SHR,
+                             Opcode.SAR, Opcode.ROL, Opcode.ROR, Opcode.TEST, Opcode.CMP, Opcode.ADDC, Opcode.SUBC))
+BLOCK_OPS = frozenset((Opcode.MEMCPY, Opcode.MEMSET))
+STORE_OPS = frozenset((Opcode.STORE, Opcode.STOREB, Opcode.STOREW))
+
+SOURCE_OPERANDS = {
+    AddressingMode.IMM: "#{2}",
+    AddressingMode.REG: "R{1}",
+    AddressingMode.MEM: "[{2}]",
+    AddressingMode.REGM: "[R{1}]",
+    AddressingMode.IDX: "[R{1}+{2}]",
+    AddressingMode.STK: "[SP+{2}]",
+    AddressingMode.BAS: "[BP+{2}]",
+}
+JUMP_OPERANDS = {
+    AddressingMode.IMM: "#{2}",
+    AddressingMode.REG: "R{0}",
+    AddressingMode.REGM: "[R{0}]",
+    AddressingMode.IDX: "[R{0}+{2}]",
+}
+
+def operand_template(opcode, mode):
+    """Format string of the operands of an instruction, or None if they cannot be decoded."""
+    if opcode in NO_OPERAND_OPS:
+        return ""
+    if opcode in SINGLE_REGISTER_OPS:
+        return "R{0}"
+    if opcode == Opcode.RET:
+        return "#{2}"  # Left out when the immediate is 0
+    if opcode == Opcode.PUSH:
+        return "#{2}" if mode == AddressingMode.IMM else "R{0}"
+    if opcode in BRANCH_OPS:
+        return JUMP_OPERANDS.get(mode)
+    if opcode in IMMEDIATE_OPS:
+        return "#{2}"
+    if opcode == Opcode.MOVE:
+        return "R{0}, R{1}"
+    if opcode in TWO_OPERAND_OPS:
+        return "R{0}, " + SOURCE_OPERANDS.get(mode, "???")
+    if opcode in BLOCK_OPS:
+        return "R{0}, R{1}, #{2}" if mode == AddressingMode.REG else None
+    if opcode in STORE_OPS:
+        if mode in (AddressingMode.IMM, AddressingMode.REG):
+            return "R{0}, ???"
+        return "R{0}, " + SOURCE_OPERANDS.get(mode, "???")
+    return None
+
+def build_disassembly_templates():
+    """Format string of every (opcode << 4 | mode) key."""
+    names = {op.value: op.name for op in Opcode}
+    templates = []
+    for key in range(4096):
+        name = names.get(key >> 4, "???")
+        operands = operand_template(key >> 4, key & 0xF)
+        if operands is None:
+            templates.append(f"{name} ???")
+        else:
+            templates.append(f"{name} {operands}" if operands else name)
+    return templates
+
+DISASSEMBLY_TEMPLATES = build_disassembly_templates()
+IMMEDIATE_MASKS = tuple(0xFFFF if mode in WIDE_IMMEDIATE_MODES else 0xFFF for mode in range(16))
+
+def load_numpy():
+    """Return the numpy module, or None when it is not installed."""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+def decode_fields(code, numpy=None):
+    """
+    Decode little-endian code bytes into an iterable of (key, reg1, reg2,
+    immediate) per word, the key being the opcode and mode (top 12 bits).
+    With numpy the whole section is unpacked and split with vectorized
+    shifts and masks.
+    """
+    count = len(code) // 4
+    if numpy is None:
+        return ((word >> 20, (word >> 16) & 0xF, (word >> 12) & 0xF, word & IMMEDIATE_MASKS[(word >> 20) & 0xF])
+                for word in new_code_buffer(code[:count * 4]))
+    words = numpy.frombuffer(code, '<u4', count)
+    keys = words >> 20
+    immediates = words & numpy.array(IMMEDIATE_MASKS, dtype=numpy.uint32)[keys & 0xF]
+    return zip(keys.tolist(), ((words >> 16) & 0xF).tolist(), ((words >> 12) & 0xF).tolist(), immediates.tolist())
+
+def disassemble(code, start_address=0, show_addresses=True, use_numpy=True):
+    """
+    Disassemble little-endian code bytes into a list of lines, prefixed
+    with their address if requested. A trailing partial word is ignored.
+    """
+    numpy = load_numpy() if use_numpy and len(code) >= 4 else None
+    prefix = "{3:04X}: " if show_addresses else ""
+    templates = [prefix + template for template in DISASSEMBLY_TEMPLATES]
+    bare_ret = prefix + "RET"
+    ret = Opcode.RET
+    result = []
+    address = start_address
+    for key, reg1, reg2, immediate in decode_fields(code, numpy):
+        if immediate or key >> 4 != ret:
+            result.append(templates[key].format(reg1, reg2, immediate, address))
+        else:
+            result.append(bare_ret.format(reg1, reg2, immediate, address))
+        address += 4
+    return result
+
+def instruction_mix(code, use_numpy=True):
+    """Count the words of a code section by (opcode << 4 | mode) key."""
+    count = len(code) // 4
+    numpy = load_numpy() if use_numpy and count else None
+    if numpy is None:
+        return collections.Counter(word >> 20 for word in new_code_buffer(code[:count * 4]))
+    counts = numpy.bincount(numpy.frombuffer(code, '<u4', count) >> 20, minlength=4096)
+    return collections.Counter({key: n for key, n in enumerate(counts.tolist()) if n})
+
+# Static cost estimates for listings (-l), in units of one register-to-register
+# instruction. They rank instructions by the work the VM does for them: an
+# operand in memory adds a bounds-checked memory access, stack operations
+# touch the stack, DIV/MOD need a host division and syscalls call the host C
+# library and flush stdout. MEMCPY/MEMSET also scale with their size.
+MEMORY_OPERAND_MODES = frozenset((AddressingMode.MEM, AddressingMode.REGM, AddressingMode.IDX,
+                                  AddressingMode.STK, AddressingMode.BAS))
+INSTRUCTION_COSTS = {
+    Opcode.MUL: 2, Opcode.DIV: 4, Opcode.MOD: 4,
+    Opcode.PUSH: 2, Opcode.POP: 2, Opcode.PUSHF: 2, Opcode.POPF: 2, Opcode.PUSHA: 17, Opcode.POPA: 17,
+    Opcode.CALL: 2, Opcode.RET: 2, Opcode.ENTER: 3, Opcode.LEAVE: 2, Opcode.INT: 4, Opcode.IRET: 4,
+    Opcode.SYSCALL: 20, Opcode.IN: 20, Opcode.OUT: 20,
+    Opcode.ALLOC: 10, Opcode.FREE: 10, Opcode.PROTECT: 5, Opcode.MEMCPY: 3, Opcode.MEMSET: 3,
+}
+
+# Symbol values shown per data row of a listing
+LISTING_MAX_REFS = 4
+
+def instruction_cost(opcode, mode):
+    """Static cost estimate of an instruction; block operations cost more than this."""
+    cost = INSTRUCTION_COSTS.get(opcode, 1)
+    if mode in MEMORY_OPERAND_MODES:
+        cost += 1
+    return cost
+
+def pack_sections(sections, entry=CODE_SEGMENT_BASE, magic=VM32_MAGIC):
+    """
+    Write a v2 container from a list of (type, address, payload). The payload
+    of a ZERO section is its size; it takes no bytes in the file (offset 0).
+    """
+    header_size = VM32_HEADER.size + VM32_SECTION.size * len(sections)
+    binary = bytearray(VM32_HEADER.pack(magic, *VM32_VERSION, header_size, entry, len(sections)))
+    offset = header_size
+    for section_type, address, payload in sections:
+        if section_type == SectionType.ZERO:
+            binary += VM32_SECTION.pack(section_type, address, 0, payload)
+        else:
+            binary += VM32_SECTION.pack(section_type, address, offset, len(payload))
+            offset += len(payload)
+    for section_type, _, payload in sections:
+        if section_type != SectionType.ZERO:
+            binary += payload
+    return binary
+
+def sparse_sections(section_type, base, payload):
+    """
+    Split a CODE or DATA segment into sections at runs of zero bytes, which
+    become ZERO sections. Runs are cut at 4-byte boundaries so code sections
+    hold whole words.
+    """
+    sections = []
+    start = 0
+    for match in ZERO_RUN_RE.finditer(payload):
+        run_start = (match.start() + 3) & ~3
+        run_end = match.end() & ~3
+        if run_end - run_start < SPARSE_MIN_ZERO_RUN:
+            continue
+        if run_start > start:
+            sections.append((section_type, base + start, payload[start:run_start]))
+        sections.append((SectionType.ZERO, base + run_start, run_end - run_start))
+        start = run_end
+    if start < len(payload):
+        sections.append((section_type, base + start, payload[start:]))
+    return sections
+
+def build_vm32(instructions, data, debug_sections=(), bss_size=0):
+    """
+    Build a VM32 binary from code words, data bytes, optional debug sections
+    and the size of the .bss, which follows the data at a 4-byte boundary.
+    Long runs of zeros in code and data are stored as ZERO sections.
+    """
+    code = code_to_bytes(instructions)
+    sections = sparse_sections(SectionType.CODE, CODE_SEGMENT_BASE, code)
+    if not code:
+        sections.append((SectionType.CODE, CODE_SEGMENT_BASE, code))
+    sections += sparse_sections(SectionType.DATA, DATA_SEGMENT_BASE, data)
+    if bss_size:
+        sections.append((SectionType.ZERO, bss_base(len(data)), bss_size))
+    for section_type, payload in debug_sections:
+        sections.append((section_type, 0, payload))
+    return pack_sections(sections)
+
+def bss_base(data_size):
+    """Address of the .bss that follows data_size bytes of .data."""
+    return DATA_SEGMENT_BASE + ((data_size + 3) & ~3)
+
+def load_segment(sections, base, end):
+    """Rebuild the bytes of the segment base..end-1 from its CODE, DATA and ZERO sections."""
+    image = bytearray()
+    for section_type, address, payload in sections:
+        if section_type not in LOAD_SECTIONS or not base <= address < end:
+            continue
+        offset = address - base
+        size = payload if section_type == SectionType.ZERO else len(payload)
+        if len(image) < offset + size:
+            image += bytes(offset + size - len(image))
+        if section_type != SectionType.ZERO:
+            image[offset:offset + size] = payload
+    return image
+
+def parse_vm32(binary, magic=VM32_MAGIC):
+    """
+    Parse the header of a VM32 binary (v1 or v2), or of a .vmdbg file when
+    magic is VMDBG_MAGIC.
+    Returns (version, entry, [(type, address, payload)]), the payload of a
+    ZERO section being its size; raises ValueError if the binary is not a
+    VM32 file or is truncated.
+    """
+    if len(binary) < VM32_HEADER.size or binary[:4] != magic:
+        raise ValueError("not a VM32 binary" if magic == VM32_MAGIC else "not a .vmdbg file")
+    view = memoryview(binary)
+    _, major, minor, header_size, entry, count = VM32_HEADER.unpack_from(binary)
+    
+    if major < 2:
+        if len(binary) < VM32_V1_HEADER.size:
+            raise ValueError("truncated VM32 header")
+        _, _, _, header_size, code_base, code_size, data_base, data_size, symbol_size = \
+            VM32_V1_HEADER.unpack_from(binary)
+        layout = [(SectionType.CODE, code_base, code_size), (SectionType.DATA, data_base, data_size),
+                  (LEGACY_SYMBOLS, 0, symbol_size)]
+        sections = []
+        offset = header_size
+        for section_type, address, size in layout:
+            if offset + size > len(binary):
+                raise ValueError("truncated VM32 binary")
+            if size:
+                sections.append((section_type, address, view[offset:offset + size]))
+            offset += size
+        return (major, minor), code_base, sections
+    
+    if header_size < VM32_HEADER.size + VM32_SECTION.size * count or header_size > len(binary):
+        raise ValueError("invalid VM32 section table")
+    sections = []
+    for i in range(count):
+        section_type, address, offset, size = VM32_SECTION.unpack_from(binary, VM32_HEADER.size + i * VM32_SECTION.size)
+        if section_type == SectionType.ZERO:
+            sections.append((section_type, address, size))
+            continue
+        if offset + size > len(binary):
+            raise ValueError(f"section {i} extends past the end of the file")
+        sections.append((section_type, address, view[offset:offset + size]))
+    return (major, minor), entry, sections
+
+def debug_file_path(binary_path):
+    """Path of the .vmdbg file that goes with a binary."""
+    return os.path.splitext(binary_path)[0] + VMDBG_EXTENSION
+
+def apply_debug_output(binary, mode):
+    """
+    Post-process a binary with embedded debug sections for a DebugOutput mode.
+    Returns (binary, sidecar); sidecar is the .vmdbg contents for SPLIT and
+    None otherwise. A split binary keeps a BUILD_ID section (a hash of the
+    full binary) that its .vmdbg file must match.
+    """
+    if mode == DebugOutput.EMBED:
+        return binary, None
+    _, entry, sections = parse_vm32(binary)
+    program = [section for section in sections if section[0] not in DEBUG_SECTIONS]
+    debug = [section for section in sections if section[0] in DEBUG_SECTIONS]
+    if mode == DebugOutput.STRIP or not debug:
+        return pack_sections(program, entry), None
+    
+    build_id = (SectionType.BUILD_ID, 0, hashlib.sha256(binary).digest()[:BUILD_ID_SIZE])
+    return pack_sections(program + [build_id], entry), pack_sections([build_id] + debug, 0, VMDBG_MAGIC)
+
+def read_uleb128(data, pos):
+    """Decode an unsigned LEB128 value at pos; returns (value, next_pos)."""
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, pos
+
+def read_sleb128(data, pos):
+    """Decode a signed LEB128 value at pos; returns (value, next_pos)."""
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            if byte & 0x40:
+                value -= 1 << shift
+            return value, pos
+
+def decode_string_table(strings):
+    """Decode the payload of a STRINGS section into a list of strings."""
+    count, pos = read_uleb128(strings, 0)
+    table = []
+    for _ in range(count):
+        length, pos = read_uleb128(strings, pos)
+        table.append(bytes(strings[pos:pos + length]).decode('utf-8', 'replace'))
+        pos += length
+    return table
+
+def decode_symbols(symbols, table):
+    """Decode the payload of a SYMBOLS section into (name, address, line, source_file), sorted by address."""
+    decoded_symbols = []
+    if symbols:
+        count, pos = read_uleb128(symbols, 0)
+        address = 0
+        for _ in range(count):
+            name, pos = read_uleb128(symbols, pos)
+            delta, pos = read_uleb128(symbols, pos)
+            _, pos = read_uleb128(symbols, pos)  # type, implied by the address
+            line, pos = read_uleb128(symbols, pos)
+            source_file, pos = read_uleb128(symbols, pos)
+            address += delta
+            decoded_symbols.append((table[name], address, line, table[source_file]))
+    return decoded_symbols
+
+def decode_line_ranges(lines, table):
+    """Decode the payload of a LINES section into (start, end, line, source_text, source_file), sorted by address."""
+    line_ranges = []
+    if lines:
+        count, pos = read_uleb128(lines, 0)
+        end = line = 0
+        for _ in range(count):
+            gap, pos = read_uleb128(lines, pos)
+            length, pos = read_uleb128(lines, pos)
+            delta, pos = read_sleb128(lines, pos)
+            text, pos = read_uleb128(lines, pos)
+            source_file, pos = read_uleb128(lines, pos)
+            start = end + gap
+            end = start + length
+            line += delta
+            line_ranges.append((start, end, line, table[text], table[source_file]))
+    return line_ranges
+
+def decode_debug_sections(strings, symbols, lines):
+    """
+    Decode the payloads of the STRINGS, SYMBOLS and LINES sections.
+    Returns (symbols, line_ranges): symbols as (name, address, line, source_file)
+    and line_ranges as (start, end, line, source_text, source_file), both
+    sorted by address.
+    """
+    table = decode_string_table(strings)
+    return decode_symbols(symbols, table), decode_line_ranges(lines, table)
+
+def decode_legacy_debug(payload, minor):
+    """
+    Decode the symbol table of a v1.0 or v1.1 binary (a LEGACY_SYMBOLS
+    section). Returns (symbols, line_ranges) like decode_debug_sections.
+    A truncated table is decoded as far as it goes, as the VM does; a v1.0
+    source line covers only its own address, as in the VM's debugger.
+    """
+    data = bytes(payload)
+    pos = 0
+    
+    def read(record):
+        nonlocal pos
+        values = record.unpack_from(data, pos)
+        pos += record.size
+        return values
+    
+    def read_string():
+        nonlocal pos
+        length, = read(LEGACY_LENGTH)
+        if pos + length > len(data):
+            raise struct.error("truncated string")
+        pos += length
+        return data[pos - length:pos].decode('utf-8', 'replace')
+    
+    symbols = []
+    line_ranges = []
+    try:
+        if minor >= 1:
+            count, = read(LEGACY_COUNT)
+            table = []
+            for _ in range(count):
+                table.append(read_string())
+            
+            def string_at(index):
+                return table[index] if index < len(table) else ""
+            
+            count, = read(LEGACY_COUNT)
+            for _ in range(count):
+                name = read_string()
+                address, _, line, source_file = read(LEGACY_SYMBOL_V11)
+                symbols.append((name, address, line, string_at(source_file)))
+            count, = read(LEGACY_COUNT)
+            for _ in range(count):
+                start, end, line, text, source_file = read(LEGACY_RANGE)
+                line_ranges.append((start, end, line, string_at(text), string_at(source_file)))
+        else:
+            count, = read(LEGACY_COUNT)
+            for _ in range(count):
+                name = read_string()
+                address, _, line = read(LEGACY_SYMBOL)
+                symbols.append((name, address, line, read_string()))
+            count, = read(LEGACY_COUNT)
+            for _ in range(count):
+                address, line = read(LEGACY_LINE)
+                text = read_string()
+                line_ranges.append((address, address + 1, line, text, read_string()))
+    except struct.error:
+        pass
+    symbols.sort(key=lambda symbol: symbol[1])
+    line_ranges.sort(key=lambda line_range: line_range[0])
+    return symbols, line_ranges
+
+class DebugInfo:
+    """
+    Symbols and source lines of a VM32 binary for tools, read on first use
+    from the binary's debug sections or from its .vmdbg file. Symbols and
+    line ranges are decoded separately, so a tool that only needs one of
+    them does not pay for the other. The symbol table of a v1 binary holds
+    both in one record stream and is decoded in one go on first use.
+    """
+    def __init__(self, binary_path, sections=None, version=None):
+        if sections is None:
+            with open(binary_path, 'rb') as f:
+                version, _, sections = parse_vm32(f.read())
+        self.binary_path = binary_path
+        self.version = version
+        self.sections = {section_type: payload for section_type, _, payload in sections
+                         if section_type in DEBUG_SECTIONS or section_type in (SectionType.BUILD_ID, LEGACY_SYMBOLS)}
+        self._legacy = None
+        self._debug_sections = None
+        self._strings = None
+        self._symbols = None
+        self._line_ranges = None
+        self._symbol_addresses = None
+        self._range_starts = None
+    
+    @property
+    def sidecar_path(self):
+        """The .vmdbg file to read, or None when the debug sections are embedded."""
+        if SectionType.STRINGS in self.sections or SectionType.BUILD_ID not in self.sections:
+            return None
+        return debug_file_path(self.binary_path)
+    
+    def load(self):
+        """Find the debug sections, reading the .vmdbg file if needed, and decode the string table."""
+        if self._strings is not None:
+            return
+        sections = self.sections
+        sidecar = self.sidecar_path
+        if sidecar:
+            with open(sidecar, 'rb') as f:
+                _, _, debug = parse_vm32(f.read(), VMDBG_MAGIC)
+            sections = {section_type: payload for section_type, _, payload in debug}
+            if bytes(sections.get(SectionType.BUILD_ID, b"")) != bytes(self.sections[SectionType.BUILD_ID]):
+                raise ValueError(f"{sidecar} does not match {self.binary_path} (build ID differs)")
+        if SectionType.STRINGS in sections:
+            self._debug_sections = sections
+            self._strings = decode_string_table(sections[SectionType.STRINGS])
+        elif LEGACY_SYMBOLS in sections:
+            minor = self.version[1] if self.version else 0
+            self._legacy = decode_legacy_debug(sections[LEGACY_SYMBOLS], minor)
+            self._debug_sections = {}
+            self._strings = []
+        else:
+            self._debug_sections = {}
+            self._strings = []
+    
+    @property
+    def symbols(self):
+        if self._symbols is None:
+            self.load()
+            if self._legacy is not None:
+                self._symbols = self._legacy[0]
+            else:
+                self._symbols = decode_symbols(self._debug_sections.get(SectionType.SYMBOLS), self._strings)
+            self._symbol_addresses = [symbol[1] for symbol in self._symbols]
+        return self._symbols
+    
+    @property
+    def line_ranges(self):
+        if self._line_ranges is None:
+            self.load()
+            if self._legacy is not None:
+                self._line_ranges = self._legacy[1]
+            else:
+                self._line_ranges = decode_line_ranges(self._debug_sections.get(SectionType.LINES), self._strings)
+            self._range_starts = [line_range[0] for line_range in self._line_ranges]
+        return self._line_ranges
+    
+    def symbol_at(self, address):
+        """The (name, offset) of the closest symbol at or below an address, or None."""
+        symbols = self.symbols
+        index = bisect.bisect_right(self._symbol_addresses, address) - 1
+        if index < 0:
+            return None
+        name, symbol_address = symbols[index][:2]
+        return name, address - symbol_address
+    
+    def line_at(self, address):
+        """The (line, source_text, source_file) an address was assembled from, or None."""
+        line_ranges = self.line_ranges
+        index = bisect.bisect_right(self._range_starts, address) - 1
+        if index < 0 or address >= line_ranges[index][1]:
+            return None
+        return line_ranges[index][2:]
+
+def store_fixup(fixup, value, instructions, data, base=0):
+    """
+    Store a resolved symbol value directly into the field a fixup refers to.
+    base is added to the fixup's byte offset (used when linking sections).
+    Returns False if the value had to be truncated to fit the field.
+    """
+    if fixup.negate:
+        value = -value
+    value += fixup.addend
+    
+    fixup_type = fixup.type
+    offset = fixup.offset + base
+    if fixup_type == FixupType.IMM16:
+        index = offset >> 2
+        instructions[index] = (instructions[index] & 0xFFFF0000) | (value & 0xFFFF)
+        return -0x8000 <= value <= 0xFFFF
+    if fixup_type == FixupType.IMM12:
+        index = offset >> 2
+        instructions[index] = (instructions[index] & 0xFFFFF000) | (value & 0xFFF)
+        return 0 <= value <= 0xFFF
+    size = 1 if fixup_type == FixupType.DATA8 else 2 if fixup_type == FixupType.DATA16 else 4
+    data[offset:offset + size] = (value & ((1 << (size * 8)) - 1)).to_bytes(size, 'little')
+    return data_value_fits(value, size)
+
+# Relocatable object files
+OBJECT_MAGIC = b"VMOB"
+OBJECT_VERSION = 3
+OBJECT_HEADER = struct.Struct("<4sHHIIIIIIII")
+
+class SymbolSection(IntEnum):
+    UNDEF = 0   # Imported, defined by another module
+    TEXT = 1    # Offset into the module's .text
+    DATA = 2    # Offset into the module's .data
+    ABS = 3     # Absolute value (.equ)
+    BSS = 4     # Offset into the module's .bss
+
+class Binding(IntEnum):
+    LOCAL = 0   # Only visible inside its module
+    GLOBAL = 1  # Exported with .global
+
+SECTION_NAMES = {".text": SymbolSection.TEXT, ".data": SymbolSection.DATA, ".bss": SymbolSection.BSS}
+
+class ObjectFile:
+    """
+    A separately assembled module: .text and .data contents, the size of
+    its .bss, a symbol table of defined (local or exported) and imported
+    symbols, relocations against those symbols and the source line
+    information for debugging.
+    
+    Binary layout (little endian):
+        "VMOB", u16 major, u16 minor, u32 header_size,
+        u32 text_size, u32 data_size, u32 symbol_count, u32 relocation_count,
+        u32 label_line_count, u32 source_line_count, u32 bss_size
+        text, data
+        symbols:     u16 name_len, name, u8 section, u8 binding, u32 value
+        relocations: u8 section, u8 type, u8 negate, u32 offset, u32 symbol, i32 addend
+        label lines: u32 symbol, u32 line, u16 file_len, file
+        line ranges: u32 start, u32 end, u32 line, u16 text_len, text, u16 file_len, file
+    Symbol values and relocation offsets are relative to their section;
+    line range addresses use the module's own CODE/DATA_SEGMENT_BASE layout,
+    with the .bss at bss_base(data_size).
+    """
+    def __init__(self, text=b"", data=b"", symbols=None, relocations=None, label_lines=None, line_ranges=None,
+                 bss_size=0):
+        self.text = bytes(text)
+        self.data = bytes(data)
+        self.bss_size = bss_size
+        self.symbols = symbols or []            # [(name, section, binding, value)]
+        self.relocations = relocations or []    # [Fixup] against symbol names
+        self.label_lines = label_lines or {}    # name -> (line, source_file)
+        self.line_ranges = line_ranges or []    # [(start, end, line, source_text, source_file)]
+    
+    def to_bytes(self):
+        """Serialize the object file."""
+        index = {symbol[0]: i for i, symbol in enumerate(self.symbols)}
+        header = OBJECT_HEADER.pack(OBJECT_MAGIC, OBJECT_VERSION, 0, OBJECT_HEADER.size,
+                                    len(self.text), len(self.data), len(self.symbols),
+                                    len(self.relocations), len(self.label_lines), len(self.line_ranges),
+                                    self.bss_size)
+        out = bytearray(header)
+        out.extend(self.text)
+        out.extend(self.data)
+        for name, section, binding, value in self.symbols:
+            name_bytes = name.encode('utf-8')
+            out.extend(struct.pack("<H", len(name_bytes)) + name_bytes)
+            out.extend(struct.pack("<BBI", section, binding, value & 0xFFFFFFFF))
+        for fixup in self.relocations:
+            out.extend(struct.pack("<BBBIIi", SECTION_NAMES[fixup.section], fixup.type,
+                                   1 if fixup.negate else 0, fixup.offset, index[fixup.symbol], fixup.addend))
+        for name, (line, source_file) in self.label_lines.items():
+            file_bytes = os.path.basename(source_file).encode('utf-8')
+            out.extend(struct.pack("<IIH", index[name], line, len(file_bytes)) + file_bytes)
+        for start, end, line, source, source_file in self.line_ranges:
+            source_bytes = source.encode('utf-8')[:255]
+            file_bytes = source_file.encode('utf-8')
+            out.extend(struct.pack("<IIIH", start, end, line, len(source_bytes)) + source_bytes)
+            out.extend(struct.pack("<H", len(file_bytes)) + file_bytes)
+        return out
+    
+    @classmethod
+    def from_bytes(cls, blob):
+        """Parse an object file; raises ValueError if it is malformed."""
+        if len(blob) < OBJECT_HEADER.size or blob[:4] != OBJECT_MAGIC:
+            raise ValueError("not a VM object file")
+        (_, major, _, header_size, text_size, data_size, num_symbols,
+         num_relocations, num_label_lines, num_line_ranges, bss_size) = OBJECT_HEADER.unpack_from(blob)
+        if major != OBJECT_VERSION:
+            raise ValueError(f"unsupported object file version {major}")
+        
+        def read_string(pos):
+            length, = struct.unpack_from("<H", blob, pos)
+            return blob[pos + 2:pos + 2 + length].decode('utf-8'), pos + 2 + length
+        
+        try:
+            pos = header_size
+            text = blob[pos:pos + text_size]
+            pos += text_size
+            data = blob[pos:pos + data_size]
+            pos += data_size
+            
+            symbols = []
+            for _ in range(num_symbols):
+                name, pos = read_string(pos)
+                section, binding, value = struct.unpack_from("<BBI", blob, pos)
+                pos += 6
+                if section == SymbolSection.ABS and value & 0x80000000:
+                    value -= 1 << 32
+                symbols.append((name, SymbolSection(section), Binding(binding), value))
+            
+            section_names = {code: name for name, code in SECTION_NAMES.items()}
+            relocations = []
+            for _ in range(num_relocations):
+                section, fixup_type, negate, offset, symbol, addend = struct.unpack_from("<BBBIIi", blob, pos)
+                pos += 15
+                relocations.append(Fixup(FixupType(fixup_type), section_names[section], offset,
+                                         symbols[symbol][0], addend, bool(negate)))
+            
+            label_lines = {}
+            for _ in range(num_label_lines):
+                symbol, line = struct.unpack_from("<II", blob, pos)
+                source_file, pos = read_string(pos + 8)
+                label_lines[symbols[symbol][0]] = (line, source_file)
+            
+            line_ranges = []
+            for _ in range(num_line_ranges):
+                start, end, line = struct.unpack_from("<III", blob, pos)
+                source, pos = read_string(pos + 12)
+                source_file, pos = read_string(pos)
+                line_ranges.append((start, end, line, source, source_file))
+        except (struct.error, IndexError, KeyError) as e:
+            raise ValueError(f"truncated or corrupt object file ({e})")
+        
+        return cls(text, data, symbols, relocations, label_lines, line_ranges, bss_size)
+
+# Build cache settings
+CACHE_FORMAT_VERSION = 1
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+CACHE_DIR_ENV = "VMASM_CACHE_DIR"
+
+@functools.lru_cache(maxsize=None)
+def assembler_fingerprint():
+    """Hash of the assembler's own source; any change to it invalidates cached builds."""
+    with open(os.path.abspath(__file__), 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+class BuildCache:
+    """
+    Persistent content-addressed cache of assembled binaries (ccache style).
+    
+    A manifest keyed by the main source, its path and the assembler
+    version/flags lists the files pulled in through .include. The binary is
+    stored under a key that also covers the content of every one of those
+    files, so editing any file of the tree results in a miss. Files are
+    evicted least recently used first once the cache grows past max_size.
+    """
+    def __init__(self, directory, max_size=DEFAULT_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+    
+    def _path(self, kind, key, ext):
+        return os.path.join(self.directory, kind, key[:2], key + ext)
+    
+    def _write(self, path, content):
+        """Write a cache file atomically so concurrent builds never see partial entries."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return len(content)
+    
+    def manifest_key(self, input_file, source_code, flags):
+        """Key of everything known before assembly: version, flags, path and main source."""
+        h = hashlib.sha256()
+        h.update(f"{CACHE_FORMAT_VERSION}\0{assembler_fingerprint()}\0".encode())
+        h.update(json.dumps(flags, sort_keys=True).encode())
+        # Include paths resolve relative to the main file and its name ends up in the debug info
+        h.update(b"\0" + os.path.abspath(input_file).encode('utf-8') + b"\0")
+        h.update(source_code.encode('utf-8', 'surrogateescape'))
+        return h.hexdigest()
+    
+    def object_key(self, manifest_key, dependencies):
+        """Key of a binary: the manifest key plus the content of every included file."""
+        h = hashlib.sha256(manifest_key.encode())
+        for path in dependencies:
+            try:
+                with open(path, 'rb') as f:
+                    content = f.read()
+            except OSError:
+                return None
+            h.update(path.encode('utf-8') + b"\0")
+            h.update(hashlib.sha256(content).digest())
+        return h.hexdigest()
+    
+    def lookup(self, manifest_key):
+        """Return (binary, metadata) of a cached build, or None on a miss."""
+        entry = None
+        try:
+            manifest_path = self._path("manifests", manifest_key, ".json")
+            with open(manifest_path, 'r') as f:
+                manifest = json.load(f)
+            key = self.object_key(manifest_key, manifest["dependencies"])
+            if key:
+                binary_path = self._path("objects", key, ".bin")
+                meta_path = self._path("objects", key, ".json")
+                with open(binary_path, 'rb') as f:
+                    binary = bytearray(f.read())
+                with open(meta_path, 'r') as f:
+                    metadata = json.load(f)
+                # Mark the entry as recently used
+                for path in (manifest_path, binary_path, meta_path):
+                    os.utime(path)
+                entry = (binary, metadata)
+        except (OSError, ValueError, KeyError):
+            entry = None
+        
+        self._update_stats(hits=1 if entry else 0, misses=0 if entry else 1)
+        return entry
+    
+    def store(self, manifest_key, dependencies, binary, metadata):
+        """Store a freshly assembled binary and the include list it was built from."""
+        key = self.object_key(manifest_key, dependencies)
+        if key is None:
+            return False
+        
+        written = self._write(self._path("objects", key, ".bin"), bytes(binary))
+        written += self._write(self._path("objects", key, ".json"), json.dumps(metadata).encode())
+        manifest = {"dependencies": dependencies}
+        written += self._write(self._path("manifests", manifest_key, ".json"), json.dumps(manifest).encode())
+        
+        stats = self._update_stats(stores=1, size=written)
+        if stats["size"] > self.max_size:
+            self.evict()
+        return True
+    
+    def evict(self):
+        """Remove least recently used files until the cache is below 90% of max_size."""
+        files = []
+        for kind in ("manifests", "objects"):
+            for root, _, names in os.walk(os.path.join(self.directory, kind)):
+                for name in names:
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((st.st_mtime, st.st_size, path))
+        
+        files.sort()
+        size = sum(entry[1] for entry in files)
+        limit = self.max_size * 9 // 10
+        evicted = 0
+        for _, file_size, path in files:
+            if size <= limit:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            size -= file_size
+            evicted += 1
+        
+        # The scan gives the exact size; store it instead of the running total
+        stats = self.stats()
+        stats["size"] = size
+        stats["evictions"] += evicted
+        self._write(os.path.join(self.directory, "stats.json"), json.dumps(stats).encode())
+        return evicted
+    
+    def clear(self):
+        """Remove every cached entry and reset the statistics."""
+        for kind in ("manifests", "objects"):
+            for root, _, names in os.walk(os.path.join(self.directory, kind)):
+                for name in names:
+                    os.unlink(os.path.join(root, name))
+        stats_path = os.path.join(self.directory, "stats.json")
+        if os.path.exists(stats_path):
+            os.unlink(stats_path)
+    
+    def stats(self):
+        """Return the hit/miss statistics and the approximate cache size in bytes."""
+        stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "size": 0}
+        try:
+            with open(os.path.join(self.directory, "stats.json"), 'r') as f:
+                stats.update(json.load(f))
+        except (OSError, ValueError):
+            pass
+        return stats
+    
+    def _update_stats(self, **deltas):
+        # Read-modify-write; concurrent builds may occasionally lose a count
+        stats = self.stats()
+        for name, delta in deltas.items():
+            stats[name] += delta
+        self._write(os.path.join(self.directory, "stats.json"), json.dumps(stats).encode())
+        return stats
+
+class Assembler:
+    def __init__(self, diagnostics=None, cache=None, optimize=False, debug_output=DebugOutput.EMBED,
+                 merge_strings=False, pack_data=False, data_profile=None, literal_pool=True):
         self.labels = {}
-        self.instructions = []
-        self.data = []
+        self.instructions = array('I')
+        self.data = bytearray()
         self.current_section = ".text"
         self.address = CODE_SEGMENT_BASE
         self.data_address = DATA_SEGMENT_BASE
-        self.unresolved_references = []
+        self.bss_address = 0
+        self.bss_size = 0
+        self.fixups = []
         self.errors = []
         self.instruction_format = InstructionFormat()
         
+        # Program IR: section list and lookup by name. The .bss is laid out
+        # from 0 and moved after the end of .data once pass 1 is done.
+        self.sections = [Section(".text", CODE_SEGMENT_BASE), Section(".data", DATA_SEGMENT_BASE), Section(".bss", 0)]
+        self.section_map = {section.name: section for section in self.sections}
+        
         # Register names mapping
-        self.registers = {
-            "R0": 0, "ACC": 0, "R0_ACC": 0,
-            "R1": 1, "BP": 1, "R1_BP": 1,
-            "R2": 2, "SP": 2, "R2_SP": 2,
-            "R3": 3, "PC": 3, "R3_PC": 3,
-            "R4": 4, "SR": 4, "R4_SR": 4,
-            "R5": 5, "R6": 6, "R7": 7, "R8": 8, "R9": 9,
-            "R10": 10, "R11": 11, "R12": 12, "R13": 13, "R14": 14,
-            "R15": 15, "LR": 15, "R15_LR": 15
-        }
+        self.registers = REGISTER_NAMES
         
         # Opcode mapping
         self.opcodes = {op.name: op.value for op in Opcode}
@@ -311,33 +2730,62 @@ class Assembler:
         # Current line info for error messages
         self.current_file = ""
         self.current_line = 0
+        self.current_text = ""
         
         # Include file tracking to prevent circular includes
         self.included_files = set()
+        self.line_count = 0
+        self.include_count = 0
+        
+        # Files pulled in through .include, in order of first inclusion,
+        # and the include graph (including file -> files it includes)
+        self.dependencies = []
+        self.include_graph = {}
+        
+        # Relocatable output state (see assemble_object)
+        self.relocatable = False
+        self.label_sections = {}
+        self.exports = []
+        self.relocations = []
+        
+        # Diagnostics are silent unless a level is requested
+        self.diag = diagnostics or Diagnostics()
+        
+        # Optional BuildCache used by assemble_file
+        self.cache = cache
+        
+        # Run the peephole optimizer (-O) between layout and encoding. Code
+        # addresses used as constants pin the code layout and disable it.
+        self.optimize = optimize
+        self.code_layout_pinned = False
+        
+        # Pool the .asciiz strings (--merge-strings) after pass 1. Data
+        # addresses used as constants pin the data layout and disable it.
+        self.merge_strings = merge_strings
+        self.string_nodes = set()   # ids of the .asciiz Data nodes
+        self.data_layout_pinned = False
+        
+        # Reorder data objects by alignment (--pack-data), the labels of an
+        # access profile (label -> rank) first
+        self.pack_data = pack_data or bool(data_profile)
+        self.data_profile = data_profile or {}
+        
+        # Move constants too wide for their immediate field to a literal pool
+        # at the end of .data; without it they are truncated (with a warning)
+        self.literal_pool = literal_pool
+        
+        # Keys of the .dispatch tables: name -> [(key, label, file, line)]
+        self.dispatch_tables = {}
+        
+        # Where assemble_file puts the debug sections (embedded, .vmdbg or none)
+        self.debug_output = debug_output
     
     def error(self, message):
         """Report an error with current file and line info."""
         error_msg = f"{self.current_file}:{self.current_line}: {message}"
         self.errors.append(error_msg)
     
-    def encode_instruction(self, opcode, mode, reg1, reg2, immediate):
-        """Encode a VM instruction into a 32-bit value."""
-        # Ensure fields are within their bit limits
-        opcode = opcode & 0xFF        # 8 bits
-        mode = mode & 0x0F            # 4 bits
-        reg1 = reg1 & 0x0F            # 4 bits
-        
-        # If in immediate mode, split 16-bit immediate across reg2 and immediate fields
-        if mode in [AddressingMode.IMM, AddressingMode.MEM, AddressingMode.STK, AddressingMode.BAS]:
-            reg2 = (immediate >> 12) & 0xF  # High 4 bits
-            immediate = immediate & 0xFFF   # Low 12 bits
-        else:
-            reg2 = reg2 & 0x0F            # 4 bits
-            immediate = immediate & 0xFFF  # 12 bits
-        
-        # Build the instruction
-        instruction = (opcode << 24) | (mode << 20) | (reg1 << 16) | (reg2 << 12) | immediate
-        return instruction
+    encode_instruction = staticmethod(encode_instruction)
     
     def parse_register(self, token):
         """Parse a register name to its numeric value."""
@@ -354,165 +2802,172 @@ class Assembler:
         self.error(f"Invalid register: {token}")
         return 0
     
-    def parse_immediate(self, token, allow_unresolved=False):
-        """Parse an immediate value or label."""
+    def parse_immediate(self, token):
+        """Parse an immediate value or symbol whose value must already be known."""
         # Check if it's a label reference
-        if re.match(r'^[A-Za-z_.][A-Za-z0-9_.]*$', token):
-            if token in self.labels:
-                return self.labels[token]
-            elif allow_unresolved:
-                # We'll resolve this later
-                return 0  # Placeholder value
-            else:
-                self.error(f"Undefined symbol: {token}")
-                return 0
-        
-        # Try to parse numeric value
-        try:
-            # Check for different number formats
-            if token.startswith('0x') or token.startswith('0X'):
-                return int(token, 16)
-            elif token.startswith('0b') or token.startswith('0B'):
-                return int(token, 2)
-            elif token.startswith('0') and len(token) > 1 and token[1] not in 'xXbB':
-                return int(token, 8)
-            else:
-                return int(token)
-        except ValueError:
-            self.error(f"Invalid numeric value: {token}")
+        if token.type == TokenType.SYMBOL:
+            if token.value in self.labels:
+                if self.relocatable and token.value in self.label_sections:
+                    self.error(f"Relocatable symbol not allowed in a constant expression: {token.value}")
+                    return 0
+                if self.label_sections.get(token.value) == ".bss":
+                    # Placed only after the end of .data is known
+                    self.error(f".bss symbol not allowed in a constant expression: {token.value}")
+                    return 0
+                if self.label_sections.get(token.value) == ".text":
+                    self.code_layout_pinned = True
+                elif self.label_sections.get(token.value) == ".data":
+                    self.data_layout_pinned = True
+                return self.labels[token.value]
+            self.error(f"Undefined symbol: {token.value}")
             return 0
+        
+        # Numeric value already converted by the lexer
+        if token.type == TokenType.IMMEDIATE:
+            return token.value
+        
+        if token.type == TokenType.EXPRESSION:
+            return self.evaluate(token)[0]
+        
+        text = token.text[1:] if token.text.startswith('#') else token.text
+        if token.type == TokenType.INVALID and token.value:
+            self.error(f"Invalid expression: {text} ({token.value})")
+        else:
+            self.error(f"Invalid numeric value: {text}")
+        return 0
+    
+    def parse_value(self, token, sign=1):
+        """
+        Parse an immediate value or a symbol reference resolved after layout.
+        Returns (value, ref) where ref is (symbol, addend, negate) or None.
+        """
+        if token.type == TokenType.SYMBOL:
+            return 0, (token.value, 0, sign < 0)
+        if token.type == TokenType.EXPRESSION:
+            value, symbol, negate = self.evaluate(token, symbolic=True)
+            if symbol is None:
+                return value, None
+            return 0, (symbol, sign * value, negate != (sign < 0))
+        return self.parse_immediate(token), None
     
-    def parse_operand(self, operand_str, is_dest=False):
+    def evaluate(self, token, symbolic=False, variables=None):
         """
-        Parse an operand string into addressing mode and values.
-        Returns (addressing_mode, reg1, reg2, immediate)
+        Evaluate a constant expression (or a number or symbol token).
+        Symbols must already be defined unless symbolic is set, in which case
+        labels and symbols defined later are kept symbolic as long as they are
+        only added or subtracted. variables binds extra names, like the index
+        of .table. Returns (value, symbol, negate) as evaluate_expression().
         """
-        operand_str = operand_str.strip()
+        if token.type == TokenType.EXPRESSION:
+            tree = token.value
+        elif token.type == TokenType.SYMBOL:
+            tree = ('sym', token.value)
+        elif token.type == TokenType.IMMEDIATE:
+            tree = ('num', token.value)
+        else:
+            return self.parse_immediate(token), None, False
         
-        # Immediate value: #123, #0xFF
-        if operand_str.startswith('#'):
-            value = self.parse_immediate(operand_str[1:], allow_unresolved=True)
-            return AddressingMode.IMM, 0, 0, value
+        labels = self.labels
+        label_sections = self.label_sections
+        def resolve(name):
+            if variables and name in variables:
+                return variables[name]
+            if symbolic:
+                # .equ constants are folded, addresses are stored by fixups
+                if name in labels and name not in label_sections:
+                    return labels[name]
+                return None
+            return self.parse_immediate(Token(TokenType.SYMBOL, name, name))
+        
+        try:
+            return evaluate_expression(tree, resolve)
+        except ValueError as e:
+            text = token.text[1:] if token.text.startswith('#') else token.text
+            self.error(f"{e} in expression: {text}")
+            return 0, None, False
+    
+    def parse_operand(self, token, is_dest=False):
+        """
+        Parse an operand token into addressing mode and values.
+        Returns (addressing_mode, reg1, reg2, immediate, ref) where ref is the
+        symbol reference to store into the immediate field, if any.
+        """
+        # Register: R0, ACC
+        if token.type == TokenType.REGISTER:
+            return AddressingMode.REG, self.parse_register(token.text), 0, 0, None
         
         # Memory bracket notation: [expr]
-        bracket_match = re.match(r'\[(.*)\]', operand_str)
-        if bracket_match:
-            expr = bracket_match.group(1).strip()
-            
-            # Check for various forms of memory addressing
-            # Register indirect: [R0]
-            if expr in self.registers or (expr.startswith('R') and expr[1:].isdigit()):
-                reg = self.parse_register(expr)
-                
-                # Special case for SP and BP based addressing
-                if reg == Register.R2_SP:
-                    return AddressingMode.STK, 0, 0, 0
-                elif reg == Register.R1_BP:
-                    return AddressingMode.BAS, 0, 0, 0
-                else:
-                    return AddressingMode.REGM, reg, 0, 0
+        if token.type == TokenType.BRACKET:
+            base, sign, offset = token.value
             
-            # Register + offset: [R0+123], [SP+8], etc.
-            plus_match = re.match(r'(.*?)\s*\+\s*(.*)', expr)
-            if plus_match:
-                base, offset = plus_match.group(1).strip(), plus_match.group(2).strip()
-                offset_sign = 1  # Positive
+            # Register based addressing: [R0], [R0+123], [SP-8], etc.
+            if base.type == TokenType.REGISTER:
+                reg = self.parse_register(base.text)
                 
-                # Base is a register
-                if base in self.registers or (base.startswith('R') and base[1:].isdigit()):
-                    reg = self.parse_register(base)
-                    imm = self.parse_immediate(offset, allow_unresolved=True)
-                    
-                    # Special case for SP and BP based addressing
+                if offset is None:
+                    # Register indirect: [R0]
                     if reg == Register.R2_SP:
-                        return AddressingMode.STK, 0, 0, imm
+                        return AddressingMode.STK, 0, 0, 0, None
                     elif reg == Register.R1_BP:
-                        return AddressingMode.BAS, 0, 0, imm
-                    else:
-                        return AddressingMode.IDX, reg, 0, imm
-                # Base is a symbol
-                else:
-                    # Use base as a symbol and parse offset
-                    if offset.isdigit() or (offset.startswith('0x') and all(c in '0123456789abcdefABCDEF' for c in offset[2:])):
-                        # Simple numeric offset
-                        imm_offset = self.parse_immediate(offset, allow_unresolved=False)
-                        
-                        # Get the base symbol's value
-                        if base in self.labels:
-                            base_value = self.labels[base]
-                        else:
-                            # Add to unresolved references
-                            self.unresolved_references.append((len(self.instructions), base, 'imm'))
-                            base_value = 0  # Placeholder
-                        
-                        # Combine base + offset
-                        value = base_value + imm_offset
-                        return AddressingMode.MEM, 0, 0, value
+                        return AddressingMode.BAS, 0, 0, 0, None
                     else:
-                        # More complex expression - not fully supported
-                        self.error(f"Complex expressions not supported: {expr}")
-                        return AddressingMode.MEM, 0, 0, 0
-                        
-            # Register - offset: [R0-123], [SP-8], etc.
-            minus_match = re.match(r'(.*?)\s*\-\s*(.*)', expr)
-            if minus_match:
-                base, offset = minus_match.group(1).strip(), minus_match.group(2).strip()
-                offset_sign = -1  # Negative
+                        return AddressingMode.REGM, reg, 0, 0, None
                 
-                # Base is a register
-                if base in self.registers or (base.startswith('R') and base[1:].isdigit()):
-                    reg = self.parse_register(base)
-                    imm = self.parse_immediate(offset, allow_unresolved=True)
-                    
+                imm, ref = self.parse_value(offset, sign)
+                if sign < 0:
+                    imm = -imm
+                if imm < 0:
                     # For negative offsets, we need to use 2's complement for 12-bit value
                     # since the immediate field is treated as unsigned in instruction encoding
-                    neg_imm = (-imm) & 0xFFF  # Apply 2's complement in 12-bit space
-                    
-                    # Special case for SP and BP based addressing
-                    if reg == Register.R2_SP:
-                        return AddressingMode.STK, 0, 0, neg_imm
-                    elif reg == Register.R1_BP:
-                        return AddressingMode.BAS, 0, 0, neg_imm
-                    else:
-                        return AddressingMode.IDX, reg, 0, neg_imm
-                # Base is a symbol
+                    imm &= 0xFFF
+                
+                # Special case for SP and BP based addressing
+                if reg == Register.R2_SP:
+                    return AddressingMode.STK, 0, 0, imm, ref
+                elif reg == Register.R1_BP:
+                    return AddressingMode.BAS, 0, 0, imm, ref
                 else:
-                    # Use base as a symbol and parse offset
-                    if offset.isdigit() or (offset.startswith('0x') and all(c in '0123456789abcdefABCDEF' for c in offset[2:])):
-                        # Simple numeric offset
-                        imm_offset = self.parse_immediate(offset, allow_unresolved=False)
-                        
-                        # Get the base symbol's value
-                        if base in self.labels:
-                            base_value = self.labels[base]
-                        else:
-                            # Add to unresolved references
-                            self.unresolved_references.append((len(self.instructions), base, 'imm'))
-                            base_value = 0  # Placeholder
-                        
-                        # Combine base - offset
-                        value = base_value - imm_offset
-                        return AddressingMode.MEM, 0, 0, value
-                    else:
-                        # More complex expression - not fully supported
-                        self.error(f"Complex expressions not supported: {expr}")
-                        return AddressingMode.MEM, 0, 0, 0
+                    return AddressingMode.IDX, reg, 0, imm, ref
             
-            # Direct memory address: [1234], [0xFF], [LABEL]
-            value = self.parse_immediate(expr, allow_unresolved=True)
-            return AddressingMode.MEM, 0, 0, value
+            # Direct memory address: [1234], [LABEL], [LABEL+4], [TABLE+INDEX*4]
+            value, ref = self.parse_value(base)
+            return AddressingMode.MEM, 0, 0, value, ref
         
-        # Must be a register if not immediate or memory
-        if operand_str in self.registers or (operand_str.startswith('R') and operand_str[1:].isdigit()):
-            return AddressingMode.REG, self.parse_register(operand_str), 0, 0
-        
-        # Otherwise assume it's a label/immediate value without # prefix
-        value = self.parse_immediate(operand_str, allow_unresolved=True)
-        return AddressingMode.IMM, 0, 0, value
+        # Otherwise it's an immediate value or label, with or without # prefix
+        value, ref = self.parse_value(token)
+        return AddressingMode.IMM, 0, 0, value, ref
+    
+    def emit(self, node):
+        """Append an IR node to the current section and place it."""
+        node.file = self.current_file
+        node.line = self.current_line
+        node.text = self.current_text
+        if self.current_section == ".text":
+            self.address = node.place(self.address, True)
+        elif self.current_section == ".data":
+            self.data_address = node.place(self.data_address, False)
+        else:
+            self.bss_address = node.place(self.bss_address, False)
+        self.section_map[self.current_section].nodes.append(node)
+        return node
+    
+    def emit_data_values(self, values, fixup_type, size, align):
+        """Emit little-endian data values of the given size from (number, ref) pairs, recording symbolic ones."""
+        value = bytearray()
+        refs = None
+        for number, ref in values:
+            if ref:
+                if refs is None:
+                    refs = []
+                refs.append((len(value), fixup_type, ref))
+            elif not data_value_fits(number, size):
+                self.diag.warning(f"{self.current_file}:{self.current_line}: value {number} does not fit in "
+                                  f"{size * 8} bits, truncated to 0x{number & ((1 << (size * 8)) - 1):0{size * 2}X}")
+            value.extend((number & ((1 << (size * 8)) - 1)).to_bytes(size, 'little'))
+        self.emit(Data(value, align, refs))
     
     def process_directive(self, directive, args):
-        """Process an assembly directive."""
-        directive = directive.lower()
+        """Process an assembly directive. args is the list of argument tokens."""
         
         if directive == ".text":
             self.current_section = ".text"
@@ -525,6 +2980,10 @@ class Assembler:
             if self.data_address == DATA_SEGMENT_BASE:
                 self.data_address = DATA_SEGMENT_BASE
         
+        elif directive == ".bss":
+            # Uninitialized data: only labels, .space and .align, zeroed by the loader
+            self.current_section = ".bss"
+        
         elif directive == ".byte":
             if not args:
                 self.error(".byte directive requires at least one value")
@@ -535,14 +2994,7 @@ class Assembler:
                 return
             
             # Parse comma-separated values
-            for value_str in args.split(','):
-                value_str = value_str.strip()
-                if not value_str:
-                    continue
-                
-                value = self.parse_immediate(value_str, allow_unresolved=True)
-                self.data.append(value & 0xFF)  # Ensure byte size
-                self.data_address += 1
+            self.emit_data_values(map(self.parse_value, args), FixupType.DATA8, 1, 1)
         
         elif directive == ".word":
             if not args:
@@ -553,21 +3005,8 @@ class Assembler:
                 self.error(".word directive can only appear in .data section")
                 return
             
-            # Align to 2 bytes
-            if self.data_address % 2 != 0:
-                self.data.append(0)
-                self.data_address += 1
-            
-            # Parse comma-separated values
-            for value_str in args.split(','):
-                value_str = value_str.strip()
-                if not value_str:
-                    continue
-                
-                value = self.parse_immediate(value_str, allow_unresolved=True)
-                self.data.append(value & 0xFF)  # Low byte
-                self.data.append((value >> 8) & 0xFF)  # High byte
-                self.data_address += 2
+            # Parse comma-separated values, aligned to 2 bytes
+            self.emit_data_values(map(self.parse_value, args), FixupType.DATA16, 2, 2)
         
         elif directive == ".dword":
             if not args:
@@ -578,23 +3017,69 @@ class Assembler:
                 self.error(".dword directive can only appear in .data section")
                 return
             
-            # Align to 4 bytes
-            while self.data_address % 4 != 0:
-                self.data.append(0)
-                self.data_address += 1
+            # Parse comma-separated values, aligned to 4 bytes
+            self.emit_data_values(map(self.parse_value, args), FixupType.DATA32, 4, 4)
+        
+        elif directive == ".table":
+            # .table name, count, expr[, size]: a lookup table computed at assembly time
+            if len(args) not in (3, 4):
+                self.error(f"Invalid format for .table: {', '.join(token.text for token in args)}")
+                return
             
-            # Parse comma-separated values
-            for value_str in args.split(','):
-                value_str = value_str.strip()
-                if not value_str:
-                    continue
-                
-                value = self.parse_immediate(value_str, allow_unresolved=True)
-                self.data.append(value & 0xFF)  # Byte 0
-                self.data.append((value >> 8) & 0xFF)  # Byte 1
-                self.data.append((value >> 16) & 0xFF)  # Byte 2
-                self.data.append((value >> 24) & 0xFF)  # Byte 3
-                self.data_address += 4
+            if self.current_section != ".data":
+                self.error(".table directive can only appear in .data section")
+                return
+            
+            name = args[0].text
+            if not SYMBOL_RE.match(name):
+                self.error(f"Invalid symbol name: {name}")
+                return
+            
+            count = self.parse_immediate(args[1])
+            size = self.parse_immediate(args[3]) if len(args) == 4 else 4
+            fixup_type = {1: FixupType.DATA8, 2: FixupType.DATA16, 4: FixupType.DATA32}.get(size)
+            if fixup_type is None:
+                self.error(f"Table entry size must be 1, 2 or 4: {size}")
+                return
+            if not 0 < count * size <= DATA_SEGMENT_SIZE:
+                self.error(f"Invalid table size: {count} entries of {size} bytes")
+                return
+            
+            # Evaluate the expression once per entry, with i bound to the index
+            values = []
+            errors = len(self.errors)
+            for index in range(count):
+                value, symbol, negate = self.evaluate(args[2], True, {"i": index})
+                if len(self.errors) > errors:
+                    return
+                values.append((0, (symbol, value, negate)) if symbol else (value, None))
+            
+            self.label_sections[name] = ".data"
+            self.labels[name] = self.emit(Label(name, 4)).address
+            self.emit_data_values(values, fixup_type, size, size)
+        
+        elif directive == ".dispatch":
+            # .dispatch name, "key", label: one entry of a perfect hash table built after pass 1
+            if len(args) != 3:
+                self.error(f"Invalid format for .dispatch: {', '.join(token.text for token in args)}")
+                return
+            
+            name = args[0].text
+            if not SYMBOL_RE.match(name):
+                self.error(f"Invalid symbol name: {name}")
+                return
+            if args[1].type != TokenType.STRING or not args[1].value:
+                self.error(f"Invalid dispatch key: {args[1].text}")
+                return
+            if args[2].type != TokenType.SYMBOL:
+                self.error(f"Invalid dispatch target: {args[2].text}")
+                return
+            
+            entries = self.dispatch_tables.setdefault(name, [])
+            if any(key == args[1].value for key, _, _, _ in entries):
+                self.error(f"Duplicate dispatch key {args[1].text} in {name}")
+                return
+            entries.append((args[1].value, args[2].value, self.current_file, self.current_line))
         
         elif directive == ".ascii":
             if not args:
@@ -605,41 +3090,12 @@ class Assembler:
                 self.error(".ascii directive can only appear in .data section")
                 return
             
-            # Extract the string (handle quotes)
-            match = re.match(r'"([^"]*)"', args)
-            if not match:
-                self.error(f"Invalid string format for .ascii: {args}")
+            # The lexer already extracted the string and processed escape sequences
+            if args[0].type != TokenType.STRING:
+                self.error(f"Invalid string format for .ascii: {args[0].text}")
                 return
             
-            string = match.group(1)
-            
-            # Process escape sequences
-            i = 0
-            actual_bytes = 0  # Track actual bytes added to memory
-            while i < len(string):
-                if string[i] == '\\' and i + 1 < len(string):
-                    if string[i + 1] == 'n':
-                        self.data.append(ord('\n'))
-                    elif string[i + 1] == 't':
-                        self.data.append(ord('\t'))
-                    elif string[i + 1] == 'r':
-                        self.data.append(ord('\r'))
-                    elif string[i + 1] == '0':
-                        self.data.append(0)
-                    elif string[i + 1] == '\\':
-                        self.data.append(ord('\\'))
-                    elif string[i + 1] == '"':
-                        self.data.append(ord('"'))
-                    else:
-                        self.data.append(ord(string[i + 1]))
-                    i += 2  # Skip both backslash and the escape character
-                    actual_bytes += 1  # But only one byte is added to memory
-                else:
-                    self.data.append(ord(string[i]))
-                    i += 1
-                    actual_bytes += 1
-            
-            self.data_address += actual_bytes
+            self.emit(Data(args[0].value))
         
         elif directive == ".asciiz":
             if not args:
@@ -650,43 +3106,14 @@ class Assembler:
                 self.error(".asciiz directive can only appear in .data section")
                 return
             
-            # Extract the string (handle quotes)
-            match = re.match(r'"([^"]*)"', args)
-            if not match:
-                self.error(f"Invalid string format for .asciiz: {args}")
+            # The lexer already extracted the string and processed escape sequences
+            if args[0].type != TokenType.STRING:
+                self.error(f"Invalid string format for .asciiz: {args[0].text}")
                 return
             
-            string = match.group(1)
-            
-            # Process escape sequences (same as .ascii)
-            i = 0
-            actual_bytes = 0  # Track actual bytes added to memory
-            while i < len(string):
-                if string[i] == '\\' and i + 1 < len(string):
-                    if string[i + 1] == 'n':
-                        self.data.append(ord('\n'))
-                    elif string[i + 1] == 't':
-                        self.data.append(ord('\t'))
-                    elif string[i + 1] == 'r':
-                        self.data.append(ord('\r'))
-                    elif string[i + 1] == '0':
-                        self.data.append(0)
-                    elif string[i + 1] == '\\':
-                        self.data.append(ord('\\'))
-                    elif string[i + 1] == '"':
-                        self.data.append(ord('"'))
-                    else:
-                        self.data.append(ord(string[i + 1]))
-                    i += 2  # Skip both backslash and the escape character
-                    actual_bytes += 1  # But only one byte is added to memory
-                else:
-                    self.data.append(ord(string[i]))
-                    i += 1
-                    actual_bytes += 1
-            
             # Add null terminator
-            self.data.append(0)
-            self.data_address += actual_bytes + 1
+            node = self.emit(Data(args[0].value + b"\0"))
+            self.string_nodes.add(id(node))
         
         elif directive == ".space" or directive == ".skip":
             if not args:
@@ -694,28 +3121,14 @@ class Assembler:
                 return
             
             # Parse size
-            try:
-                size = self.parse_immediate(args.split()[0], allow_unresolved=False)
-            except:
-                self.error(f"Invalid size for {directive}: {args}")
-                return
+            size = self.parse_immediate(args[0])
             
             if size <= 0:
                 self.error(f"Size for {directive} must be positive: {size}")
                 return
             
-            # Fill with zeros
-            if self.current_section == ".text":
-                # Fill code section with NOP instructions (must be word-aligned)
-                size = (size + 3) & ~3  # Round up to multiple of 4
-                for _ in range(0, size, 4):
-                    self.instructions.append(0)  # NOP instruction
-                self.address += size
-            else:
-                # Fill data section with zeros
-                for _ in range(size):
-                    self.data.append(0)
-                self.data_address += size
+            # Fill with zeros (NOP instructions in the code section)
+            self.emit(Fill(".space", size))
         
         elif directive == ".align":
             if not args:
@@ -723,50 +3136,26 @@ class Assembler:
                 return
             
             # Parse alignment
-            try:
-                alignment = self.parse_immediate(args.split()[0], allow_unresolved=False)
-            except:
-                self.error(f"Invalid alignment: {args}")
-                return
+            alignment = self.parse_immediate(args[0])
             
             if alignment <= 0 or (alignment & (alignment - 1)) != 0:
-                self.error(f"Alignment must be a positive power of 2: {args}")
+                self.error(f"Alignment must be a positive power of 2: {args[0].text}")
                 return
             
-            # Calculate padding needed
-            if self.current_section == ".text":
-                current = self.address
-                aligned = (current + alignment - 1) & ~(alignment - 1)
-                padding = aligned - current
-                
-                # Add NOP instructions for padding
-                for _ in range(0, padding, 4):
-                    self.instructions.append(0)  # NOP instruction
-                self.address += padding
-            else:
-                current = self.data_address
-                aligned = (current + alignment - 1) & ~(alignment - 1)
-                padding = aligned - current
-                
-                # Add zero bytes for padding
-                for _ in range(padding):
-                    self.data.append(0)
-                self.data_address += padding
+            # Pad with zeros (NOP instructions in the code section)
+            self.emit(Fill(".align", alignment))
         
         elif directive == ".equ" or directive == ".set":
-            parts = args.split(',', 1)
-            if len(parts) != 2:
-                self.error(f"Invalid format for {directive}: {args}")
+            if len(args) != 2:
+                self.error(f"Invalid format for {directive}: {', '.join(token.text for token in args)}")
                 return
             
-            name, value_str = parts
-            name = name.strip()
-            value_str = value_str.strip()
-            if not re.match(r'^[A-Za-z_.][A-Za-z0-9_.]*$', name):
+            name = args[0].text
+            if not SYMBOL_RE.match(name):
                 self.error(f"Invalid symbol name: {name}")
                 return
             
-            value = self.parse_immediate(value_str, allow_unresolved=False)
+            value = self.parse_immediate(args[1])
             self.labels[name] = value
         
         elif directive == ".org":
@@ -775,38 +3164,45 @@ class Assembler:
                 return
             
             # Parse address
-            try:
-                address = self.parse_immediate(args.split()[0], allow_unresolved=False)
-            except:
-                self.error(f"Invalid address for .org: {args}")
-                return
+            address = self.parse_immediate(args[0])
             
             if self.current_section == ".text":
                 if address < self.address:
-                    self.error(f"Cannot move address backward: {args}")
+                    self.error(f"Cannot move address backward: {args[0].text}")
                     return
-                # Pad with NOPs to reach new address
-                while self.address < address:
-                    self.instructions.append(0)  # NOP instruction
-                    self.address += 4
+            elif self.current_section == ".bss":
+                self.error(".org directive cannot be used in .bss section")
+                return
             else:
                 if address < self.data_address:
-                    self.error(f"Cannot move data address backward: {args}")
+                    self.error(f"Cannot move data address backward: {args[0].text}")
+                    return
+            
+            # Pad to reach the new address
+            self.emit(Fill(".org", address))
+        
+        elif directive == ".global" or directive == ".globl" or directive == ".extern":
+            if not args:
+                self.error(f"{directive} directive requires at least one symbol")
+                return
+            
+            for token in args:
+                if token.type != TokenType.SYMBOL:
+                    self.error(f"Invalid symbol name: {token.text}")
                     return
-                # Pad with zeros to reach new address
-                while self.data_address < address:
-                    self.data.append(0)
-                    self.data_address += 1
+                # Exported symbols; undefined symbols are imported implicitly
+                if directive != ".extern" and token.value not in self.exports:
+                    self.exports.append(token.value)
         
         elif directive == ".include":
             if not args:
                 self.error(".include directive requires a filename")
                 return
             
-            # Extract the filename
-            match = re.match(r'"([^"]*)"', args)
+            # Extract the filename (raw, without escape processing)
+            match = STRING_RE.match(args[0].text)
             if not match:
-                self.error(f"Invalid filename format for .include: {args}")
+                self.error(f"Invalid filename format for .include: {args[0].text}")
                 return
             
             filename = match.group(1)
@@ -815,12 +3211,15 @@ class Assembler:
         else:
             self.error(f"Unknown directive: {directive}")
     
-    def process_instruction(self, opcode_str, operands_str):
-        """Process an assembly instruction."""
+    def process_instruction(self, opcode_str, operand_tokens):
+        """
+        Lay out an assembly instruction (pass 1).
+        Operands are parsed and validated and an Instruction node is emitted;
+        it is encoded by encode() (pass 2).
+        """
         if not opcode_str:
             return
         
-        opcode_str = opcode_str.upper()
         if opcode_str not in self.opcodes:
             self.error(f"Unknown opcode: {opcode_str}")
             return
@@ -830,35 +3229,10 @@ class Assembler:
         # Parse operands
         operands = []
         operand_modes = []
-        for_source = {}  # Track source label references
-        
-        if operands_str:
-            raw_operands = operands_str.split(',')
-            for i, raw_op in enumerate(raw_operands):
-                raw_op = raw_op.strip()
-                if not raw_op:
-                    continue
-                
-                # Parse the operand
-                mode, reg1, reg2, imm = self.parse_operand(raw_op, is_dest=(i==0))
-                operands.append((mode, reg1, reg2, imm))
-                operand_modes.append(mode)
-                
-                # Check if this might be a label reference in immediate mode
-                if mode == AddressingMode.IMM and re.match(r'^[A-Za-z_.][A-Za-z0-9_.]*$', raw_op.lstrip('#')):
-                    symbol = raw_op.lstrip('#')
-                    if symbol not in self.labels:
-                        for_source[i] = symbol
-                
-                # Check if this might be a label reference in memory mode
-                elif mode == AddressingMode.MEM:
-                    # Extract the expression inside brackets
-                    bracket_match = re.match(r'\[(.*)\]', raw_op)
-                    if bracket_match:
-                        expr = bracket_match.group(1).strip()
-                        # Check if it's a label
-                        if re.match(r'^[A-Za-z_.][A-Za-z0-9_.]*$', expr) and expr not in self.labels:
-                            for_source[i] = expr
+        for i, token in enumerate(operand_tokens):
+            operand = self.parse_operand(token, is_dest=(i==0))
+            operands.append(operand)
+            operand_modes.append(operand[0])
         
         # Validate instruction format
         valid, error = self.instruction_format.validate(opcode_str, operands, operand_modes)
@@ -866,37 +3240,28 @@ class Assembler:
             self.error(error)
             return
         
-        # Encode instruction based on opcode and operands
+        # Select the fields of the instruction word
         if not operands:
             # No operands (e.g., NOP, HALT)
-            instruction = self.encode_instruction(opcode, AddressingMode.IMM, 0, 0, 0)
+            fields = (AddressingMode.IMM, 0, 0, 0, None)
         
         elif len(operands) == 1:
             # Single operand instructions
-            mode, reg1, reg2, imm = operands[0]
-            instruction = self.encode_instruction(opcode, mode, reg1, reg2, imm)
-            
-            # Track unresolved references
-            if 0 in for_source:
-                self.unresolved_references.append((len(self.instructions), for_source[0], 'imm'))
+            fields = operands[0]
         
         elif len(operands) == 2:
             # Two operand instructions
-            mode1, reg1, _, _ = operands[0]
-            mode2, reg2_val, _, imm = operands[1]
+            mode1, reg1, _, _, _ = operands[0]
+            mode2, reg2_val, _, imm, ref = operands[1]
             
             # For most two-operand instructions
-            if opcode_str in ["MOVE"]:
+            if opcode_str == "MOVE":
                 # Register to register
-                instruction = self.encode_instruction(opcode, AddressingMode.REG, reg1, reg2_val, 0)
+                fields = (AddressingMode.REG, reg1, reg2_val, 0, None)
             
             elif mode1 == AddressingMode.REG:
                 # Destination is a register
-                instruction = self.encode_instruction(opcode, mode2, reg1, reg2_val, imm)
-                
-                # Track unresolved references
-                if 1 in for_source:
-                    self.unresolved_references.append((len(self.instructions), for_source[1], 'imm'))
+                fields = (mode2, reg1, reg2_val, imm, ref)
             
             else:
                 # Special case, like OUT port, value
@@ -904,90 +3269,71 @@ class Assembler:
                 return
         
         elif len(operands) == 3:
-            # Three operand instructions (like MEMCPY)
-            # These need special handling based on the opcode
-            self.error(f"Three-operand instruction {opcode_str} not fully implemented")
-            return
+            # Bulk memory operations: MEMCPY Rdest, Rsrc, size and
+            # MEMSET Rdest, Rvalue, size. REG mode keeps reg2 a register
+            # and the size in the 12-bit immediate field.
+            _, reg1, _, _, _ = operands[0]
+            _, reg2, _, _, _ = operands[1]
+            _, _, _, size, ref = operands[2]
+            if not ref and not 0 < size <= 0xFFF:
+                self.error(f"{opcode_str} size must be between 1 and 4095: {size}")
+                return
+            fields = (AddressingMode.REG, reg1, reg2, size, ref)
         
         else:
             self.error(f"Too many operands for {opcode_str}")
             return
         
-        # Add the encoded instruction
-        self.instructions.append(instruction)
-        self.address += 4
+        # The instruction word is encoded by pass 2
+        self.emit(Instruction(opcode, *fields))
     
     def process_line(self, line):
-        """Process a single line of assembly code with enhanced debug tracking."""
-        # Remove comments
-        line = re.sub(r';.*$', '', line).strip()
-        if not line:
+        """Process a single line of assembly code."""
+        tokens = tokenize_line(line)
+        if not tokens:
             return
+        self.current_text = line
         
-        # Check for label
-        label_match = re.match(r'^([A-Za-z_.][A-Za-z0-9_.]*):(.*)$', line)
-        if label_match:
-            label, remainder = label_match.groups()
+        # Handle label definitions
+        index = 0
+        while index < len(tokens) and tokens[index].type == TokenType.LABEL:
+            label = tokens[index].value
+            index += 1
             
             # Store label address
+            self.label_sections[label] = self.current_section
             if self.current_section == ".text":
-                self.labels[label] = self.address
+                node = self.emit(Label(label))
             else:
                 # For data segment, ensure labels are aligned to 4-byte boundaries
-                if self.data_address % 4 != 0:
-                    # Add padding bytes
-                    pad_needed = 4 - (self.data_address % 4)
-                    for _ in range(pad_needed):
-                        self.data.append(0)
-                    self.data_address += pad_needed
-                self.labels[label] = self.data_address
-            
-            # Store label line number and source file for debugging
-            if not hasattr(self, 'label_lines'):
-                self.label_lines = {}
-            # Save the CURRENT source file, not just "main.asm"
-            self.label_lines[label] = (self.current_line, self.current_file)
-            print(f"Label {label} from file: {self.current_file}")  # Debug print
-            
-            # Process remainder of line if any
-            remainder = remainder.strip()
-            if remainder:
-                self.process_line(remainder)
+                node = self.emit(Label(label, 4))
+            self.labels[label] = node.address
+            
+            if self.diag.trace:
+                self.diag.log(Verbosity.TRACE, f"Label {label} from file: {self.current_file}")
+        
+        if index == len(tokens):
             return
         
+        head = tokens[index]
+        operands = tokens[index + 1:]
+        
         # Check for directive
-        if line.startswith('.'):
-            directive_match = re.match(r'(\.[a-zA-Z0-9_]+)\s*(.*)', line)
-            if directive_match:
-                directive, args = directive_match.groups()
-                self.process_directive(directive, args)
-            else:
-                self.error(f"Invalid directive syntax: {line}")
+        if head.type == TokenType.DIRECTIVE:
+            self.process_directive(head.value, operands)
+            return
+        
+        if head.type == TokenType.INVALID:
+            self.error(f"Invalid directive syntax: {head.text}")
             return
         
         # Must be an instruction
         if self.current_section != ".text":
-            self.error(f"Instructions can only appear in .text section: {line}")
+            text = ", ".join(token.text for token in operands)
+            self.error(f"Instructions can only appear in .text section: {head.text} {text}".rstrip())
             return
         
-        # Split instruction into opcode and operands
-        parts = line.split(None, 1)
-        opcode = parts[0].upper()
-        operands = parts[1] if len(parts) > 1 else ""
-        
-        # Store original address for debug line info
-        orig_address = self.address
-        
-        self.process_instruction(opcode, operands)
-        
-        # Update debug info after adding the instruction
-        if not hasattr(self, 'source_lines'):
-            self.source_lines = {}
-
-        if self.address > orig_address:
-            for addr in range(orig_address, self.address, 4):
-                print(f"Storing debug line at 0x{addr:04X}: file={self.current_file}, line={line}")
-                self.source_lines[addr] = (self.current_line, line.strip(), self.current_file)
+        self.process_instruction(head.value, operands)
     
     def include_file(self, filename):
         """Process an included file with improved source tracking."""
@@ -1009,17 +3355,26 @@ class Assembler:
         
         # Mark file as included
         self.included_files.add(abs_path)
+        self.include_count += 1
+        if abs_path not in self.dependencies:
+            self.dependencies.append(abs_path)
+        edges = self.include_graph.setdefault(os.path.abspath(prev_file), [])
+        if abs_path not in edges:
+            edges.append(abs_path)
         
         try:
             # Process the included file - THIS IS KEY: set current_file to the included file
             with open(filename, 'r') as f:
                 self.current_file = abs_path  # Use absolute path for debug info
-                print(f"Including file: {filename} (as {self.current_file})")  # Debug print
+                if self.diag.verbose:
+                    self.diag.log(Verbosity.VERBOSE, f"Including file: {filename} (as {self.current_file})")
                 
+                line_num = 0
                 for line_num, line in enumerate(f, 1):
                     self.current_line = line_num
                     # Process this line with source_file set to the included file
                     self.process_line(line)
+                self.line_count += line_num
         except FileNotFoundError:
             self.error(f"Include file not found: {filename}")
         except Exception as e:
@@ -1033,221 +3388,617 @@ class Assembler:
         # Remove from included set to allow including again elsewhere
         self.included_files.remove(abs_path)
     
-    def resolve_references(self):
-        """Resolve forward references and late-bound symbols."""
-        for index, symbol, ref_type in self.unresolved_references:
-            if symbol in self.labels:
-                # Get the instruction
-                instruction = self.instructions[index]
-                
-                # Extract fields
-                opcode = (instruction >> 24) & 0xFF
-                mode = (instruction >> 20) & 0x0F
-                reg1 = (instruction >> 16) & 0x0F
-                
-                # Get symbol value
-                value = self.labels[symbol]
+    def encode(self):
+        """
+        Pass 2: walk the IR once, encoding every instruction and building the
+        code and data segments. Symbolic fields are recorded as fixups.
+        """
+        encode = self.encode_instruction
+        fixups = self.fixups
+        
+        instructions = array('I')
+        for node in self.section_map[".text"].nodes:
+            node_type = type(node)
+            if node_type is Instruction:
+                node.word = encode(node.opcode, node.mode, node.reg1, node.reg2, node.imm)
+                instructions.append(node.word)
+                if node.ref:
+                    # Symbol values are stored into the immediate field by resolve_fixups()
+                    fixup_type = FixupType.IMM16 if node.mode in WIDE_IMMEDIATE_MODES else FixupType.IMM12
+                    symbol, addend, negate = node.ref
+                    fixups.append(Fixup(fixup_type, ".text", node.address - CODE_SEGMENT_BASE,
+                                        symbol, addend, negate, node.file, node.line))
+            elif node_type is Fill:
+                instructions.frombytes(bytes(node.size))  # NOP instructions
+        
+        data = bytearray()
+        for node in self.section_map[".data"].nodes:
+            node_type = type(node)
+            if node_type is Data:
+                if node.pad:
+                    data += bytes(node.pad)
+                if node.refs:
+                    offset = node.address - DATA_SEGMENT_BASE
+                    for value_offset, fixup_type, (symbol, addend, negate) in node.refs:
+                        fixups.append(Fixup(fixup_type, ".data", offset + value_offset,
+                                            symbol, addend, negate, node.file, node.line))
+                data += node.value
+            elif node_type is Label:
+                if node.pad:
+                    data += bytes(node.pad)
+            elif node_type is Fill:
+                data += bytes(node.size)
+        
+        self.instructions = instructions
+        self.data = data
+        self.bss_size = self.section_map[".bss"].size
+    
+    def collect_debug_info(self):
+        """
+        Walk the IR to build the debug tables: label_lines maps each label to
+        (line, file) and line_ranges lists (start, end, line, source_text,
+        file_basename) for the bytes every line produced, alignment padding
+        included. Adjacent bytes from the same line share one range.
+        """
+        label_lines = {}
+        line_ranges = []
+        for section in self.sections:
+            for node in section.nodes:
+                node_type = type(node)
+                if node_type is Label:
+                    label_lines[node.name] = (node.line, node.file)
+                    start = node.address - node.pad
+                    end = node.address
+                elif node_type is Alias:
+                    label_lines[node.name] = (node.line, node.file)
+                    continue
+                elif node_type is Instruction:
+                    start = node.address
+                    end = start + 4
+                elif node_type is Data:
+                    start = node.address - node.pad
+                    end = node.address + len(node.value)
+                else:
+                    start = node.address
+                    end = start + node.size
                 
-                # Rebuild the instruction with resolved value
-                if ref_type == 'imm':
-                    new_instruction = self.encode_instruction(opcode, mode, reg1, 0, value)
-                    self.instructions[index] = new_instruction
+                if end > start:
+                    entry = (node.line, node.text.strip(), os.path.basename(node.file))
+                    last = line_ranges[-1] if line_ranges else None
+                    if last and last[1] == start and last[2:] == entry:
+                        line_ranges[-1] = (last[0], end) + entry
+                    else:
+                        line_ranges.append((start, end) + entry)
+        
+        self.label_lines = label_lines
+        self.line_ranges = line_ranges
+    
+    def apply_fixup(self, fixup, value):
+        """Store a resolved symbol value directly into the field a fixup refers to."""
+        if not store_fixup(fixup, value, self.instructions, self.data):
+            self.diag.warning(f"{fixup.file}:{fixup.line}: value of {fixup.symbol} does not fit "
+                              f"its {fixup.type.name} field and was truncated")
+    
+    def resolve_fixups(self):
+        """
+        Resolve all symbol references against the complete symbol table.
+        When assembling a relocatable object, references to labels and to
+        undefined symbols are kept as relocations for the linker instead.
+        """
+        labels = self.labels
+        for fixup in self.fixups:
+            symbol = fixup.symbol
+            if self.relocatable and (symbol in self.label_sections or symbol not in labels):
+                self.relocations.append(fixup)
+            elif symbol in labels:
+                self.apply_fixup(fixup, labels[symbol])
             else:
+                self.current_file = fixup.file
+                self.current_line = fixup.line
                 self.error(f"Unresolved symbol: {symbol}")
     
     def assemble(self, source_code, filename="<input>", include_debug=True):
         """Assemble the source code into binary with new optimized format and enhanced debug info."""
+        if not self._assemble_passes(source_code, filename, relocatable=False):
+            return None
+        
+        with self.diag.phase("emit") as phase:
+            binary = self._emit(include_debug)
+            phase["code_bytes"] = len(self.instructions) * 4
+            phase["data_bytes"] = len(self.data)
+            phase["bss_bytes"] = self.bss_size
+            phase["symbol_bytes"] = self.symbol_table_size
+            phase["total_bytes"] = len(binary)
+        return binary
+    
+    def assemble_object(self, source_code, filename="<input>"):
+        """
+        Assemble the source code into a relocatable ObjectFile.
+        Labels stay relative to their section, references to them and to
+        undefined (imported) symbols become relocations, and symbols named
+        by .global are exported to other modules.
+        """
+        if not self._assemble_passes(source_code, filename, relocatable=True):
+            return None
+        
+        for name in self.exports:
+            if name not in self.labels:
+                self.error(f"Exported symbol is not defined: {name}")
+        if self.errors:
+            for error in self.errors:
+                self.diag.error(error)
+            return None
+        
+        with self.diag.phase("emit") as phase:
+            exports = set(self.exports)
+            symbols = []
+            for name, value in self.labels.items():
+                section = SECTION_NAMES.get(self.label_sections.get(name), SymbolSection.ABS)
+                if section == SymbolSection.DATA:
+                    value -= DATA_SEGMENT_BASE
+                elif section == SymbolSection.BSS:
+                    value -= self.section_map[".bss"].base
+                binding = Binding.GLOBAL if name in exports else Binding.LOCAL
+                symbols.append((name, section, binding, value))
+            
+            # Imports, in order of first use
+            imported = set()
+            for fixup in self.relocations:
+                if fixup.symbol not in self.labels and fixup.symbol not in imported:
+                    imported.add(fixup.symbol)
+                    symbols.append((fixup.symbol, SymbolSection.UNDEF, Binding.GLOBAL, 0))
+            
+            self.collect_debug_info()
+            obj = ObjectFile(code_to_bytes(self.instructions), self.data,
+                             symbols, self.relocations, self.label_lines, self.line_ranges, self.bss_size)
+            phase["symbols"] = len(symbols)
+            phase["exports"] = len(exports)
+            phase["imports"] = len(imported)
+            phase["relocations"] = len(self.relocations)
+        return obj
+    
+    def _assemble_passes(self, source_code, filename, relocatable):
+        """Run both assembler passes; returns False (after reporting errors) on failure."""
         # Reset state
         self.labels = {}
-        self.instructions = []
-        self.data = []
+        self.instructions = array('I')
+        self.data = bytearray()
         self.current_section = ".text"
         self.address = CODE_SEGMENT_BASE
         self.data_address = DATA_SEGMENT_BASE
-        self.unresolved_references = []
+        self.bss_address = 0
+        self.bss_size = 0
+        self.sections = [Section(".text", CODE_SEGMENT_BASE), Section(".data", DATA_SEGMENT_BASE), Section(".bss", 0)]
+        self.section_map = {section.name: section for section in self.sections}
+        self.fixups = []
         self.errors = []
         self.current_file = filename
         self.included_files = set([os.path.abspath(filename)])
+        self.dependencies = []
+        self.include_graph = {}
+        self.relocatable = relocatable
+        self.label_sections = {}
+        self.exports = []
+        self.relocations = []
+        self.code_layout_pinned = False
+        self.string_nodes = set()
+        self.data_layout_pinned = False
+        self.dispatch_tables = {}
+        self.diag.reset()
+        diag = self.diag
         
-        # For enhanced debug info
-        self.source_lines = {}  # Maps address -> (line_num, source_line, source_file)
+        # Debug info, built from the IR by collect_debug_info()
+        self.line_ranges = []   # [(start, end, line_num, source_line, source_file)]
         self.label_lines = {}   # Maps label -> (line_num, source_file)
         
-        # Process each line
+        # Pass 1: lay out every line, assigning addresses to all labels
         lines = source_code.splitlines()
-        for i, line in enumerate(lines, 1):
-            self.current_line = i
-            try:
-                # Save original address before processing
-                orig_address = self.address
-                orig_data_address = self.data_address
-                
-                # Process the line
-                self.process_line(line)
-                
-                # If we added instructions, store debug info
-                if self.address > orig_address:
-                    for addr in range(orig_address, self.address, 4):
-                        file_name = os.path.basename(self.current_file)
-                        self.source_lines[addr] = (i, line.strip(), file_name)
-                
-                # If we added data, store debug info
-                if self.data_address > orig_data_address:
-                    for addr in range(orig_data_address, self.data_address):
-                        data_addr = DATA_SEGMENT_BASE + (addr - DATA_SEGMENT_BASE)
-                        file_name = os.path.basename(self.current_file)
-                        self.source_lines[data_addr] = (i, line.strip(), file_name)
-            except Exception as e:
-                self.error(f"Exception: {str(e)}")
+        self.line_count = len(lines)
+        self.include_count = 0
+        with diag.phase("layout") as phase:
+            self._layout(lines)
+            phase["lines"] = self.line_count
+            phase["includes"] = self.include_count
+            phase["labels"] = len(self.labels)
+            phase["nodes"] = sum(len(section.nodes) for section in self.sections)
+        
+        if self.dispatch_tables and not self.errors:
+            with diag.phase("dispatch") as phase:
+                self.build_dispatch_tables(phase)
+        if not self.errors:
+            with diag.phase("literals") as phase:
+                self.check_immediates(phase)
+        if self.merge_strings and not self.errors:
+            with diag.phase("strings") as phase:
+                self.merge_string_pool(phase)
+        if self.pack_data and not self.errors:
+            with diag.phase("pack") as phase:
+                self.pack_data_layout(phase)
+        self.place_bss()
+        
+        if self.optimize and not self.errors:
+            with diag.phase("optimize") as phase:
+                self.optimize_code(phase)
+        
+        # Pass 2: encode instructions against the complete symbol table
+        with diag.phase("encode") as phase:
+            self.encode()
+            phase["instructions"] = len(self.instructions)
+            phase["data_bytes"] = len(self.data)
+            phase["fixups"] = len(self.fixups)
         
-        # Resolve forward references
-        self.resolve_references()
+        with diag.phase("resolve") as phase:
+            errors_before = len(self.errors)
+            self.resolve_fixups()
+            phase["fixups"] = len(self.fixups)
+            phase["unresolved"] = len(self.errors) - errors_before
+            if relocatable:
+                phase["relocations"] = len(self.relocations)
         
         # Check for errors
         if self.errors:
             for error in self.errors:
-                print(f"Error: {error}", file=sys.stderr)
-            return None
+                diag.error(error)
+            return False
+        return True
+    
+    def optimize_code(self, phase):
+        """Run the peephole optimizer over .text and lay the section out again."""
+        section = self.section_map[".text"]
+        code_labels = {node.name for node in section.nodes if type(node) is Label}
+        for node in section.nodes:
+            if type(node) is Instruction and node.ref and node.ref[0] in code_labels and (node.ref[1] or node.ref[2]):
+                self.code_layout_pinned = True
+        for node in self.section_map[".data"].nodes:
+            if type(node) is Data and node.refs:
+                for _, _, (symbol, addend, negate) in node.refs:
+                    if symbol in code_labels and (addend or negate):
+                        self.code_layout_pinned = True
+        if self.code_layout_pinned:
+            self.diag.log(Verbosity.NORMAL, "Peephole optimizer skipped: code addresses are used as constants")
+            phase["removed"] = 0
+            return
         
-        # Build the binary output with new format
-        binary = bytearray()
+        peephole = Peephole(section)
+        removed = peephole.run()
+        self.address = section.layout(self.labels)
         
-        # Magic number "VM32" to identify our format
-        binary.extend(b"VM32")
+        phase["removed"] = removed
+        phase.update(peephole.counts)
+        details = ", ".join(f"{count} {name.replace('_', ' ')}" for name, count in peephole.counts.items() if count)
+        self.diag.log(Verbosity.NORMAL, f"Peephole optimizer removed {removed} instructions"
+                                        + (f" ({details})" if details else ""))
+    
+    def check_immediates(self, phase):
+        """
+        Find the immediates that encoding would truncate, .equ constants
+        included. Source operands of LITERAL_POOL_OPS become MEM operands
+        reading the constant from a pool of 32-bit words at the end of .data;
+        every other truncation is reported as a warning.
+        """
+        labels = self.labels
+        pool = {}
+        pooled = truncated = 0
+        for node in self.section_map[".text"].nodes:
+            if type(node) is not Instruction:
+                continue
+            value = node.imm
+            if node.ref:
+                symbol, addend, negate = node.ref
+                if symbol not in labels or symbol in self.label_sections:
+                    continue  # Addresses are resolved (and checked) later
+                value = (-labels[symbol] if negate else labels[symbol]) + addend
+            if immediate_fits(node.mode, value):
+                continue
+            
+            if self.literal_pool and node.mode == AddressingMode.IMM and node.opcode in LITERAL_POOL_OPS:
+                value &= 0xFFFFFFFF
+                if value not in pool:
+                    pool[value] = f"{LITERAL_PREFIX}{value:08X}"
+                node.mode = AddressingMode.MEM
+                node.imm = 0
+                node.ref = (pool[value], 0, False)
+                pooled += 1
+                continue
+            if node.ref:
+                continue  # Reported when the fixup is applied
+            
+            bits = 16 if node.mode in WIDE_IMMEDIATE_MODES else 12
+            stored = value & ((1 << bits) - 1)
+            self.diag.warning(f"{node.file}:{node.line}: {Opcode(node.opcode).name} immediate {value} "
+                              f"does not fit in {bits} bits, truncated to 0x{stored:0{bits // 4}X}")
+            truncated += 1
         
-        # Format version (1.0)
-        binary.extend(struct.pack("<H", 1))
-        binary.extend(struct.pack("<H", 0))
+        if pool:
+            with self.generated(".data", self.current_file, 0, "; literal pool"):
+                for value, name in pool.items():
+                    self.emit_label(name)
+                    self.emit(Data(value.to_bytes(4, 'little'), 4))
+            self.diag.log(Verbosity.VERBOSE, f"Literal pool: {len(pool)} constants for {pooled} instructions")
         
-        # Save position for header size (will fill later)
-        header_size_pos = len(binary)
-        binary.extend(struct.pack("<I", 0))  # Placeholder
+        phase["pooled"] = pooled
+        phase["constants"] = len(pool)
+        phase["truncated"] = truncated
+    
+    @contextmanager
+    def generated(self, section, file, line, text):
+        """Append nodes generated after pass 1 (literal pools, dispatch tables) to the end of a section."""
+        current = (self.current_section, self.current_file, self.current_line, self.current_text)
+        self.current_section = section
+        self.current_file, self.current_line, self.current_text = file, line, text
+        try:
+            yield
+        finally:
+            self.current_section, self.current_file, self.current_line, self.current_text = current
+    
+    def emit_label(self, name):
+        """Define a generated data label at the current address of .data."""
+        self.label_sections[name] = ".data"
+        self.labels[name] = self.emit(Label(name, 4)).address
+    
+    def build_dispatch_tables(self, phase):
+        """
+        Find a perfect hash for the keys of every .dispatch table and append
+        the table, followed by its key strings, to the end of .data. name.seed
+        and name.shift are defined as constants for the guest's hash routine.
+        """
+        slots_total = 0
+        for name, entries in self.dispatch_tables.items():
+            _, _, file, line = entries[0]
+            with self.generated(".data", file, line, f"; dispatch table {name}"):
+                slots_total += self.emit_dispatch_table(name, entries)
         
-        # Code segment info
-        code_size = len(self.instructions) * 4
-        binary.extend(struct.pack("<I", CODE_SEGMENT_BASE))  # Code segment address
-        binary.extend(struct.pack("<I", code_size))         # Code segment size
+        phase["tables"] = len(self.dispatch_tables)
+        phase["keys"] = sum(len(entries) for entries in self.dispatch_tables.values())
+        phase["slots"] = slots_total
+    
+    def emit_dispatch_table(self, name, entries):
+        """Emit one dispatch table and its keys; returns its number of slots (0 after an error)."""
+        if name in self.labels:
+            self.error(f"Dispatch table name already defined: {name}")
+            return 0
         
-        # Data segment info
-        data_size = len(self.data)
-        binary.extend(struct.pack("<I", DATA_SEGMENT_BASE))  # Data segment address
-        binary.extend(struct.pack("<I", data_size))         # Data segment size
+        hashes = {}
+        for key, _, _, _ in entries:
+            h = dispatch_hash(key)
+            if h in hashes:
+                self.error(f"Dispatch keys {hashes[h]!r} and {key.decode('latin-1')!r} of {name} hash alike")
+                return 0
+            hashes[h] = key.decode('latin-1')
+        found = perfect_hash(list(hashes))
+        if found is None:
+            self.error(f"No perfect hash found for the {len(entries)} keys of {name}")
+            return 0
+        bits, seed = found
+        shift = 32 - bits
         
-        # Symbol table info - save position for size (will fill later)
-        symbol_table_pos = len(binary)
-        binary.extend(struct.pack("<I", 0))  # Placeholder for symbol table size
+        # Every used slot points to its key string and its label
+        refs = []
+        for index, (key, label, _, _) in enumerate(entries):
+            offset = (((dispatch_hash(key) * seed) & 0xFFFFFFFF) >> shift) * DISPATCH_ENTRY_SIZE
+            refs.append((offset, FixupType.DATA32, (f"{name}.key{index}", 0, False)))
+            refs.append((offset + 4, FixupType.DATA32, (label, 0, False)))
+        refs.sort(key=lambda ref: ref[0])
         
-        # Mark end of header
-        header_size = len(binary)
+        self.emit_label(name)
+        self.emit(Data(bytes(DISPATCH_ENTRY_SIZE << bits), 4, refs))
+        for index, (key, _, file, line) in enumerate(entries):
+            self.current_file, self.current_line = file, line
+            self.emit_label(f"{name}.key{index}")
+            self.string_nodes.add(id(self.emit(Data(key + b"\0"))))
+        self.labels[f"{name}.seed"] = seed
+        self.labels[f"{name}.shift"] = shift
         
-        # Update header size field
-        binary[header_size_pos:header_size_pos+4] = struct.pack("<I", header_size)
+        self.diag.log(Verbosity.VERBOSE, f"Dispatch table {name}: {len(entries)} keys in {1 << bits} slots "
+                                         f"(seed {seed}, shift {shift})")
+        return 1 << bits
+    
+    def merge_string_pool(self, phase):
+        """Merge identical and tail-sharing strings of .data and lay the section out again."""
+        if self.data_layout_pinned:
+            self.diag.log(Verbosity.NORMAL, "String pool skipped: data addresses are used as constants")
+            phase["merged"] = 0
+            return
         
-        # Add code segment
-        for instruction in self.instructions:
-            binary.extend(struct.pack("<I", instruction))
+        section = self.section_map[".data"]
+        before = self.data_address - DATA_SEGMENT_BASE
+        merged, poolable = merge_strings(section, self.string_nodes)
+        self.data_address = section.layout(self.labels)
+        after = self.data_address - DATA_SEGMENT_BASE
         
-        # Add data segment (no padding needed)
-        binary.extend(bytes(self.data))
+        phase["strings"] = len(self.string_nodes)
+        phase["poolable"] = poolable
+        phase["merged"] = merged
+        phase["saved_bytes"] = before - after
+        self.diag.log(Verbosity.NORMAL, f"String pool merged {merged} of {poolable} strings, saving {before - after} "
+                                        f"bytes of the {DATA_SEGMENT_SIZE // 1024} KB data segment "
+                                        f"({before} -> {after} bytes)")
+    
+    def pack_data_layout(self, phase):
+        """Pack the objects of .data and .bss by alignment and lay .data out again."""
+        if self.data_layout_pinned:
+            self.diag.log(Verbosity.NORMAL, "Data packing skipped: data addresses are used as constants")
+            phase["saved_bytes"] = 0
+            return
         
-        # Add symbol table if debug info is requested
-        symbol_table_start = len(binary)
-        if include_debug:
-            symbol_table = self.generate_symbol_table()
-            binary.extend(symbol_table)
+        data = self.section_map[".data"]
+        bss = self.section_map[".bss"]
+        data_before = self.data_address - DATA_SEGMENT_BASE
+        bss_before = self.bss_address
+        hot = 0
+        for section in (data, bss):
+            section_hot = pack_data(section, self.data_profile)
+            if section_hot is None:
+                self.diag.log(Verbosity.NORMAL, f"Data packing skipped for {section.name}: it uses .org")
+            else:
+                hot += section_hot
+        self.data_address = data.layout(self.labels)
+        self.bss_address = bss.layout(self.labels)
+        data_after = self.data_address - DATA_SEGMENT_BASE
         
-        # Update symbol table size in header
-        symbol_table_size = len(binary) - symbol_table_start
-        binary[symbol_table_pos:symbol_table_pos+4] = struct.pack("<I", symbol_table_size)
+        saved = data_before + bss_before - data_after - self.bss_address
+        phase["hot_objects"] = hot
+        phase["saved_bytes"] = saved
+        self.diag.log(Verbosity.NORMAL, f"Data packing saved {saved} bytes (.data {data_before} -> {data_after}, "
+                                        f".bss {bss_before} -> {self.bss_address} bytes)"
+                                        + (f", {hot} hot objects first" if self.data_profile else ""))
+    
+    def write_map(self, path):
+        """Write the layout of .data and .bss to a map file."""
+        write_data_map(path, [self.section_map[".data"], self.section_map[".bss"]], self.data_profile)
+    
+    def describe_ref(self, ref):
+        """'symbol+addend = 0xVALUE' for a symbol reference, as resolved in this run."""
+        symbol, addend, negate = ref
+        text = ("-" if negate else "") + symbol
+        if addend:
+            text += f"{addend:+d}"
+        if symbol not in self.labels:
+            return text
+        value = (-self.labels[symbol] if negate else self.labels[symbol]) + addend
+        return f"{text} = 0x{value & 0xFFFFFFFF:04X}"
+    
+    def write_listing(self, path):
+        """
+        Write an annotated listing of the last run, straight from the IR and
+        the encoded segments: one row per node with its address, encoded
+        word (or first data bytes), static cost, source location and text,
+        and the value of any symbol it refers to. The instructions under
+        each .text label are totalled at the end of the block.
+        """
+        rows = []
+        for section in self.sections:
+            if not section.nodes:
+                continue
+            in_text = section.name == ".text"
+            size = max(node_end(node) for node in section.nodes) - section.base
+            rows.append(f"{section.name} at 0x{section.base:04X}, {size} bytes")
+            rows.append("Addr  Word      Cost  Location            Source")
+            block = [None, 0, 0, False]  # label, instructions, cost, size-dependent
+            
+            def close_block():
+                label, count, cost, variable = block
+                if count:
+                    rows.append(f"{'':26}; {label or section.name}: {count} instruction{'s' if count > 1 else ''}, "
+                                f"cost {cost}{'+' if variable else ''}")
+            
+            last_source = None
+            for node in section.nodes:
+                node_type = type(node)
+                if node_type is Label or node_type is Alias:
+                    if in_text and node_type is Label:
+                        close_block()
+                        block[:] = [node.name, 0, 0, False]
+                    shared = f"  ; shares {node.target.text.strip()!r}" if node_type is Alias else ""
+                    rows.append(f"{node.address:04X}{'':22}{node.name}:{shared}")
+                    continue
+                
+                source = (node.file, node.line)
+                location = f"{os.path.basename(node.file)}:{node.line}" if node.line else "(generated)"
+                text = node.text.strip() if source != last_source else ""
+                last_source = source
+                if node_type is Instruction:
+                    word = self.instructions[(node.address - CODE_SEGMENT_BASE) >> 2]
+                    cost = instruction_cost(node.opcode, node.mode)
+                    variable = node.opcode in BLOCK_OPS
+                    block[1] += 1
+                    block[2] += cost
+                    block[3] = block[3] or variable
+                    row = f"{node.address:04X}  {word:08X}  {cost:>3}{'+' if variable else ' '}  {location:<18}  {text}"
+                    if node.ref:
+                        row = f"{row:<72}  ; {self.describe_ref(node.ref)}"
+                elif node_type is Data:
+                    offset = node.address - DATA_SEGMENT_BASE if not in_text else node.address - CODE_SEGMENT_BASE
+                    stored = self.data[offset:offset + len(node.value)] if not in_text else node.value
+                    notes = [f"{len(node.value)} bytes"] if len(node.value) > 4 else []
+                    refs = node.refs or ()
+                    notes += [self.describe_ref(ref) for _, _, ref in refs[:LISTING_MAX_REFS]]
+                    if len(refs) > LISTING_MAX_REFS:
+                        notes.append(f"{len(refs) - LISTING_MAX_REFS} more symbols")
+                    row = f"{node.address:04X}  {bytes(stored[:4]).hex().upper():<8}  {'':4}  {location:<18}  {text}"
+                    if notes:
+                        row = f"{row:<72}  ; {', '.join(notes)}"
+                else:
+                    row = f"{node.address:04X}  {'':8}  {'':4}  {location:<18}  {text}"
+                    row = f"{row:<72}  ; {node.size} bytes"
+                rows.append(row)
+            if in_text:
+                close_block()
+            rows.append("")
         
-        return binary
+        with open(path, 'w') as f:
+            f.write("\n".join(rows) + "\n")
+    
+    def _layout(self, lines):
+        """Pass 1 over the top-level source lines, building the IR."""
+        for i, line in enumerate(lines, 1):
+            self.current_line = i
+            try:
+                self.process_line(line)
+            except Exception as e:
+                self.error(f"Exception: {str(e)}")
+    
+    def place_bss(self):
+        """Move the .bss after the end of .data, updating its labels."""
+        section = self.section_map[".bss"]
+        section.base = bss_base(self.data_address - DATA_SEGMENT_BASE)
+        self.bss_address = section.layout(self.labels)
+    
+    def _emit(self, include_debug):
+        """Build the VM32 binary from the encoded segments."""
+        debug_sections = self.generate_debug_sections() if include_debug else []
+        self.symbol_table_size = sum(len(payload) for _, payload in debug_sections)
+        return build_vm32(self.instructions, self.data, debug_sections, self.bss_size)
 
-    def generate_symbol_table(self):
-        """Generate a symbol table for debugging information with enhanced source tracking."""
-        symbol_table = bytearray()
-        
-        # Number of labels
-        num_labels = len(self.labels)
-        symbol_table.extend(struct.pack("<I", num_labels))
-        
-        # Add each label
+    def generate_debug_sections(self):
+        """Generate the debug sections (strings, symbols and source line ranges)."""
+        self.collect_debug_info()
+        symbols = []
         for name, addr in self.labels.items():
-            # Label name
-            name_bytes = name.encode('utf-8')
-            symbol_table.extend(struct.pack("<H", len(name_bytes)))
-            symbol_table.extend(name_bytes)
-            
-            # Label address
-            symbol_table.extend(struct.pack("<I", addr))
-            
-            # Label type (0=code, 1=data)
-            is_data = addr >= DATA_SEGMENT_BASE
-            symbol_table.extend(struct.pack("<B", 1 if is_data else 0))
-            
-            # Line number
-            line_num = 0
-            source_file = b''
-            
-            if name in self.label_lines:
-                line_num, source_file_path = self.label_lines[name]
-                if source_file_path:
-                    # Use basename to avoid path encoding issues
-                    basename = os.path.basename(source_file_path)
-                    source_file = basename.encode('utf-8')
-                    print(f"Symbol {name} at 0x{addr:04X} from file {basename}")
-            
-            symbol_table.extend(struct.pack("<I", line_num))
-            
-            # Add source file for the label
-            symbol_table.extend(struct.pack("<H", len(source_file)))
-            if source_file:
-                symbol_table.extend(source_file)
-        
-        # Add source line information
-        # Count entries
-        line_entries = len(self.source_lines)
-        symbol_table.extend(struct.pack("<I", line_entries))
-        
-        # Group and sort source lines by address
-        sorted_lines = sorted(self.source_lines.items(), key=lambda x: x[0])
-        
-        # Add each entry
-        for addr, (line_num, source, source_file_path) in sorted_lines:
-            symbol_table.extend(struct.pack("<I", addr))      # Address
-            symbol_table.extend(struct.pack("<I", line_num))  # Line number
-            
-            # Source line text
-            source_bytes = source.encode('utf-8')
-            symbol_table.extend(struct.pack("<H", min(len(source_bytes), 255)))
-            symbol_table.extend(source_bytes[:255])  # Limit to 255 bytes
-            
-            # Source file path - Use basename instead of full path
-            if source_file_path:
-                basename = os.path.basename(source_file_path)
-                source_file_bytes = basename.encode('utf-8')
-                
-                # Debug print for source file
-                if addr % 64 == 0:  # Only print some entries to avoid flooding
-                    print(f"Line at 0x{addr:04X} from file: {basename}")
-            else:
-                source_file_bytes = b''
+            line_num, source_file = self.label_lines.get(name, (0, ""))
+            symbols.append((name, addr, line_num, source_file))
+        return build_debug_sections(symbols, self.line_ranges, self.diag)
+    
+    def assemble_object_file(self, input_file, output_file=None):
+        """Assemble an input file to a relocatable object file."""
+        try:
+            if not output_file:
+                output_file = os.path.splitext(input_file)[0] + '.o'
             
-            symbol_table.extend(struct.pack("<H", len(source_file_bytes)))
-            if source_file_bytes:
-                symbol_table.extend(source_file_bytes)
-        
-        # Print some stats
-        code_lines = sum(1 for addr, _ in sorted_lines if addr < DATA_SEGMENT_BASE)
-        data_lines = len(sorted_lines) - code_lines
-        
-        print(f"Symbol table: {len(symbol_table)} bytes")
-        print(f"  - {num_labels} symbols")
-        print(f"  - {line_entries} source lines ({code_lines} code, {data_lines} data)")
+            with open(input_file, 'r') as f:
+                source_code = f.read()
+            
+            obj = self.assemble_object(source_code, input_file)
+            if obj is None:
+                self.diag.log(Verbosity.QUIET, f"Failed to assemble {input_file}")
+                return False
+            
+            with open(output_file, 'wb') as f:
+                f.write(obj.to_bytes())
+            
+            self.diag.log(Verbosity.NORMAL, f"Successfully assembled {input_file} to {output_file}")
+            self.diag.log(Verbosity.NORMAL, f"Text: {len(obj.text)} bytes, data: {len(obj.data)} bytes, "
+                                            f"{len(obj.relocations)} relocations")
+            return True
         
-        return symbol_table
+        except Exception as e:
+            self.diag.error(str(e))
+            return False
+    
+    def load_cached(self, binary, metadata):
+        """Restore the segments and labels of a binary taken from the build cache."""
+        _, _, sections = parse_vm32(binary)
+        self.instructions = new_code_buffer(load_segment(sections, CODE_SEGMENT_BASE, DATA_SEGMENT_BASE))
+        self.data = load_segment(sections, DATA_SEGMENT_BASE, DATA_SEGMENT_BASE + metadata["data_size"])
+        self.data += bytes(metadata["data_size"] - len(self.data))
+        self.bss_size = metadata["bss_size"]
+        self.labels = metadata["labels"]
+        self.dependencies = metadata["dependencies"]
+        self.include_graph = metadata["include_graph"]
+        self.errors = []
     
     def assemble_file(self, input_file, output_file=None):
-        """Assemble an input file to binary."""
+        """Assemble an input file to binary, reusing a cached build when available."""
         try:
             # Determine output filename if not provided
             if not output_file:
@@ -1257,30 +4008,63 @@ class Assembler:
             with open(input_file, 'r') as f:
                 source_code = f.read()
             
-            # Assemble the code
-            binary = self.assemble(source_code, input_file)
-            if not binary:
-                print(f"Failed to assemble {input_file}", file=sys.stderr)
-                return False
+            binary = None
+            if self.cache:
+                self.diag.reset()
+                with self.diag.phase("cache") as cache_phase:
+                    options = {"include_debug": True, "optimize": self.optimize, "merge_strings": self.merge_strings,
+                               "pack_data": self.pack_data, "data_profile": self.data_profile,
+                               "literal_pool": self.literal_pool}
+                    manifest_key = self.cache.manifest_key(input_file, source_code, options)
+                    entry = self.cache.lookup(manifest_key)
+                    cache_phase["hit"] = 1 if entry else 0
+                if entry:
+                    self.diag.log(Verbosity.VERBOSE, f"Build cache hit for {input_file}")
+                    self.load_cached(*entry)
+                    binary = entry[0]
+            
+            if binary is None:
+                # Assemble the code
+                binary = self.assemble(source_code, input_file)
+                if not binary:
+                    self.diag.log(Verbosity.QUIET, f"Failed to assemble {input_file}")
+                    return False
+                
+                if self.cache:
+                    metadata = {"labels": self.labels, "dependencies": self.dependencies,
+                                "include_graph": self.include_graph, "data_size": len(self.data),
+                                "bss_size": self.bss_size}
+                    self.cache.store(manifest_key, self.dependencies, binary, metadata)
+                    # assemble() started a fresh set of statistics
+                    self.diag.phases["cache"] = cache_phase
             
-            # Write binary to output file
+            # Write binary to output file, and its split debug info
+            binary, sidecar = apply_debug_output(binary, self.debug_output)
             with open(output_file, 'wb') as f:
                 f.write(binary)
+            if sidecar is not None:
+                with open(debug_file_path(output_file), 'wb') as f:
+                    f.write(sidecar)
             
             # Report success
             code_size = len(self.instructions) * 4
             data_size = len(self.data)
             total_size = len(binary)
             
-            print(f"Successfully assembled {input_file} to {output_file}")
-            print(f"Code segment: {code_size} bytes ({len(self.instructions)} instructions)")
-            print(f"Data segment: {data_size} bytes")
-            print(f"Total binary size: {total_size} bytes")
+            log = self.diag.log
+            log(Verbosity.NORMAL, f"Successfully assembled {input_file} to {output_file}")
+            log(Verbosity.NORMAL, f"Code segment: {code_size} bytes ({len(self.instructions)} instructions)")
+            log(Verbosity.NORMAL, f"Data segment: {data_size} bytes")
+            if self.bss_size:
+                log(Verbosity.NORMAL, f"BSS: {self.bss_size} bytes (zeroed at load, not stored)")
+            log(Verbosity.NORMAL, f"Total binary size: {total_size} bytes")
+            if sidecar is not None:
+                log(Verbosity.NORMAL, f"Debug info: {len(sidecar)} bytes in {debug_file_path(output_file)}")
             
             return True
         
         except Exception as e:
-            print(f"Error: {str(e)}", file=sys.stderr)
+            self.diag.error(str(e))
             return False
     
     def disassemble(self, binary_data, start_address=0, show_addresses=True):
@@ -1288,145 +4072,178 @@ class Assembler:
         Basic disassembler for VM binary code.
         Returns a list of disassembled instructions.
         """
-        result = []
-        address = start_address
-        
-        # Process each 32-bit instruction
-        for i in range(0, len(binary_data), 4):
-            if i + 4 > len(binary_data):
-                break
-            
-            # Extract the 32-bit instruction
-            instruction = struct.unpack("<I", binary_data[i:i+4])[0]
-            
-            # Decode fields
-            opcode = (instruction >> 24) & 0xFF
-            mode = (instruction >> 20) & 0x0F
-            reg1 = (instruction >> 16) & 0x0F
-            reg2 = (instruction >> 12) & 0x0F
-            immediate = instruction & 0xFFF
-            
-            # If mode is immediate-related, combine reg2 and immediate
-            if mode in [AddressingMode.IMM, AddressingMode.MEM, AddressingMode.STK, AddressingMode.BAS]:
-                immediate = (reg2 << 12) | immediate
-            
-            # Find opcode name
-            opcode_name = "???"
-            for name, value in self.opcodes.items():
-                if value == opcode:
-                    opcode_name = name
-                    break
-            
-            # Format the instruction based on opcode and mode
-            if opcode_name in ["NOP", "PUSHF", "POPF", "PUSHA", "POPA", "LEAVE", "HALT", "CLI", "STI", "IRET", "CPUID", "RESET", "DEBUG"]:
-                # No operands
-                disasm = f"{opcode_name}"
-            
-            elif opcode_name in ["INC", "DEC", "NEG", "NOT", "POP"]:
-                # Single register operand
-                disasm = f"{opcode_name} R{reg1}"
-            
-            elif opcode_name == "RET":
-                # Optional immediate
-                if immediate == 0:
-                    disasm = f"{opcode_name}"
-                else:
-                    disasm = f"{opcode_name} #{immediate}"
-            
-            elif opcode_name == "PUSH":
-                # Register or immediate
-                if mode == AddressingMode.IMM:
-                    disasm = f"{opcode_name} #{immediate}"
-                else:
-                    disasm = f"{opcode_name} R{reg1}"
-            
-            elif opcode_name in ["JMP", "JZ", "JNZ", "JN", "JP", "JO", "JC", "JBE", "JA", "CALL"]:
-                # Jump target
-                if mode == AddressingMode.IMM:
-                    disasm = f"{opcode_name} #{immediate}"
-                elif mode == AddressingMode.REG:
-                    disasm = f"{opcode_name} R{reg1}"
-                elif mode == AddressingMode.REGM:
-                    disasm = f"{opcode_name} [R{reg1}]"
-                elif mode == AddressingMode.IDX:
-                    disasm = f"{opcode_name} [R{reg1}+{immediate}]"
-                else:
-                    disasm = f"{opcode_name} ???"
-            
-            elif opcode_name in ["ENTER", "INT", "SYSCALL"]:
-                # Immediate value
-                disasm = f"{opcode_name} #{immediate}"
-            
-            elif opcode_name == "MOVE":
-                # Register to register
-                disasm = f"{opcode_name} R{reg1}, R{reg2}"
-            
-            elif opcode_name in ["LOAD", "LOADB", "LOADW", "LEA", "ADD", "SUB", "MUL", "DIV", "MOD", 
-                               "AND", "OR", "XOR", "SHL", "SHR", "SAR", "ROL", "ROR", "TEST", "CMP",
-                               "ADDC", "SUBC"]:
-                # Two operands, first is register
-                if mode == AddressingMode.IMM:
-                    disasm = f"{opcode_name} R{reg1}, #{immediate}"
-                elif mode == AddressingMode.REG:
-                    disasm = f"{opcode_name} R{reg1}, R{reg2}"
-                elif mode == AddressingMode.MEM:
-                    disasm = f"{opcode_name} R{reg1}, [{immediate}]"
-                elif mode == AddressingMode.REGM:
-                    disasm = f"{opcode_name} R{reg1}, [R{reg2}]"
-                elif mode == AddressingMode.IDX:
-                    disasm = f"{opcode_name} R{reg1}, [R{reg2}+{immediate}]"
-                elif mode == AddressingMode.STK:
-                    disasm = f"{opcode_name} R{reg1}, [SP+{immediate}]"
-                elif mode == AddressingMode.BAS:
-                    disasm = f"{opcode_name} R{reg1}, [BP+{immediate}]"
-                else:
-                    disasm = f"{opcode_name} R{reg1}, ???"
-            
-            elif opcode_name in ["STORE", "STOREB", "STOREW"]:
-                # Store operations
-                if mode == AddressingMode.MEM:
-                    disasm = f"{opcode_name} R{reg1}, [{immediate}]"
-                elif mode == AddressingMode.REGM:
-                    disasm = f"{opcode_name} R{reg1}, [R{reg2}]"
-                elif mode == AddressingMode.IDX:
-                    disasm = f"{opcode_name} R{reg1}, [R{reg2}+{immediate}]"
-                elif mode == AddressingMode.STK:
-                    disasm = f"{opcode_name} R{reg1}, [SP+{immediate}]"
-                elif mode == AddressingMode.BAS:
-                    disasm = f"{opcode_name} R{reg1}, [BP+{immediate}]"
-                else:
-                    disasm = f"{opcode_name} R{reg1}, ???"
-            
-            else:
-                # Unknown or complicated format
-                disasm = f"{opcode_name} ???"
-            
-            # Add address prefix if requested
-            if show_addresses:
-                disasm = f"{address:04X}: {disasm}"
-            
-            result.append(disasm)
-            address += 4
-        
-        return result
+        return disassemble(binary_data, start_address, show_addresses)
+
+def escape_depfile_path(path):
+    """Escape a path for a Make/Ninja depfile."""
+    return path.replace('\\', '/').replace('$', '$$').replace('#', '\\#').replace(' ', '\\ ')
+
+def write_depfile(path, target, sources):
+    """Write a Make/Ninja compatible depfile: target depends on every source."""
+    lines = [escape_depfile_path(target) + ":"]
+    lines.extend(escape_depfile_path(source) for source in sources)
+    with open(path, 'w') as f:
+        f.write(" \\\n  ".join(lines) + "\n")
+        # Empty rules keep make going when a header is deleted
+        for source in sources[1:]:
+            f.write(f"\n{escape_depfile_path(source)}:\n")
+
+def read_manifest(path):
+    """
+    Read a project manifest: one "input [output]" entry per line, '#' starts
+    a comment. Relative paths are relative to the manifest's directory.
+    """
+    base_dir = os.path.dirname(os.path.abspath(path))
+    entries = []
+    with open(path, 'r') as f:
+        for line in f:
+            fields = line.split('#', 1)[0].split()
+            if not fields:
+                continue
+            input_file = os.path.join(base_dir, fields[0])
+            output_file = os.path.join(base_dir, fields[1]) if len(fields) > 1 else None
+            entries.append((input_file, output_file))
+    return entries
+
+def assemble_job(job):
+    """
+    Assemble one input; runs in a worker process. Diagnostics are captured
+    and returned as (success, log_text, stats, include_graph) so the parent
+    can report them in input order.
+    """
+    input_file, output_file, compile_only, options, cache_dir, cache_max_size, level = job
+    stream = io.StringIO()
+    cache = BuildCache(cache_dir, cache_max_size) if cache_dir else None
+    assembler = Assembler(Diagnostics(level, stream), cache, **options)
+    if compile_only:
+        success = assembler.assemble_object_file(input_file, output_file)
+    else:
+        success = assembler.assemble_file(input_file, output_file)
+    return success, stream.getvalue(), assembler.diag.to_dict(), assembler.include_graph
+
+def assemble_many(jobs, workers=None):
+    """
+    Assemble independent inputs concurrently on a process pool.
+    Results are returned in job order, independent of scheduling.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(jobs) <= 1:
+        return [assemble_job(job) for job in jobs]
+    
+    # Hand out several jobs per task to keep the pipe overhead low on large builds
+    chunksize = max(1, len(jobs) // (workers * 4))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(assemble_job, jobs, chunksize=chunksize))
 
 # Main function for CLI
 def main():
     import argparse
     
     parser = argparse.ArgumentParser(description='Assembler for Virtual Machine')
-    parser.add_argument('input', help='Input assembly file')
+    parser.add_argument('inputs', nargs='*', metavar='input', help='Input assembly file(s)')
     parser.add_argument('-o', '--output', help='Output binary file (default: input file with .bin extension)')
-    parser.add_argument('-v', '--verbose', action='store_true', help='Show verbose output')
+    parser.add_argument('-m', '--manifest', help='Project manifest listing "input [output]" per line')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of parallel workers for multiple inputs (default: all cores)')
+    parser.add_argument('--output-dir', help='Directory for the outputs of multiple inputs (default: next to each input)')
+    parser.add_argument('-v', '--verbose', action='count', default=0, help='Show verbose output (-vv to trace labels and symbols)')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Only report errors')
+    parser.add_argument('--stats-json', metavar='FILE', help="Write assembly statistics as JSON to FILE ('-' for stdout)")
+    parser.add_argument('--cache-dir', default=os.environ.get(CACHE_DIR_ENV),
+                        help=f'Reuse builds from this cache directory (default: ${CACHE_DIR_ENV})')
+    parser.add_argument('--no-cache', action='store_true', help='Do not use the build cache')
+    parser.add_argument('--cache-max-size', type=int, default=DEFAULT_CACHE_SIZE // (1024 * 1024),
+                        help='Maximum build cache size in MiB (default: %(default)s)')
+    parser.add_argument('--cache-stats', action='store_true', help='Show build cache statistics')
     parser.add_argument('-d', '--disassemble', action='store_true', help='Disassemble the output after assembly')
     parser.add_argument('-l', '--list-file', help='Generate a listing file with assembled code')
+    parser.add_argument('-c', '--compile', action='store_true',
+                        help='Emit a relocatable object file (default: input file with .o extension) for linker.py')
+    parser.add_argument('--depfile', help='Write a Make/Ninja depfile listing the input and every included file')
+    parser.add_argument('-O', '--optimize', action='store_true',
+                        help='Run the peephole optimizer and report the instructions it removed')
+    parser.add_argument('--merge-strings', action='store_true',
+                        help='Store identical .asciiz strings once and share common string tails')
+    parser.add_argument('--pack-data', action='store_true',
+                        help='Reorder data objects by alignment to minimize padding')
+    parser.add_argument('--data-profile', metavar='FILE',
+                        help='Access profile ("label [count]" per line) whose labels --pack-data places first')
+    parser.add_argument('--map-file', metavar='FILE', help='Write the layout of .data and .bss to FILE')
+    parser.add_argument('--no-literal-pool', action='store_true',
+                        help='Truncate (with a warning) immediates that do not fit instead of pooling them')
+    debug_group = parser.add_mutually_exclusive_group()
+    debug_group.add_argument('--split-debug', action='store_true',
+                             help=f'Write the debug information to a {VMDBG_EXTENSION} file next to the binary')
+    debug_group.add_argument('--strip', action='store_true', help='Do not include any debug information')
     
     args = parser.parse_args()
     
-    assembler = Assembler()
+    if args.quiet:
+        level = Verbosity.QUIET
+    else:
+        level = min(Verbosity.NORMAL + args.verbose, Verbosity.TRACE)
+    
+    entries = [(input_file, None) for input_file in args.inputs]
+    if args.manifest:
+        try:
+            entries.extend(read_manifest(args.manifest))
+        except OSError as e:
+            parser.error(f"cannot read manifest: {e}")
+    if not entries:
+        parser.error("no input files")
+    
+    if len(entries) > 1 or args.manifest:
+        if args.output:
+            parser.error("-o needs a single input file; use --output-dir")
+        if args.disassemble or args.list_file or args.depfile or args.data_profile or args.map_file:
+            parser.error("-d, -l, --depfile, --data-profile and --map-file need a single input file")
+        sys.exit(build_many(args, entries, level))
+    
+    args.input = entries[0][0]
+    data_profile = None
+    if args.data_profile:
+        try:
+            data_profile = read_data_profile(args.data_profile)
+        except (OSError, ValueError) as e:
+            parser.error(f"cannot read data profile: {e}")
+    
+    # A cached build has no IR to write a map from
+    cache = None
+    if args.cache_dir and not args.no_cache and not args.map_file and not args.list_file:
+        cache = BuildCache(args.cache_dir, args.cache_max_size * 1024 * 1024)
+    assembler = Assembler(Diagnostics(level), cache, data_profile=data_profile, **assembler_options(args))
+    
+    if args.compile:
+        success = assembler.assemble_object_file(args.input, args.output)
+        if success and args.map_file:
+            assembler.write_map(args.map_file)
+        if success and args.depfile:
+            output_file = args.output or os.path.splitext(args.input)[0] + '.o'
+            write_depfile(args.depfile, output_file, [args.input] + assembler.dependencies)
+        if args.stats_json:
+            assembler.diag.write_json(args.stats_json)
+        sys.exit(0 if success else 1)
     
     success = assembler.assemble_file(args.input, args.output)
     
+    if success and args.map_file:
+        assembler.write_map(args.map_file)
+    
+    if success and args.depfile:
+        output_file = args.output or os.path.splitext(args.input)[0] + '.bin'
+        write_depfile(args.depfile, output_file, [args.input] + assembler.dependencies)
+    
+    if cache and args.cache_stats:
+        stats = cache.stats()
+        lookups = stats["hits"] + stats["misses"]
+        rate = 100.0 * stats["hits"] / lookups if lookups else 0.0
+        print(f"\nBuild cache: {args.cache_dir}")
+        print(f"  hits {stats['hits']}, misses {stats['misses']} ({rate:.1f}% hit rate)")
+        print(f"  stores {stats['stores']}, evictions {stats['evictions']}")
+        print(f"  size {stats['size']} / {cache.max_size} bytes")
+    
+    if args.stats_json:
+        assembler.diag.write_json(args.stats_json)
+    
     if success and args.verbose:
         # Print symbol table
         print("\nSymbol Table:")
@@ -1438,27 +4255,81 @@ def main():
         with open(output_file, 'rb') as f:
             binary_data = f.read()
         
+        # Only the code sections: the header and the debug sections are not instructions
         print("\nDisassembly:")
-        disassembly = assembler.disassemble(binary_data)
-        for line in disassembly:
-            print(line)
+        _, _, sections = parse_vm32(binary_data)
+        for section_type, address, payload in sections:
+            if section_type == SectionType.CODE:
+                for line in assembler.disassemble(payload, address):
+                    print(line)
     
     if success and args.list_file:
-        # Generate listing file with binary and source
-        try:
-            with open(args.input, 'r') as src_file, open(args.list_file, 'w') as list_file:
-                list_file.write("Source Code:\n")
-                list_file.write(src_file.read())
-                list_file.write("\n\n")
-                
-                list_file.write("Disassembly:\n")
-                disassembly = assembler.disassemble(binary_data)
-                for line in disassembly:
-                    list_file.write(line + "\n")
-                
-                print(f"Listing file generated: {args.list_file}")
-        except Exception as e:
-            print(f"Error generating listing file: {str(e)}", file=sys.stderr)
+        assembler.write_listing(args.list_file)
+        print(f"Listing file generated: {args.list_file}")
+    
+    sys.exit(0 if success else 1)
+
+def debug_output_mode(args):
+    """DebugOutput selected by the --split-debug and --strip options."""
+    if args.strip:
+        return DebugOutput.STRIP
+    return DebugOutput.SPLIT if args.split_debug else DebugOutput.EMBED
+
+def assembler_options(args):
+    """Assembler keyword arguments selected by the command line options shared with asm_build."""
+    return {"optimize": args.optimize, "debug_output": debug_output_mode(args), "merge_strings": args.merge_strings,
+            "pack_data": args.pack_data, "literal_pool": not args.no_literal_pool}
+
+def build_many(args, entries, level):
+    """Assemble many inputs in parallel and report them in input order; returns the exit code."""
+    extension = '.o' if args.compile else '.bin'
+    jobs = []
+    outputs = {}
+    cache_dir = args.cache_dir if not args.no_cache else None
+    for input_file, output_file in entries:
+        if not output_file:
+            output_file = os.path.splitext(input_file)[0] + extension
+            if args.output_dir:
+                output_file = os.path.join(args.output_dir, os.path.basename(output_file))
+        
+        # Two inputs writing the same file would make the result depend on scheduling
+        key = os.path.abspath(output_file)
+        if key in outputs:
+            print(f"Error: {input_file} and {outputs[key]} both write {output_file}", file=sys.stderr)
+            return 1
+        outputs[key] = input_file
+        jobs.append((input_file, output_file, args.compile, assembler_options(args), cache_dir,
+                     args.cache_max_size * 1024 * 1024, level))
+    
+    for output_file in outputs:
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    
+    start = time.perf_counter()
+    results = assemble_many(jobs, args.jobs)
+    elapsed = time.perf_counter() - start
+    
+    failed = 0
+    stats = {}
+    for (input_file, _), (success, log, file_stats, _) in zip(entries, results):
+        sys.stderr.write(log)
+        stats[input_file] = file_stats
+        if not success:
+            failed += 1
+    
+    if level >= Verbosity.NORMAL:
+        workers = min(args.jobs or os.cpu_count() or 1, len(jobs))
+        print(f"Assembled {len(jobs) - failed} of {len(jobs)} files in {elapsed:.2f} s "
+              f"({workers} workers, {failed} failed)", file=sys.stderr)
+    
+    if args.stats_json:
+        text = json.dumps({"files": stats}, indent=2)
+        if args.stats_json == '-':
+            print(text)
+        else:
+            with open(args.stats_json, 'w') as f:
+                f.write(text + "\n")
+    
+    return 1 if failed else 0
 
 
 if __name__ == '__main__':
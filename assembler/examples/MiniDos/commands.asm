@@ -1,6 +1,14 @@
 ; commands.asm - Command handlers for MiniDOS
 ; Contains implementation of all supported commands
 
+.global do_help_cmd, do_cls_cmd, do_echo_cmd, do_exit_cmd, do_time_cmd
+.global do_mem_cmd, do_ver_cmd, do_pause_cmd, do_color_cmd
+.extern skip_whitespace, parse_number                         ; utils.asm
+.extern parse_cmd_done                                        ; parser.asm
+.extern help_text, time_text, seconds_text, version_text      ; data.asm
+.extern pause_text, mem_total_msg, mem_code_msg, mem_data_msg
+.extern mem_stack_msg, mem_heap_msg, bytes_suffix
+
 ; ----- Command Handlers -----
 
 do_help_cmd:
@@ -1,6 +1,10 @@
 ; data.asm - Data segment definitions for MiniDOS
 ; Contains all string constants and buffers
 
+.global welcome_msg, prompt, help_text, cmd_not_found, version_text, time_text, seconds_text
+.global pause_text, mem_total_msg, mem_code_msg, mem_data_msg, mem_stack_msg, mem_heap_msg
+.global bytes_suffix, kb_suffix, input_buffer, command_buffer
+
 .data
 welcome_msg:
     .asciiz "MiniDOS v1.0\nCopyright (c) 2025\nType 'help' for commands\n"
@@ -10,24 +14,6 @@ help_text:
     .asciiz "Available commands:\n  help - Show this help\n  cls - Clear screen\n  echo [text] - Display text\n  exit - Quit OS\n  time - Show system time\n  mem - Show memory info\n  ver - Show version\n  pause - Wait for key press\n  color [num] - Change text color (0-7)\n"
 cmd_not_found:
     .asciiz "Bad command or file name\n"
-cmd_help:
-    .asciiz "help"
-cmd_cls:
-    .asciiz "cls"
-cmd_echo:
-    .asciiz "echo"
-cmd_exit:
-    .asciiz "exit"
-cmd_time:
-    .asciiz "time"
-cmd_mem:
-    .asciiz "mem"
-cmd_ver:
-    .asciiz "ver"
-cmd_pause:
-    .asciiz "pause"
-cmd_color:
-    .asciiz "color"
 version_text:
     .asciiz "MiniDOS Version 1.0\nCopyright (c) 2025\n"
 time_text:
@@ -51,7 +37,8 @@ bytes_suffix:
 kb_suffix:
     .asciiz " KB\n"
 
-; ----- Buffers -----
+; ----- Buffers (zeroed by the loader, not stored in the binary) -----
+.bss
 input_buffer:
     .space 256
 command_buffer:
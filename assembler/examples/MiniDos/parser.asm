@@ -1,6 +1,24 @@
 ; parser.asm - Command parsing for MiniDOS
 ; Contains functions to parse and execute commands
 
+.global parse_command, parse_cmd_done
+.extern skip_whitespace, find_word_end, hash_string, strcmp   ; utils.asm
+.extern command_buffer, cmd_not_found                         ; data.asm
+.extern do_help_cmd, do_cls_cmd, do_echo_cmd, do_exit_cmd     ; commands.asm
+.extern do_time_cmd, do_mem_cmd, do_ver_cmd, do_pause_cmd, do_color_cmd
+
+; ----- Command Table -----
+; Command name -> handler, looked up through a perfect hash
+.dispatch commands, "help", do_help_cmd
+.dispatch commands, "cls", do_cls_cmd
+.dispatch commands, "echo", do_echo_cmd
+.dispatch commands, "exit", do_exit_cmd
+.dispatch commands, "time", do_time_cmd
+.dispatch commands, "mem", do_mem_cmd
+.dispatch commands, "ver", do_ver_cmd
+.dispatch commands, "pause", do_pause_cmd
+.dispatch commands, "color", do_color_cmd
+
 ; ----- Command Parser -----
 ; R6 = pointer to command string
 parse_command:
@@ -30,24 +48,12 @@ parse_command:
     LOAD R9, #31
     
 copy_cmd_len_ok:
+    ; Copy the longest possible command in one go; the terminator
+    ; below cuts it to the real length
     LOAD R10, command_buffer  ; Destination
-    MOVE R11, R8              ; Source
-    MOVE R12, R9              ; Length
-    
-    ; Copy loop
-    CMP R12, #0
-    JZ copy_cmd_done
-    
-copy_cmd_loop:
-    LOADB R13, [R11]
-    STOREB R13, [R10]
-    INC R10
-    INC R11
-    DEC R12
-    CMP R12, #0
-    JNZ copy_cmd_loop
+    MEMCPY R10, R8, #31
+    ADD R10, R9
     
-copy_cmd_done:    
     ; Null-terminate command
     LOAD R13, #0
     STOREB R13, [R10]
@@ -55,72 +61,26 @@ copy_cmd_done:
     ; Save pointer to arguments
     MOVE R14, R6
     
-    ; Match command against known commands
-    LOAD R6, command_buffer
-    
-    ; Check for "help" command
-    LOAD R7, cmd_help
-    CALL strcmp
-    CMP R0, #0
-    JZ do_help_cmd
-    
-    ; Check for "cls" command
+    ; Look the command up in the dispatch table, a perfect hash built by
+    ; the assembler: one hash and one string compare for any command
     LOAD R6, command_buffer
-    LOAD R7, cmd_cls
-    CALL strcmp
-    CMP R0, #0
-    JZ do_cls_cmd
-    
-    ; Check for "echo" command
-    LOAD R6, command_buffer
-    LOAD R7, cmd_echo
-    CALL strcmp
-    CMP R0, #0
-    JZ do_echo_cmd
-    
-    ; Check for "exit" command
-    LOAD R6, command_buffer
-    LOAD R7, cmd_exit
-    CALL strcmp
-    CMP R0, #0
-    JZ do_exit_cmd
-    
-    ; Check for "time" command
-    LOAD R6, command_buffer
-    LOAD R7, cmd_time
-    CALL strcmp
-    CMP R0, #0
-    JZ do_time_cmd
-    
-    ; Check for "mem" command
-    LOAD R6, command_buffer
-    LOAD R7, cmd_mem
-    CALL strcmp
-    CMP R0, #0
-    JZ do_mem_cmd
-    
-    ; Check for "ver" command
-    LOAD R6, command_buffer
-    LOAD R7, cmd_ver
-    CALL strcmp
-    CMP R0, #0
-    JZ do_ver_cmd
-    
-    ; Check for "pause" command
-    LOAD R6, command_buffer
-    LOAD R7, cmd_pause
-    CALL strcmp
-    CMP R0, #0
-    JZ do_pause_cmd
-    
-    ; Check for "color" command
-    LOAD R6, command_buffer
-    LOAD R7, cmd_color
+    CALL hash_string
+    MUL R0, #commands.seed
+    SHR R0, #commands.shift
+    SHL R0, #3          ; 8 bytes per slot
+    ADD R0, #commands
+    MOVE R13, R0
+    
+    ; An unused slot or another key means the command is not known
+    LOAD R7, [R13]
+    CMP R7, #0
+    JZ cmd_unknown
     CALL strcmp
     CMP R0, #0
-    JZ do_color_cmd
+    JNZ cmd_unknown
+    JMP [R13+4]         ; Jump to the handler
     
-    ; Command not found
+cmd_unknown:
     LOAD R0, cmd_not_found
     SYSCALL #2
     JMP parse_cmd_done
@@ -0,0 +1,33 @@
+; shell.asm - Main entry point for MiniDOS
+; Contains initialization and main command loop
+
+.global main
+.extern welcome_msg, prompt, input_buffer                    ; data.asm
+.extern parse_command                                         ; parser.asm
+
+.text
+    ; Initialize the OS
+    JMP main
+
+; ----- Main Program -----
+main:
+    ; Display welcome message
+    LOAD R0, welcome_msg
+    SYSCALL #2
+    
+command_loop:
+    ; Display prompt
+    LOAD R0, prompt
+    SYSCALL #2
+    
+    ; Read command line input
+    LOAD R0, input_buffer
+    LOAD R5, #255
+    SYSCALL #4
+    
+    ; Parse and execute command
+    LOAD R6, input_buffer
+    CALL parse_command
+    
+    ; Loop back for next command
+    JMP command_loop
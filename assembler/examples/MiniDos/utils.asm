@@ -1,6 +1,8 @@
 ; utils.asm - Utility functions for MiniDOS
 ; Contains general-purpose functions for string handling, etc.
 
+.global skip_whitespace, find_word_end, hash_string, strcmp, parse_number
+
 ; ----- String Utilities -----
 
 ; Skip whitespace
@@ -37,6 +39,26 @@ find_word_done:
     POP R7
     RET
 
+; Hash a string for a .dispatch table: h = h * 33 + c over its bytes
+; Input: R6 = pointer to string
+; Output: R0 = hash
+hash_string:
+    PUSH R6
+    PUSH R7
+    LOAD R0, #0
+hash_loop:
+    LOADB R7, [R6]
+    CMP R7, #0
+    JZ hash_done
+    MUL R0, #33
+    ADD R0, R7
+    INC R6
+    JMP hash_loop
+hash_done:
+    POP R7
+    POP R6
+    RET
+
 ; String comparison
 ; Input: R6 = pointer to string 1
 ;        R7 = pointer to string 2
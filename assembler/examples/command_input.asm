@@ -513,5 +513,7 @@ kb_msg:
     .asciiz " KB\n"
 goodbye_msg:
     .asciiz "Goodbye!\n"
+
+.bss
 input_buffer:
     .space 100
\ No newline at end of file
@@ -0,0 +1,45 @@
+; Example assembly program for the VM
+; Uses lookup tables computed by the assembler (.table) instead of
+; computing the values at run time
+
+.equ VALUE, 0xCAFE
+.equ DIGITS, 4
+
+.text                   ; Code section
+    ; Print VALUE in hexadecimal, most significant digit first
+    LOAD R9, #(DIGITS - 1) * 4  ; Shift of the current digit
+digit_loop:
+    LOAD R8, #VALUE
+    SHR R8, R9
+    AND R8, #0xF        ; Digit value
+    ADD R8, #hex_digits ; Address of its character
+    LOADB R0, [R8]
+    SYSCALL #0          ; Syscall 0 = print character
+    SUB R9, #4
+    JN squares_start
+    JMP digit_loop
+    
+squares_start:
+    LOAD R0, #10        ; ASCII for newline
+    SYSCALL #0
+    
+    ; Print the squares of 0 to 9, one load each
+    LOAD R9, #0         ; Table offset
+square_loop:
+    LOAD R8, #squares
+    ADD R8, R9
+    LOAD R0, [R8]
+    SYSCALL #1          ; Syscall 1 = print integer
+    LOAD R0, #32        ; ASCII for space
+    SYSCALL #0
+    ADD R9, #4
+    CMP R9, #10 * 4
+    JNZ square_loop
+    
+    LOAD R0, #10
+    SYSCALL #0
+    HALT
+
+.data                   ; Data section
+.table hex_digits, 16, i < 10 ? '0' + i : 'A' + i - 10, 1
+.table squares, 10, i * i
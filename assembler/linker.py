@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Linker for VM object files
+
+Combines relocatable object files produced by `assembler.py -c` into a VM32
+binary. The .text sections are laid out one after another from
+CODE_SEGMENT_BASE and the non-empty .data sections (each aligned to 4 bytes) from
+DATA_SEGMENT_BASE, in command line order, followed by the .bss sections of
+all modules (also 4-byte aligned). Relocations are then resolved
+against each module's own symbols first and the exported (.global) symbols
+of all modules second.
+"""
+
+import os
+import sys
+from array import array
+
+from assembler import (CODE_SEGMENT_BASE, DATA_SEGMENT_BASE, Binding, DebugOutput, Diagnostics,
+                       ObjectFile, SymbolSection, Verbosity, apply_debug_output, bss_base, build_debug_sections,
+                       build_vm32, debug_file_path, debug_output_mode, new_code_buffer, store_fixup)
+
+class Linker:
+    def __init__(self, diagnostics=None):
+        self.errors = []
+        self.diag = diagnostics or Diagnostics()
+        self.instructions = array('I')
+        self.data = bytearray()
+        self.bss_size = 0
+
+    def error(self, message):
+        """Report an error."""
+        self.errors.append(message)
+
+    def link(self, objects, include_debug=True):
+        """
+        Link a list of (name, ObjectFile) into a VM32 binary.
+        Returns the binary, or None after reporting errors.
+        """
+        self.errors = []
+        self.instructions = array('I')
+        self.data = bytearray()
+        self.bss_size = 0
+        diag = self.diag
+        diag.reset()
+
+        # Place every section and collect the exported symbols
+        with diag.phase("layout") as phase:
+            bases = []
+            for name, obj in objects:
+                text_base = CODE_SEGMENT_BASE + len(self.instructions) * 4
+                if obj.data:
+                    self.data += bytes(-len(self.data) & 3)
+                data_base = DATA_SEGMENT_BASE + len(self.data)
+                bases.append((text_base, data_base))
+
+                self.instructions.extend(new_code_buffer(obj.text))
+                self.data += obj.data
+
+            # The .bss of every module goes after all the data
+            bss_start = bss_base(len(self.data))
+            for i, (name, obj) in enumerate(objects):
+                bases[i] += (bss_start + self.bss_size,)
+                self.bss_size += (obj.bss_size + 3) & ~3
+
+            exported = {}
+            for (name, obj), module_bases in zip(objects, bases):
+                for symbol, section, binding, value in obj.symbols:
+                    if binding != Binding.GLOBAL or section == SymbolSection.UNDEF:
+                        continue
+                    if symbol in exported:
+                        self.error(f"Duplicate symbol {symbol} defined in {exported[symbol][0]} and {name}")
+                        continue
+                    exported[symbol] = (name, self.symbol_address(section, value, *module_bases))
+            phase["modules"] = len(objects)
+            phase["exports"] = len(exported)
+            phase["code_bytes"] = len(self.instructions) * 4
+            phase["data_bytes"] = len(self.data)
+            phase["bss_bytes"] = self.bss_size
+
+        # Patch every relocation with the final symbol address
+        with diag.phase("relocate") as phase:
+            count = 0
+            for (name, obj), (text_base, data_base, module_bss_base) in zip(objects, bases):
+                local = {}
+                for symbol, section, binding, value in obj.symbols:
+                    if section != SymbolSection.UNDEF:
+                        local[symbol] = self.symbol_address(section, value, text_base, data_base, module_bss_base)
+
+                for fixup in obj.relocations:
+                    if fixup.symbol in local:
+                        value = local[fixup.symbol]
+                    elif fixup.symbol in exported:
+                        value = exported[fixup.symbol][1]
+                    else:
+                        self.error(f"Undefined symbol {fixup.symbol} referenced in {name}")
+                        continue
+
+                    # Relocation offsets are relative to the module's section
+                    if fixup.section == ".text":
+                        base = text_base - CODE_SEGMENT_BASE
+                    else:
+                        base = data_base - DATA_SEGMENT_BASE
+                    if not store_fixup(fixup, value, self.instructions, self.data, base):
+                        diag.warning(f"{name}: value of {fixup.symbol} does not fit its "
+                                     f"{fixup.type.name} field and was truncated")
+                    count += 1
+            phase["relocations"] = count
+
+        if self.errors:
+            for error in self.errors:
+                diag.error(error)
+            return None
+
+        with diag.phase("emit") as phase:
+            debug_sections = self.generate_debug_sections(objects, bases) if include_debug else []
+            binary = build_vm32(self.instructions, self.data, debug_sections, self.bss_size)
+            phase["symbol_bytes"] = sum(len(payload) for _, payload in debug_sections)
+            phase["total_bytes"] = len(binary)
+        return binary
+
+    @staticmethod
+    def symbol_address(section, value, text_base, data_base, bss_base):
+        """Final address of a symbol defined in a module placed at the given bases."""
+        if section == SymbolSection.TEXT:
+            return text_base + value
+        if section == SymbolSection.DATA:
+            return data_base + value
+        if section == SymbolSection.BSS:
+            return bss_base + value
+        return value
+
+    def generate_debug_sections(self, objects, bases):
+        """Merge the debug information of all modules into the VM32 debug sections."""
+        symbols = []
+        line_ranges = []
+        for (name, obj), module_bases in zip(objects, bases):
+            text_base, data_base, module_bss_base = module_bases
+            for symbol, section, binding, value in obj.symbols:
+                if section == SymbolSection.UNDEF:
+                    continue
+                address = self.symbol_address(section, value, *module_bases)
+                line, source_file = obj.label_lines.get(symbol, (0, ""))
+                symbols.append((symbol, address, line, source_file))
+
+            # The module's .bss was assembled right after its own .data
+            own_bss_base = bss_base(len(obj.data))
+            for start, end, line, source, source_file in obj.line_ranges:
+                if start >= own_bss_base and obj.bss_size:
+                    offset = module_bss_base - own_bss_base
+                elif start >= DATA_SEGMENT_BASE:
+                    offset = data_base - DATA_SEGMENT_BASE
+                else:
+                    offset = text_base - CODE_SEGMENT_BASE
+                line_ranges.append((start + offset, end + offset, line, source, source_file))
+        return build_debug_sections(symbols, line_ranges, self.diag)
+
+    def link_files(self, input_files, output_file, debug_output=DebugOutput.EMBED):
+        """Link object files into a VM32 binary file."""
+        objects = []
+        for input_file in input_files:
+            try:
+                with open(input_file, 'rb') as f:
+                    objects.append((input_file, ObjectFile.from_bytes(f.read())))
+            except (OSError, ValueError) as e:
+                self.diag.error(f"{input_file}: {e}")
+                return False
+
+        binary = self.link(objects, debug_output != DebugOutput.STRIP)
+        if binary is None:
+            self.diag.log(Verbosity.QUIET, f"Failed to link {output_file}")
+            return False
+
+        binary, sidecar = apply_debug_output(binary, debug_output)
+        with open(output_file, 'wb') as f:
+            f.write(binary)
+        if sidecar is not None:
+            with open(debug_file_path(output_file), 'wb') as f:
+                f.write(sidecar)
+
+        log = self.diag.log
+        log(Verbosity.NORMAL, f"Successfully linked {len(objects)} modules to {output_file}")
+        log(Verbosity.NORMAL, f"Code segment: {len(self.instructions) * 4} bytes ({len(self.instructions)} instructions)")
+        log(Verbosity.NORMAL, f"Data segment: {len(self.data)} bytes")
+        if self.bss_size:
+            log(Verbosity.NORMAL, f"BSS: {self.bss_size} bytes (zeroed at load, not stored)")
+        log(Verbosity.NORMAL, f"Total binary size: {len(binary)} bytes")
+        if sidecar is not None:
+            log(Verbosity.NORMAL, f"Debug info: {len(sidecar)} bytes in {debug_file_path(output_file)}")
+        return True
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Linker for Virtual Machine object files')
+    parser.add_argument('inputs', nargs='+', help='Object files, in link order')
+    parser.add_argument('-o', '--output', help='Output binary file (default: first input with .bin extension)')
+    parser.add_argument('-v', '--verbose', action='count', default=0, help='Show verbose output')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Only report errors')
+    debug_group = parser.add_mutually_exclusive_group()
+    debug_group.add_argument('--no-debug', '--strip', dest='strip', action='store_true',
+                             help='Do not include any debug information')
+    debug_group.add_argument('--split-debug', action='store_true',
+                             help='Write the debug information to a .vmdbg file next to the binary')
+    parser.add_argument('--stats-json', metavar='FILE', help="Write link statistics as JSON to FILE ('-' for stdout)")
+
+    args = parser.parse_args()
+
+    if args.quiet:
+        level = Verbosity.QUIET
+    else:
+        level = min(Verbosity.NORMAL + args.verbose, Verbosity.TRACE)
+    linker = Linker(Diagnostics(level))
+
+    output_file = args.output or os.path.splitext(args.inputs[0])[0] + '.bin'
+    success = linker.link_files(args.inputs, output_file, debug_output_mode(args))
+
+    if args.stats_json:
+        linker.diag.write_json(args.stats_json)
+    sys.exit(0 if success else 1)
+
+
+if __name__ == '__main__':
+    main()
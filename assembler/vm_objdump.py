@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+vm-objdump: display the contents of VM32 binaries
+
+Shows the header and section table, the symbol table, a symbolized
+disassembly of the code sections, a hex dump of the data sections and
+size statistics. Binaries are memory-mapped (see vmfile) and only the
+parts needed for the selected output are decoded: headers and sizes come
+straight from the section table, symbols are decoded for -t and -d, and
+source lines only for -l.
+"""
+
+import bisect
+import sys
+
+from assembler import (BRANCH_OPS, DATA_SEGMENT_BASE, DEBUG_SECTIONS, AddressingMode, SectionType, decode_fields,
+                       disassemble, load_numpy, new_code_buffer)
+from vmfile import VMFile
+
+def format_symbol(symbols, addresses, address):
+    """<name> or <name+offset> of the symbol an address falls in, or None."""
+    index = bisect.bisect_right(addresses, address) - 1
+    if index < 0:
+        return None
+    symbol_address, name = symbols[index]
+    offset = address - symbol_address
+    return f"<{name}+0x{offset:X}>" if offset else f"<{name}>"
+
+def show_headers(vm, out):
+    """Print the file header and the section table."""
+    out.append(f"  VM32 v{vm.version[0]}.{vm.version[1]}, entry 0x{vm.entry:04X}, "
+               f"{vm.file_size} bytes, header {vm.header_size} bytes")
+    if vm.build_id is not None:
+        out.append(f"  Build ID: {vm.build_id.hex()}")
+    out.append(f"  Debug info: {vm.debug_location or 'none'}")
+    out.append("")
+    out.append("Sections:")
+    out.append("Idx Type         Address  Offset      Size")
+    for section in vm.sections:
+        offset = f"{section.offset:08X}" if section.stored else "-"
+        out.append(f"{section.index:3} {section.name:<12} {section.address:04X}     {offset:<8} {section.size:9}")
+
+def show_symbols(vm, out):
+    """Print the symbol table."""
+    symbols = vm.debug.symbols
+    out.append("SYMBOL TABLE:")
+    if not symbols:
+        out.append("  (no symbols)")
+    for name, address, line, source_file in symbols:
+        section = "DATA" if address >= DATA_SEGMENT_BASE else "CODE"
+        location = f"  {source_file}:{line}" if source_file else ""
+        out.append(f"{address:04X} {section:<5} {name}{location}")
+
+def show_disassembly(vm, out, line_numbers, use_numpy):
+    """Print the code sections with their labels, source lines and symbolized operands."""
+    debug = vm.debug
+    # Generated symbols without a source location (e.g. .dispatch
+    # parameters) are constants rather than addresses
+    symbols = [(address, name) for name, address, _, source_file in debug.symbols if source_file]
+    addresses = [address for address, _ in symbols]
+    exact = dict(symbols)
+    numpy = load_numpy() if use_numpy else None
+    for section in vm.sections_of(SectionType.CODE):
+        out.append(f"Disassembly of section {section.name} at 0x{section.address:04X} ({section.size} bytes):")
+        code = section.data
+        lines = disassemble(code, show_addresses=False, use_numpy=use_numpy)
+        fields = decode_fields(code, numpy if len(code) >= 4 else None)
+        next_symbol = 0
+        while next_symbol < len(symbols) and symbols[next_symbol][0] < section.address:
+            next_symbol += 1
+        last_line = None
+        address = section.address
+        for word, text, (key, _, _, immediate) in zip(new_code_buffer(code[:len(code) & ~3]), lines, fields):
+            while next_symbol < len(symbols) and symbols[next_symbol][0] <= address:
+                out.append("")
+                out.append(f"{symbols[next_symbol][0]:04X} <{symbols[next_symbol][1]}>:")
+                next_symbol += 1
+            if line_numbers:
+                line = debug.line_at(address)
+                if line is not None and line != last_line:
+                    out.append(f"; {line[2]}:{line[0]}  {line[1]}")
+                last_line = line
+
+            # Name the symbol a jump target or memory operand refers to
+            mode = key & 0xF
+            target = None
+            if key >> 4 in BRANCH_OPS and mode == AddressingMode.IMM or mode == AddressingMode.MEM:
+                target = format_symbol(symbols, addresses, immediate)
+            elif mode == AddressingMode.IMM and immediate >= DATA_SEGMENT_BASE and immediate in exact:
+                target = f"<{exact[immediate]}>"
+            if target:
+                text = f"{text:<28} {target}"
+            out.append(f"  {address:04X}:  {word:08X}  {text}")
+            address += 4
+        out.append("")
+
+def show_contents(vm, out):
+    """Hex dump the data sections."""
+    for section in vm.sections_of(SectionType.DATA):
+        out.append(f"Contents of section {section.name} at 0x{section.address:04X} ({section.size} bytes):")
+        data = section.data
+        for offset in range(0, len(data), 16):
+            chunk = bytes(data[offset:offset + 16])
+            hex_bytes = " ".join(chunk[i:i + 4].hex() for i in range(0, len(chunk), 4))
+            text = "".join(chr(b) if 32 <= b < 127 else "." for b in chunk)
+            out.append(f" {section.address + offset:04X} {hex_bytes:<35}  {text}")
+        out.append("")
+
+def show_sizes(vm, out):
+    """Print how the file and the loaded image are made up."""
+    def total(*types):
+        return sum(section.size for section in vm.sections_of(*types))
+
+    code = total(SectionType.CODE)
+    rows = [("Header", vm.header_size, ""),
+            ("Code", code, f"{code // 4} instructions"),
+            ("Data", total(SectionType.DATA), ""),
+            ("Debug", total(*DEBUG_SECTIONS), ", ".join(f"{section.name.lower()} {section.size}"
+                                                       for section in vm.sections_of(*DEBUG_SECTIONS))),
+            ("Build ID", total(SectionType.BUILD_ID), "")]
+    stored = sum(size for _, size, _ in rows)
+    out.append(f"File size: {vm.file_size} bytes")
+    for name, size, detail in rows:
+        if size:
+            share = 100.0 * size / vm.file_size
+            out.append(f"  {name:<9} {size:10} bytes  {share:5.1f}%" + (f"  ({detail})" if detail else ""))
+    if vm.file_size > stored:
+        out.append(f"  {'Other':<9} {vm.file_size - stored:10} bytes")
+    zero = total(SectionType.ZERO)
+    if zero:
+        out.append(f"Zero fill: {zero} bytes (not stored in the file)")
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Display the contents of VM32 binaries')
+    parser.add_argument('files', nargs='+', help='VM32 binaries')
+    parser.add_argument('-x', '--headers', action='store_true', help='Show the file header and section table')
+    parser.add_argument('-t', '--syms', action='store_true', help='Show the symbol table')
+    parser.add_argument('-d', '--disassemble', action='store_true', help='Disassemble the code sections')
+    parser.add_argument('-l', '--line-numbers', action='store_true', help='With -d, show the source line of each instruction')
+    parser.add_argument('-s', '--full-contents', action='store_true', help='Hex dump the data sections')
+    parser.add_argument('--size', action='store_true', help='Show size statistics')
+    parser.add_argument('--no-numpy', action='store_true', help='Use the pure Python decoder even if NumPy is installed')
+    args = parser.parse_args()
+
+    if not (args.headers or args.syms or args.disassemble or args.full_contents or args.size):
+        args.headers = args.size = True
+
+    failed = False
+    for path in args.files:
+        out = []
+        try:
+            with VMFile(path) as vm:
+                out.append(f"{path}:")
+                if args.headers:
+                    show_headers(vm, out)
+                    out.append("")
+                if args.syms:
+                    show_symbols(vm, out)
+                    out.append("")
+                if args.disassemble:
+                    show_disassembly(vm, out, args.line_numbers, not args.no_numpy)
+                if args.full_contents:
+                    show_contents(vm, out)
+                if args.size:
+                    show_sizes(vm, out)
+                    out.append("")
+        except (OSError, ValueError) as e:
+            print(f"vm-objdump: {path}: {e}", file=sys.stderr)
+            failed = True
+            continue
+        try:
+            sys.stdout.write("\n".join(out) + "\n")
+        except BrokenPipeError:
+            sys.stderr.close()
+            sys.exit(0)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+vmfile: memory-mapped access to VM32 binaries
+
+Opens a VM32 binary (v1 or v2) with mmap and exposes the header and every
+section as a zero-copy memoryview into the mapping, so a tool only touches
+the pages it actually reads. Symbols and source lines are decoded on first
+use (through DebugInfo, from the embedded debug sections or the .vmdbg
+file), and each of them only when it is asked for.
+
+    with VMFile("program.bin") as vm:
+        for section in vm.sections_of(SectionType.CODE):
+            print(section.address, len(section.data))
+        print(vm.debug.symbol_at(0x10))
+"""
+
+import mmap
+
+from assembler import (LEGACY_SYMBOLS, VM32_HEADER, VM32_SECTION, DebugInfo, SectionType, debug_file_path,
+                       parse_vm32)
+
+class SectionView:
+    """One section of a mapped binary. data is a memoryview into the file, None for ZERO sections."""
+    __slots__ = ('index', 'type', 'address', 'offset', 'size', 'data')
+
+    def __init__(self, index, section_type, address, offset, size, data):
+        self.index = index
+        self.type = section_type
+        self.address = address
+        self.offset = offset
+        self.size = size
+        self.data = data
+
+    @property
+    def name(self):
+        if self.type == LEGACY_SYMBOLS:
+            return "SYMBOLS_V1"
+        try:
+            return SectionType(self.type).name
+        except ValueError:
+            return f"0x{self.type:X}"
+
+    @property
+    def stored(self):
+        """Whether the section takes bytes in the file."""
+        return self.data is not None
+
+    def __repr__(self):
+        return f"SectionView({self.name}, address=0x{self.address:04X}, offset={self.offset}, size={self.size})"
+
+class VMFile:
+    """
+    A VM32 binary mapped into memory. Raises OSError if the file cannot be
+    read and ValueError if it is not a valid VM32 binary.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                self._map = b""  # Empty files cannot be mapped
+        self.view = memoryview(self._map)
+        try:
+            self.version, self.entry, sections = parse_vm32(self.view)
+        except ValueError:
+            self.close()
+            raise
+        self.file_size = len(self.view)
+        self.header_size = VM32_HEADER.unpack_from(self.view)[3]
+        self.header = self.view[:self.header_size]
+
+        # parse_vm32 only returns the payloads; the file offsets come from
+        # the section table (v2) or follow the header in order (v1)
+        self.sections = []
+        offset = self.header_size
+        for index, (section_type, address, payload) in enumerate(sections):
+            if self.version[0] >= 2:
+                offset = VM32_SECTION.unpack_from(self.view, VM32_HEADER.size + index * VM32_SECTION.size)[2]
+            if section_type == SectionType.ZERO:
+                self.sections.append(SectionView(index, section_type, address, offset, payload, None))
+            else:
+                self.sections.append(SectionView(index, section_type, address, offset, len(payload), payload))
+                offset += len(payload)
+        self.debug = DebugInfo(path, sections, self.version)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        Release the views and unmap the file. Raises BufferError while a
+        view taken from a section (e.g. a NumPy array) is still alive.
+        """
+        for section in getattr(self, 'sections', ()):
+            if section.data is not None:
+                section.data.release()
+        self.sections = []
+        if hasattr(self, 'header'):
+            self.header.release()
+        self.view.release()
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+
+    def sections_of(self, *types):
+        """The sections of the given types, in file order."""
+        return [section for section in self.sections if section.type in types]
+
+    @property
+    def build_id(self):
+        """The build ID that matches the binary with its .vmdbg file, or None."""
+        for section in self.sections_of(SectionType.BUILD_ID):
+            return bytes(section.data)
+        return None
+
+    @property
+    def debug_location(self):
+        """Where the debug information lives: 'embedded', the .vmdbg path, or None if there is none."""
+        if self.sections_of(SectionType.STRINGS, LEGACY_SYMBOLS):
+            return "embedded"
+        if self.build_id is not None:
+            return debug_file_path(self.path)
+        return None
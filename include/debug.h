@@ -5,7 +5,29 @@
 #include <string.h>
 #include <stdlib.h>
 
-void load_debug_symbols(VM *vm, const uint8_t *data, uint32_t size);
+// Debug table layouts, selected by the VM32 header version
+#define DEBUG_FORMAT_PER_ADDRESS 0  // v1.0: one entry per code word and data byte
+#define DEBUG_FORMAT_RANGES      1  // v1.1: string table and address ranges
+
+// Split debug information written by the assembler with --split-debug
+#define DEBUG_SIDECAR_MAGIC      "VMDB"
+#define DEBUG_SIDECAR_EXTENSION  ".vmdbg"
+
+void load_debug_symbols(VM *vm, const uint8_t *data, uint32_t size, int format);
+
+// VM32 v2 debug sections (any of symbols and lines may be NULL)
+void load_debug_sections(VM *vm, const uint8_t *strings, uint32_t strings_size,
+                         const uint8_t *symbols, uint32_t symbols_size,
+                         const uint8_t *lines, uint32_t lines_size);
+
+uint32_t debug_read_uleb128(const uint8_t **ptr, const uint8_t *end);
+
+int32_t debug_read_sleb128(const uint8_t **ptr, const uint8_t *end);
+
+// Debug information of the loaded program, loaded on first use in debug mode
+DebugInfo* debug_get_info(VM *vm);
+
+char* debug_sidecar_path(const char *program_file);
 
 void free_debug_info(VM *vm);
 
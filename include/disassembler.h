@@ -31,6 +31,11 @@ int disassemble_file(const char *filename);
 
 void parse_symbol_table(const uint8_t *data, uint32_t size, SymbolTable *table);
 
+void parse_symbol_sections(const uint8_t *strings, uint32_t strings_size,
+                           const uint8_t *symbols, uint32_t symbols_size, SymbolTable *table);
+
+void parse_sidecar_symbols(const char *filename, const uint8_t *build_id, SymbolTable *table);
+
 void free_symbol_table(SymbolTable *table);
 
 const char* disassemble_find_symbol_for_address(SymbolTable *table, uint32_t address);
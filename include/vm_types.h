@@ -33,6 +33,21 @@
 #define HEAP_SEGMENT_BASE   0xC000
 #define HEAP_SEGMENT_SIZE   0x4000
 
+// VM32 v2 container: 20-byte header followed by 16-byte section entries
+#define VM32_V2_HEADER_SIZE     20
+#define VM32_V2_SECTION_SIZE    16
+
+// VM32 v2 section types (unknown types are skipped by the loader)
+#define VM32_SECTION_CODE       1  // Loaded at its address in the code segment
+#define VM32_SECTION_DATA       2  // Loaded at its address in the data segment
+#define VM32_SECTION_STRINGS    3  // Debug string table
+#define VM32_SECTION_SYMBOLS    4  // Debug symbols
+#define VM32_SECTION_LINES      5  // Debug source line ranges
+#define VM32_SECTION_BUILD_ID   6  // Matches a binary with its .vmdbg file
+#define VM32_SECTION_ZERO       7  // Zero-filled memory (.bss), no bytes in the file
+
+#define VM32_BUILD_ID_SIZE      16
+
 // Special stack frame offsets
 #define FRAME_PREV_BP_OFFSET    0
 #define FRAME_RET_ADDR_OFFSET   4
@@ -50,6 +65,7 @@ typedef struct {
 // SourceLine represents a line from the source code
 typedef struct {
     uint32_t address;     // Program address
+    uint32_t end_address; // First address after the line's code or data
     uint32_t line_num;    // Source line number
     char *source;         // Source line text
     char *source_file;    // Source file path
@@ -64,6 +80,10 @@ typedef struct {
     // Source line information
     SourceLine *source_lines;
     uint32_t source_line_count;
+    
+    // Shared string table (v1.1 and v2 tables): symbol and line strings point into it
+    char **strings;
+    uint32_t string_count;
 } DebugInfo;
 
 #define MAX_BREAKPOINTS 32
@@ -115,6 +135,12 @@ typedef struct {
     char error_message[256]; // Error message
 
     DebugInfo *debug_info;  // Debug information (NULL if not loaded)
+    
+    // Debug information is loaded on first use (see debug_get_info)
+    char *debug_file;                       // Binary or .vmdbg file holding the debug sections
+    uint8_t build_id[VM32_BUILD_ID_SIZE];   // Build ID the .vmdbg file must match
+    bool has_build_id;
+    bool debug_load_attempted;
 } VM;
 
 // Error codes
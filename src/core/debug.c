@@ -1,7 +1,9 @@
 #include <debug.h>
 #include <stdio.h>
 
-void load_debug_symbols(VM *vm, const uint8_t *data, uint32_t size) {
+static void load_debug_ranges(VM *vm, const uint8_t *data, uint32_t size);
+
+void load_debug_symbols(VM *vm, const uint8_t *data, uint32_t size, int format) {
     if (!vm || !data || size < 4) {
         return;
     }
@@ -14,6 +16,11 @@ void load_debug_symbols(VM *vm, const uint8_t *data, uint32_t size) {
     
     memset(vm->debug_info, 0, sizeof(DebugInfo));
     
+    if (format == DEBUG_FORMAT_RANGES) {
+        load_debug_ranges(vm, data, size);
+        return;
+    }
+    
     const uint8_t *ptr = data;
     
     // Read symbol count
@@ -119,6 +126,7 @@ void load_debug_symbols(VM *vm, const uint8_t *data, uint32_t size) {
         // Address
         if (ptr + 4 >= data + size) break;
         line->address = *((uint32_t*)ptr);
+        line->end_address = line->address + 1;
         ptr += 4;
         
         // Line number
@@ -233,30 +241,382 @@ void load_debug_symbols(VM *vm, const uint8_t *data, uint32_t size) {
            vm->debug_info->symbol_count, vm->debug_info->source_line_count);
 }
 
+// Entry of the shared string table, or NULL for an invalid index
+static char* debug_string(DebugInfo *info, uint32_t index) {
+    return index < info->string_count ? info->strings[index] : NULL;
+}
+
+// Load a v1.1 table: a string table, the symbols and one entry per range of
+// addresses produced by a source line. Strings are allocated once and shared.
+static void load_debug_ranges(VM *vm, const uint8_t *data, uint32_t size) {
+    DebugInfo *info = vm->debug_info;
+    const uint8_t *ptr = data;
+    const uint8_t *end = data + size;
+    
+    // String table
+    uint32_t string_count = *((uint32_t*)ptr);
+    ptr += 4;
+    
+    // Always allocated: a non-NULL table marks shared strings for free_debug_info
+    info->strings = (char**)calloc(string_count + 1, sizeof(char*));
+    if (!info->strings) {
+        free(info);
+        vm->debug_info = NULL;
+        return;
+    }
+    
+    for (uint32_t i = 0; i < string_count; i++) {
+        if (ptr + 2 > end) return;
+        uint16_t len = *((uint16_t*)ptr);
+        ptr += 2;
+        if (ptr + len > end) return;
+        
+        info->strings[i] = (char*)malloc(len + 1);
+        if (!info->strings[i]) return;
+        memcpy(info->strings[i], ptr, len);
+        info->strings[i][len] = '\0';
+        ptr += len;
+        info->string_count = i + 1;
+    }
+    
+    // Symbols
+    if (ptr + 4 > end) return;
+    uint32_t symbol_count = *((uint32_t*)ptr);
+    ptr += 4;
+    
+    printf("Loading %u symbols...\n", symbol_count);
+    
+    info->symbols = (Symbol*)calloc(symbol_count + 1, sizeof(Symbol));
+    if (!info->symbols) return;
+    
+    for (uint32_t i = 0; i < symbol_count; i++) {
+        if (ptr + 2 > end) break;
+        uint16_t name_len = *((uint16_t*)ptr);
+        ptr += 2;
+        if (ptr + name_len + 13 > end) break;
+        
+        Symbol *sym = &info->symbols[i];
+        sym->name = (char*)malloc(name_len + 1);
+        if (!sym->name) break;
+        memcpy(sym->name, ptr, name_len);
+        sym->name[name_len] = '\0';
+        ptr += name_len;
+        
+        sym->address = *((uint32_t*)ptr);
+        sym->type = ptr[4];
+        sym->line_num = *((uint32_t*)(ptr + 5));
+        sym->source_file = debug_string(info, *((uint32_t*)(ptr + 9)));
+        if (sym->source_file && !sym->source_file[0]) {
+            sym->source_file = NULL;
+        }
+        ptr += 13;
+        info->symbol_count = i + 1;
+    }
+    
+    // Source line ranges, sorted by address
+    if (ptr + 4 > end) return;
+    uint32_t range_count = *((uint32_t*)ptr);
+    ptr += 4;
+    
+    printf("Loading %u source line ranges...\n", range_count);
+    
+    info->source_lines = (SourceLine*)calloc(range_count + 1, sizeof(SourceLine));
+    if (!info->source_lines) return;
+    
+    for (uint32_t i = 0; i < range_count && ptr + 20 <= end; i++) {
+        SourceLine *line = &info->source_lines[i];
+        line->address = *((uint32_t*)ptr);
+        line->end_address = *((uint32_t*)(ptr + 4));
+        line->line_num = *((uint32_t*)(ptr + 8));
+        line->source = debug_string(info, *((uint32_t*)(ptr + 12)));
+        line->source_file = debug_string(info, *((uint32_t*)(ptr + 16)));
+        if (line->source_file && !line->source_file[0]) {
+            line->source_file = NULL;
+        }
+        ptr += 20;
+        info->source_line_count = i + 1;
+    }
+    
+    printf("Debug symbols loaded: %u symbols, %u source line ranges, %u strings\n", 
+           info->symbol_count, info->source_line_count, info->string_count);
+}
+
+// Read an unsigned LEB128 value; a truncated value leaves *ptr at end
+uint32_t debug_read_uleb128(const uint8_t **ptr, const uint8_t *end) {
+    uint32_t value = 0;
+    int shift = 0;
+    while (*ptr < end) {
+        uint8_t byte = *(*ptr)++;
+        if (shift < 32) {
+            value |= (uint32_t)(byte & 0x7F) << shift;
+        }
+        shift += 7;
+        if (!(byte & 0x80)) {
+            return value;
+        }
+    }
+    return value;
+}
+
+// Read a signed LEB128 value; a truncated value leaves *ptr at end
+int32_t debug_read_sleb128(const uint8_t **ptr, const uint8_t *end) {
+    uint32_t value = 0;
+    int shift = 0;
+    uint8_t byte = 0;
+    while (*ptr < end) {
+        byte = *(*ptr)++;
+        if (shift < 32) {
+            value |= (uint32_t)(byte & 0x7F) << shift;
+        }
+        shift += 7;
+        if (!(byte & 0x80)) {
+            break;
+        }
+    }
+    if (shift < 32 && (byte & 0x40)) {
+        value |= ~0u << shift;
+    }
+    return (int32_t)value;
+}
+
+// Load the v2 debug sections: a string table, the symbols and the source
+// line ranges, every number LEB128-encoded and addresses delta-encoded.
+void load_debug_sections(VM *vm, const uint8_t *strings, uint32_t strings_size,
+                         const uint8_t *symbols, uint32_t symbols_size,
+                         const uint8_t *lines, uint32_t lines_size) {
+    if (!vm || !strings) {
+        return;
+    }
+    
+    vm->debug_info = (DebugInfo*)calloc(1, sizeof(DebugInfo));
+    if (!vm->debug_info) {
+        return;
+    }
+    DebugInfo *info = vm->debug_info;
+    
+    // String table
+    const uint8_t *ptr = strings;
+    const uint8_t *end = strings + strings_size;
+    uint32_t string_count = debug_read_uleb128(&ptr, end);
+    if (string_count > strings_size) {
+        string_count = 0;  // Corrupt count: at least one byte per string
+    }
+    
+    // Always allocated: a non-NULL table marks shared strings for free_debug_info
+    info->strings = (char**)calloc(string_count + 1, sizeof(char*));
+    if (!info->strings) {
+        free(info);
+        vm->debug_info = NULL;
+        return;
+    }
+    
+    for (uint32_t i = 0; i < string_count && ptr < end; i++) {
+        uint32_t len = debug_read_uleb128(&ptr, end);
+        if (len > (uint32_t)(end - ptr)) break;
+        
+        info->strings[i] = (char*)malloc(len + 1);
+        if (!info->strings[i]) break;
+        memcpy(info->strings[i], ptr, len);
+        info->strings[i][len] = '\0';
+        ptr += len;
+        info->string_count = i + 1;
+    }
+    
+    // Symbols, sorted by address
+    if (symbols) {
+        ptr = symbols;
+        end = symbols + symbols_size;
+        uint32_t symbol_count = debug_read_uleb128(&ptr, end);
+        if (symbol_count > symbols_size) {
+            symbol_count = 0;
+        }
+        
+        printf("Loading %u symbols...\n", symbol_count);
+        
+        info->symbols = (Symbol*)calloc(symbol_count + 1, sizeof(Symbol));
+        uint32_t address = 0;
+        for (uint32_t i = 0; info->symbols && i < symbol_count && ptr < end; i++) {
+            Symbol *sym = &info->symbols[i];
+            const char *name = debug_string(info, debug_read_uleb128(&ptr, end));
+            address += debug_read_uleb128(&ptr, end);
+            sym->address = address;
+            sym->type = (uint8_t)debug_read_uleb128(&ptr, end);
+            sym->line_num = debug_read_uleb128(&ptr, end);
+            sym->source_file = debug_string(info, debug_read_uleb128(&ptr, end));
+            if (sym->source_file && !sym->source_file[0]) {
+                sym->source_file = NULL;
+            }
+            
+            // Symbol names are owned by the symbol, as in the other formats
+            sym->name = strdup(name ? name : "");
+            if (!sym->name) break;
+            info->symbol_count = i + 1;
+        }
+    }
+    
+    // Source line ranges, sorted by address
+    if (lines) {
+        ptr = lines;
+        end = lines + lines_size;
+        uint32_t range_count = debug_read_uleb128(&ptr, end);
+        if (range_count > lines_size) {
+            range_count = 0;
+        }
+        
+        printf("Loading %u source line ranges...\n", range_count);
+        
+        info->source_lines = (SourceLine*)calloc(range_count + 1, sizeof(SourceLine));
+        uint32_t address = 0;
+        uint32_t line_num = 0;
+        for (uint32_t i = 0; info->source_lines && i < range_count && ptr < end; i++) {
+            SourceLine *line = &info->source_lines[i];
+            line->address = address + debug_read_uleb128(&ptr, end);
+            line->end_address = line->address + debug_read_uleb128(&ptr, end);
+            line_num += debug_read_sleb128(&ptr, end);
+            line->line_num = line_num;
+            line->source = debug_string(info, debug_read_uleb128(&ptr, end));
+            line->source_file = debug_string(info, debug_read_uleb128(&ptr, end));
+            if (line->source_file && !line->source_file[0]) {
+                line->source_file = NULL;
+            }
+            address = line->end_address;
+            info->source_line_count = i + 1;
+        }
+    }
+    
+    printf("Debug symbols loaded: %u symbols, %u source line ranges, %u strings\n", 
+           info->symbol_count, info->source_line_count, info->string_count);
+}
+
+// Path of the .vmdbg file that goes with a program: its extension replaced
+char* debug_sidecar_path(const char *program_file) {
+    const char *slash = strrchr(program_file, '/');
+    const char *dot = strrchr(program_file, '.');
+    size_t stem = (dot && (!slash || dot > slash)) ? (size_t)(dot - program_file) : strlen(program_file);
+    
+    char *path = (char*)malloc(stem + sizeof(DEBUG_SIDECAR_EXTENSION));
+    if (path) {
+        memcpy(path, program_file, stem);
+        strcpy(path + stem, DEBUG_SIDECAR_EXTENSION);
+    }
+    return path;
+}
+
+// Read the debug sections of a v2 binary or .vmdbg file. A .vmdbg file is
+// only used if its build ID matches the one of the loaded program.
+static void load_debug_file(VM *vm, const char *path) {
+    FILE *file = fopen(path, "rb");
+    if (!file) {
+        printf("Warning: Debug information not found: %s\n", path);
+        return;
+    }
+    
+    fseek(file, 0, SEEK_END);
+    long size = ftell(file);
+    fseek(file, 0, SEEK_SET);
+    
+    uint8_t *buffer = (size >= VM32_V2_HEADER_SIZE) ? (uint8_t*)malloc(size) : NULL;
+    if (!buffer || fread(buffer, 1, size, file) != (size_t)size) {
+        printf("Warning: Failed to read debug information: %s\n", path);
+        free(buffer);
+        fclose(file);
+        return;
+    }
+    fclose(file);
+    
+    int sidecar = memcmp(buffer, DEBUG_SIDECAR_MAGIC, 4) == 0;
+    uint16_t major = *((uint16_t*)(buffer + 4));
+    uint32_t header_size = *((uint32_t*)(buffer + 8));
+    uint32_t section_count = *((uint32_t*)(buffer + 16));
+    if ((!sidecar && memcmp(buffer, "VM32", 4) != 0) || major < 2 || 
+        header_size > (uint32_t)size || header_size < VM32_V2_HEADER_SIZE ||
+        section_count > (header_size - VM32_V2_HEADER_SIZE) / VM32_V2_SECTION_SIZE) {
+        printf("Warning: Invalid debug information file: %s\n", path);
+        free(buffer);
+        return;
+    }
+    
+    const uint8_t *sections[VM32_SECTION_BUILD_ID + 1] = {0};
+    uint32_t sizes[VM32_SECTION_BUILD_ID + 1] = {0};
+    for (uint32_t i = 0; i < section_count; i++) {
+        const uint8_t *entry = buffer + VM32_V2_HEADER_SIZE + i * VM32_V2_SECTION_SIZE;
+        uint32_t type = *((uint32_t*)entry);
+        uint32_t offset = *((uint32_t*)(entry + 8));
+        uint32_t section_size = *((uint32_t*)(entry + 12));
+        if (type <= VM32_SECTION_BUILD_ID && offset <= (uint32_t)size && 
+            section_size <= (uint32_t)size - offset) {
+            sections[type] = buffer + offset;
+            sizes[type] = section_size;
+        }
+    }
+    
+    if (sidecar && (!vm->has_build_id || sizes[VM32_SECTION_BUILD_ID] != VM32_BUILD_ID_SIZE ||
+                    memcmp(sections[VM32_SECTION_BUILD_ID], vm->build_id, VM32_BUILD_ID_SIZE) != 0)) {
+        printf("Warning: %s does not match the program (build ID differs)\n", path);
+        free(buffer);
+        return;
+    }
+    
+    if (sections[VM32_SECTION_STRINGS]) {
+        load_debug_sections(vm, sections[VM32_SECTION_STRINGS], sizes[VM32_SECTION_STRINGS],
+                            sections[VM32_SECTION_SYMBOLS], sizes[VM32_SECTION_SYMBOLS],
+                            sections[VM32_SECTION_LINES], sizes[VM32_SECTION_LINES]);
+    }
+    free(buffer);
+}
+
+// Debug information of the loaded program, read from disk on first use in
+// debug mode. Returns NULL if there is none.
+DebugInfo* debug_get_info(VM *vm) {
+    if (!vm) {
+        return NULL;
+    }
+    if (!vm->debug_info && vm->debug_mode && vm->debug_file && !vm->debug_load_attempted) {
+        vm->debug_load_attempted = true;
+        load_debug_file(vm, vm->debug_file);
+    }
+    return vm->debug_info;
+}
+
 // Function to free debug info
 void free_debug_info(VM *vm) {
     if (!vm || !vm->debug_info) {
         return;
     }
     
+    // Strings owned by the shared string table are freed with it
+    int shared_strings = vm->debug_info->strings != NULL;
+    
     // Free symbols
     if (vm->debug_info->symbols) {
         for (uint32_t i = 0; i < vm->debug_info->symbol_count; i++) {
             free(vm->debug_info->symbols[i].name);
-            free(vm->debug_info->symbols[i].source_file);
+            if (!shared_strings) {
+                free(vm->debug_info->symbols[i].source_file);
+            }
         }
         free(vm->debug_info->symbols);
     }
     
     // Free source lines
     if (vm->debug_info->source_lines) {
-        for (uint32_t i = 0; i < vm->debug_info->source_line_count; i++) {
-            free(vm->debug_info->source_lines[i].source);
-            free(vm->debug_info->source_lines[i].source_file);
+        if (!shared_strings) {
+            for (uint32_t i = 0; i < vm->debug_info->source_line_count; i++) {
+                free(vm->debug_info->source_lines[i].source);
+                free(vm->debug_info->source_lines[i].source_file);
+            }
         }
         free(vm->debug_info->source_lines);
     }
     
+    // Free the string table
+    if (shared_strings) {
+        for (uint32_t i = 0; i < vm->debug_info->string_count; i++) {
+            free(vm->debug_info->strings[i]);
+        }
+        free(vm->debug_info->strings);
+    }
+    
     // Free debug info structure
     free(vm->debug_info);
     vm->debug_info = NULL;
@@ -264,7 +624,7 @@ void free_debug_info(VM *vm) {
 
 // Helper function to find symbol by address
 Symbol* find_symbol_by_address(VM *vm, uint32_t address) {
-    if (!vm || !vm->debug_info) {
+    if (!vm || !debug_get_info(vm)) {
         return NULL;
     }
     
@@ -291,7 +651,7 @@ Symbol* find_symbol_by_address(VM *vm, uint32_t address) {
 }
 
 void debug_print_source_info(VM *vm) {
-    if (!vm || !vm->debug_info) {
+    if (!vm || !debug_get_info(vm)) {
         printf("No debug information available\n");
         return;
     }
@@ -323,7 +683,7 @@ void debug_print_source_info(VM *vm) {
 }
 
 void debug_dump_source_mapping(VM *vm) {
-    if (!vm || !vm->debug_info) {
+    if (!vm || !debug_get_info(vm)) {
         printf("No debug information available\n");
         return;
     }
@@ -379,7 +739,7 @@ void debug_dump_source_mapping(VM *vm) {
 
 // Function to find source line by address
 SourceLine* find_source_line_by_address(VM *vm, uint32_t address) {
-    if (!vm || !vm->debug_info) {
+    if (!vm || !debug_get_info(vm)) {
         return NULL;
     }
     
@@ -394,7 +754,7 @@ SourceLine* find_source_line_by_address(VM *vm, uint32_t address) {
     for (uint32_t i = 0; i < vm->debug_info->source_line_count; i++) {
         SourceLine *line = &vm->debug_info->source_lines[i];
         
-        if (line->address == address) {
+        if (address >= line->address && address < line->end_address) {
             // Skip invalid entries
             if (!line->source) {
                 continue;
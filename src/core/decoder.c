@@ -233,6 +233,13 @@ void vm_disassemble_instruction(VM *vm, Instruction *instr, char *buffer, size_t
             }
             break;
             
+        case MEMCPY_OP:
+        case MEMSET_OP:
+            // Rdest, Rsrc/Rvalue, size
+            snprintf(operands, sizeof(operands), "R%d, R%d, 0x%03X", 
+                     instr->reg1, instr->reg2, instr->immediate);
+            break;
+            
         case LOOP_OP:
             // Reg, Target
             snprintf(operands, sizeof(operands), "R%d, 0x%03X", 
@@ -6,6 +6,7 @@
 #include "decoder.h"
 #include "memory.h"
 #include "disassembler.h"
+#include "debug.h"
 
 // Print register name with optional suffix
 void print_register(uint8_t reg, int with_suffix) {
@@ -274,10 +275,17 @@ void disassemble_instruction(uint32_t address, uint32_t instruction) {
             break;
             
         // Memory management instructions
-        case ALLOC_OP:
-        case FREE_OP:
         case MEMCPY_OP:
         case MEMSET_OP:
+            // Destination, source (or fill value) and size
+            print_register(reg1, 0);
+            printf(", ");
+            print_register(reg2, 0);
+            printf(", 0x%03X", immediate);
+            break;
+            
+        case ALLOC_OP:
+        case FREE_OP:
         case PROTECT_OP:
             // These would be handled similar to other instructions
             // based on their specific formats
@@ -458,26 +466,114 @@ int disassemble_file(const char *filename) {
     uint16_t major_ver = *((uint16_t*)(buffer + 4));
     uint16_t minor_ver = *((uint16_t*)(buffer + 6));
     uint32_t header_size = *((uint32_t*)(buffer + 8));
-    uint32_t code_base = *((uint32_t*)(buffer + 12));
-    uint32_t code_size = *((uint32_t*)(buffer + 16));
-    uint32_t data_base = *((uint32_t*)(buffer + 20));
-    uint32_t data_size = *((uint32_t*)(buffer + 24));
-    uint32_t symbol_size = *((uint32_t*)(buffer + 28));
+    uint32_t symbol_size = 0, symbol_offset = 0;
+    uint32_t strings_size = 0, strings_offset = 0;
+    const uint8_t *build_id = NULL;
+    
+    // The code and data sections are copied to an image of both segments,
+    // indexed by address, where zero-fill sections are simply left at 0
+    uint8_t *image = (uint8_t*)calloc(DATA_SEGMENT_BASE + DATA_SEGMENT_SIZE, 1);
+    uint32_t code_end = CODE_SEGMENT_BASE, data_end = DATA_SEGMENT_BASE, zero_fill = 0;
+    if (!image) {
+        fprintf(stderr, "Error: Memory allocation failed\n");
+        free(buffer);
+        return 1;
+    }
     
-    // Calculate file offsets
-    uint32_t code_offset = header_size;
-    uint32_t data_offset = code_offset + code_size;
-    uint32_t symbol_offset = data_offset + data_size;
+    if (major_ver >= 2) {
+        // v2: find the sections in the section table
+        uint32_t section_count = *((uint32_t*)(buffer + 16));
+        if (header_size > file_size || header_size < VM32_V2_HEADER_SIZE ||
+            section_count > (header_size - VM32_V2_HEADER_SIZE) / VM32_V2_SECTION_SIZE) {
+            fprintf(stderr, "Error: Invalid VM32 section table\n");
+            free(image);
+            free(buffer);
+            return 1;
+        }
+        
+        for (uint32_t i = 0; i < section_count; i++) {
+            const uint8_t *entry = buffer + VM32_V2_HEADER_SIZE + i * VM32_V2_SECTION_SIZE;
+            uint32_t type = *((uint32_t*)entry);
+            uint32_t address = *((uint32_t*)(entry + 4));
+            uint32_t offset = *((uint32_t*)(entry + 8));
+            uint32_t size = *((uint32_t*)(entry + 12));
+            if (type != VM32_SECTION_ZERO && (offset > file_size || size > file_size - offset)) {
+                continue;
+            }
+            
+            if (type == VM32_SECTION_CODE || type == VM32_SECTION_DATA || type == VM32_SECTION_ZERO) {
+                int in_code = type == VM32_SECTION_CODE || (type == VM32_SECTION_ZERO && address < DATA_SEGMENT_BASE);
+                uint32_t limit = in_code ? CODE_SEGMENT_BASE + CODE_SEGMENT_SIZE : DATA_SEGMENT_BASE + DATA_SEGMENT_SIZE;
+                if (address > limit || size > limit - address || (type == VM32_SECTION_DATA && address < DATA_SEGMENT_BASE)) {
+                    fprintf(stderr, "Warning: Section %u at 0x%04X is outside its segment\n", i, address);
+                    continue;
+                }
+                if (type != VM32_SECTION_ZERO) {
+                    memcpy(image + address, buffer + offset, size);
+                }
+                if (in_code) {
+                    code_end = address + size > code_end ? address + size : code_end;
+                } else if (type == VM32_SECTION_DATA) {
+                    data_end = address + size > data_end ? address + size : data_end;
+                } else {
+                    zero_fill += size;
+                }
+            } else if (type == VM32_SECTION_STRINGS) {
+                strings_size = size; strings_offset = offset;
+            } else if (type == VM32_SECTION_SYMBOLS) {
+                symbol_size = size; symbol_offset = offset;
+            } else if (type == VM32_SECTION_BUILD_ID && size == VM32_BUILD_ID_SIZE) {
+                build_id = buffer + offset;
+            }
+        }
+    } else {
+        uint32_t code_base = *((uint32_t*)(buffer + 12));
+        uint32_t code_size = *((uint32_t*)(buffer + 16));
+        uint32_t data_base = *((uint32_t*)(buffer + 20));
+        uint32_t data_size = *((uint32_t*)(buffer + 24));
+        symbol_size = *((uint32_t*)(buffer + 28));
+        
+        // Calculate file offsets
+        uint32_t code_offset = header_size;
+        uint32_t data_offset = code_offset + code_size;
+        symbol_offset = data_offset + data_size;
+        
+        if (code_base != CODE_SEGMENT_BASE || code_size > CODE_SEGMENT_SIZE ||
+            data_base != DATA_SEGMENT_BASE || data_size > DATA_SEGMENT_SIZE ||
+            symbol_offset > file_size || symbol_size > file_size - symbol_offset) {
+            fprintf(stderr, "Error: Invalid VM32 header\n");
+            free(image);
+            free(buffer);
+            return 1;
+        }
+        memcpy(image + code_base, buffer + code_offset, code_size);
+        memcpy(image + data_base, buffer + data_offset, data_size);
+        code_end = code_base + code_size;
+        data_end = data_base + data_size;
+    }
     
+    uint32_t code_size = code_end - CODE_SEGMENT_BASE;
+    uint32_t data_size = data_end - DATA_SEGMENT_BASE;
     printf("VM32 Binary Format v%d.%d\n", major_ver, minor_ver);
-    printf("  Code segment: 0x%04X, %d bytes\n", code_base, code_size);
-    printf("  Data segment: 0x%04X, %d bytes\n", data_base, data_size);
-    printf("  Symbol table: %d bytes\n", symbol_size);
+    printf("  Code segment: 0x%04X, %d bytes\n", CODE_SEGMENT_BASE, code_size);
+    printf("  Data segment: 0x%04X, %d bytes\n", DATA_SEGMENT_BASE, data_size);
+    if (zero_fill > 0) {
+        printf("  Zero fill:    %d bytes (not stored in the file)\n", zero_fill);
+    }
+    printf("  Symbol table: %d bytes\n", symbol_size + strings_size);
     printf("\n");
     
     // Load and process symbol table if available
     SymbolTable symbols = {0};
-    if (symbol_size > 0) {
+    if (major_ver >= 2) {
+        if (symbol_size > 0 && strings_size > 0) {
+            parse_symbol_sections(buffer + strings_offset, strings_size,
+                                  buffer + symbol_offset, symbol_size, &symbols);
+        } else if (build_id) {
+            parse_sidecar_symbols(filename, build_id, &symbols);
+        }
+    } else if (symbol_size > 0 && minor_ver == 0) {
+        // v1.1 range tables are only read by the VM's debugger
         parse_symbol_table(buffer + symbol_offset, symbol_size, &symbols);
     }
     
@@ -487,19 +583,13 @@ int disassemble_file(const char *filename) {
         printf("Address  Raw Instr.  Assembly\n");
         printf("-------- ----------  --------\n");
         
-        for (uint32_t offset = 0; offset < code_size; offset += 4) {
-            if (offset + 4 > code_size) {
-                break;
-            }
-            
-            uint32_t address = code_base + offset;
-            
+        for (uint32_t address = CODE_SEGMENT_BASE; address + 4 <= code_end; address += 4) {
             // Read the instruction
             uint32_t instruction = 
-                  ((uint32_t)buffer[code_offset + offset]) |
-                  ((uint32_t)buffer[code_offset + offset + 1] << 8) |
-                  ((uint32_t)buffer[code_offset + offset + 2] << 16) |
-                  ((uint32_t)buffer[code_offset + offset + 3] << 24);
+                  ((uint32_t)image[address]) |
+                  ((uint32_t)image[address + 1] << 8) |
+                  ((uint32_t)image[address + 2] << 16) |
+                  ((uint32_t)image[address + 3] << 24);
             
             // Check if this address has a label
             const char* label = disassemble_find_symbol_for_address(&symbols, address);
@@ -520,12 +610,13 @@ int disassemble_file(const char *filename) {
         
         for (uint32_t offset = 0; offset < data_size; offset += 16) {
             uint32_t block_size = (offset + 16 <= data_size) ? 16 : data_size - offset;
-            disassemble_dump_memory(buffer + data_offset + offset, data_base + offset, block_size);
+            disassemble_dump_memory(image, DATA_SEGMENT_BASE + offset, block_size);
         }
     }
     
     // Free resources
     free_symbol_table(&symbols);
+    free(image);
     free(buffer);
     return 0;
 }
@@ -596,6 +687,146 @@ void parse_symbol_table(const uint8_t *data, uint32_t size, SymbolTable *table)
     printf("Loaded %d symbols from debug information\n", table->count);
 }
 
+// Read the symbols of a v2 binary from its string table and symbol section
+void parse_symbol_sections(const uint8_t *strings, uint32_t strings_size,
+                           const uint8_t *symbols, uint32_t symbols_size, SymbolTable *table) {
+    if (!strings || !symbols || !table) {
+        return;
+    }
+    
+    // Locate every string of the string table
+    const uint8_t *ptr = strings;
+    const uint8_t *end = strings + strings_size;
+    uint32_t string_count = debug_read_uleb128(&ptr, end);
+    if (string_count > strings_size) {
+        return;
+    }
+    const uint8_t **string_data = (const uint8_t**)calloc(string_count + 1, sizeof(uint8_t*));
+    uint32_t *string_lengths = (uint32_t*)calloc(string_count + 1, sizeof(uint32_t));
+    if (!string_data || !string_lengths) {
+        fprintf(stderr, "Error: Failed to allocate memory for symbol table\n");
+        free(string_data);
+        free(string_lengths);
+        return;
+    }
+    
+    uint32_t found = 0;
+    while (found < string_count && ptr < end) {
+        uint32_t len = debug_read_uleb128(&ptr, end);
+        if (len > (uint32_t)(end - ptr)) break;
+        string_data[found] = ptr;
+        string_lengths[found] = len;
+        ptr += len;
+        found++;
+    }
+    
+    // Symbols, with delta-encoded addresses
+    ptr = symbols;
+    end = symbols + symbols_size;
+    uint32_t symbol_count = debug_read_uleb128(&ptr, end);
+    if (symbol_count > symbols_size) {
+        symbol_count = 0;
+    }
+    
+    table->names = (char**)calloc(symbol_count + 1, sizeof(char*));
+    table->addresses = (uint32_t*)calloc(symbol_count + 1, sizeof(uint32_t));
+    table->types = (uint8_t*)calloc(symbol_count + 1, sizeof(uint8_t));
+    table->count = 0;
+    
+    if (!table->names || !table->addresses || !table->types) {
+        fprintf(stderr, "Error: Failed to allocate memory for symbol table\n");
+        free(table->names);
+        free(table->addresses);
+        free(table->types);
+        table->names = NULL;
+        free(string_data);
+        free(string_lengths);
+        return;
+    }
+    
+    uint32_t address = 0;
+    uint32_t i;
+    for (i = 0; i < symbol_count && ptr < end; i++) {
+        uint32_t name = debug_read_uleb128(&ptr, end);
+        address += debug_read_uleb128(&ptr, end);
+        table->addresses[i] = address;
+        table->types[i] = (uint8_t)debug_read_uleb128(&ptr, end);
+        debug_read_uleb128(&ptr, end);  // Line number
+        debug_read_uleb128(&ptr, end);  // Source file
+        
+        uint32_t len = name < found ? string_lengths[name] : 0;
+        table->names[i] = (char*)malloc(len + 1);
+        if (!table->names[i]) {
+            break;
+        }
+        if (len) {
+            memcpy(table->names[i], string_data[name], len);
+        }
+        table->names[i][len] = '\0';
+    }
+    table->count = i;
+    
+    free(string_data);
+    free(string_lengths);
+    
+    printf("Loaded %d symbols from debug information\n", table->count);
+}
+
+// Read the symbols of a binary built with --split-debug from its .vmdbg file
+void parse_sidecar_symbols(const char *filename, const uint8_t *build_id, SymbolTable *table) {
+    char *path = debug_sidecar_path(filename);
+    FILE *file = path ? fopen(path, "rb") : NULL;
+    if (!file) {
+        free(path);
+        return;
+    }
+    
+    fseek(file, 0, SEEK_END);
+    long size = ftell(file);
+    fseek(file, 0, SEEK_SET);
+    uint8_t *buffer = (size >= VM32_V2_HEADER_SIZE) ? (uint8_t*)malloc(size) : NULL;
+    if (!buffer || fread(buffer, 1, size, file) != (size_t)size) {
+        free(buffer);
+        fclose(file);
+        free(path);
+        return;
+    }
+    fclose(file);
+    
+    const uint8_t *strings = NULL, *symbols = NULL, *sidecar_id = NULL;
+    uint32_t strings_size = 0, symbols_size = 0;
+    uint32_t header_size = *((uint32_t*)(buffer + 8));
+    uint32_t section_count = *((uint32_t*)(buffer + 16));
+    if (memcmp(buffer, DEBUG_SIDECAR_MAGIC, 4) == 0 && header_size <= size && header_size >= VM32_V2_HEADER_SIZE &&
+        section_count <= (header_size - VM32_V2_HEADER_SIZE) / VM32_V2_SECTION_SIZE) {
+        for (uint32_t i = 0; i < section_count; i++) {
+            const uint8_t *entry = buffer + VM32_V2_HEADER_SIZE + i * VM32_V2_SECTION_SIZE;
+            uint32_t type = *((uint32_t*)entry);
+            uint32_t offset = *((uint32_t*)(entry + 8));
+            uint32_t section_size = *((uint32_t*)(entry + 12));
+            if (offset > size || section_size > size - offset) {
+                continue;
+            }
+            
+            if (type == VM32_SECTION_STRINGS) {
+                strings = buffer + offset; strings_size = section_size;
+            } else if (type == VM32_SECTION_SYMBOLS) {
+                symbols = buffer + offset; symbols_size = section_size;
+            } else if (type == VM32_SECTION_BUILD_ID && section_size == VM32_BUILD_ID_SIZE) {
+                sidecar_id = buffer + offset;
+            }
+        }
+    }
+    
+    if (!sidecar_id || memcmp(sidecar_id, build_id, VM32_BUILD_ID_SIZE) != 0) {
+        fprintf(stderr, "Warning: %s does not match the program (build ID differs)\n", path);
+    } else if (strings && symbols) {
+        parse_symbol_sections(strings, strings_size, symbols, symbols_size, table);
+    }
+    free(buffer);
+    free(path);
+}
+
 void free_symbol_table(SymbolTable *table) {
     if (!table) {
         return;
@@ -245,7 +245,7 @@ void debug_print_current_context(VM *vm) {
     printf("PC: 0x%04X", pc);
     
     // Find symbol if debug info available
-    if (vm->debug_info) {
+    if (debug_get_info(vm)) {
         Symbol *sym = find_symbol_by_address(vm, pc);
         if (sym) {
             uint32_t offset = pc - sym->address;
@@ -358,7 +358,7 @@ void debug_print_current_context(VM *vm) {
 
 // List all symbols
 void debug_list_symbols(VM *vm) {
-    if (!vm || !vm->debug_info) {
+    if (!vm || !debug_get_info(vm)) {
         printf("No debug information available\n");
         return;
     }
@@ -398,7 +398,7 @@ bool debug_set_breakpoint(VM *vm, const char *location) {
         // Decimal address
         address = strtoul(location, NULL, 10);
         found = true;
-    } else if (vm->debug_info) {
+    } else if (debug_get_info(vm)) {
         // Try to find symbol by name
         for (uint32_t i = 0; i < vm->debug_info->symbol_count; i++) {
             if (strcmp(vm->debug_info->symbols[i].name, location) == 0) {
@@ -423,7 +423,7 @@ bool debug_set_breakpoint(VM *vm, const char *location) {
     printf("Breakpoint %d set at 0x%04X", breakpoint_count, address);
     
     // Show symbol if available
-    if (vm->debug_info) {
+    if (debug_get_info(vm)) {
         Symbol *sym = find_symbol_by_address(vm, address);
         if (sym) {
             uint32_t offset = address - sym->address;
@@ -468,7 +468,7 @@ void debug_list_breakpoints(VM *vm) {
                breakpoints[i].enabled ? "enabled" : "disabled");
         
         // Show symbol if available
-        if (vm->debug_info) {
+        if (debug_get_info(vm)) {
             Symbol *sym = find_symbol_by_address(vm, breakpoints[i].address);
             if (sym && strcmp(sym->name, breakpoints[i].name) != 0) {
                 uint32_t offset = breakpoints[i].address - sym->address;
@@ -544,7 +544,7 @@ void debug_execution(VM *vm) {
         }
         else if (strncmp(cmd, "n", 1) == 0 || strncmp(cmd, "next", 4) == 0) {
             // Step one line (not instruction)
-            if (vm->debug_info) {
+            if (debug_get_info(vm)) {
                 // Find current source line
                 SourceLine *current = find_source_line_by_address(vm, vm->registers[R3_PC]);
                 if (current) {
@@ -34,6 +34,9 @@ int vm_init(VM *vm, uint32_t memory_size) {
 
     vm->last_error = 0;
     vm->debug_info = NULL;
+    vm->debug_file = NULL;
+    vm->has_build_id = false;
+    vm->debug_load_attempted = false;
     
     return VM_ERROR_NONE;
 }
@@ -52,6 +55,11 @@ void vm_cleanup(VM *vm) {
         free(vm->io_devices);
         vm->io_devices = NULL;
     }
+    
+    // Free debug information
+    free_debug_info(vm);
+    free(vm->debug_file);
+    vm->debug_file = NULL;
 }
 
 // Reset the VM to initial state
@@ -201,6 +209,221 @@ void vm_io_write(VM *vm, uint16_t port, uint32_t value) {
     }
 }
 
+// Check that a code, data or zero-fill section fits in its memory segment.
+// A zero-fill section belongs to the segment its address is in.
+static int vm_check_section(VM *vm, uint32_t type, uint32_t address, uint32_t size) {
+    bool in_code = type == VM32_SECTION_CODE || (type == VM32_SECTION_ZERO && address < DATA_SEGMENT_BASE);
+    uint32_t base = in_code ? CODE_SEGMENT_BASE : DATA_SEGMENT_BASE;
+    uint32_t limit = in_code ? CODE_SEGMENT_SIZE : DATA_SEGMENT_SIZE;
+    
+    if (address < base || address - base > limit || size > limit - (address - base)) {
+        vm->last_error = VM_ERROR_SEGMENTATION_FAULT;
+        snprintf(vm->error_message, sizeof(vm->error_message), 
+                "%s section too large: %u bytes at 0x%04X", 
+                in_code ? "Code" : "Data", size, address);
+        return VM_ERROR_SEGMENTATION_FAULT;
+    }
+    return VM_ERROR_NONE;
+}
+
+// Validate the header of a VM32 v2 binary; returns the section count or -1
+static int vm_check_section_table(VM *vm, const uint8_t *header, uint32_t size) {
+    uint32_t header_size = *((uint32_t*)(header + 8));
+    uint32_t section_count = *((uint32_t*)(header + 16));
+    
+    if (size < VM32_V2_HEADER_SIZE || header_size > size || header_size < VM32_V2_HEADER_SIZE ||
+        section_count > (header_size - VM32_V2_HEADER_SIZE) / VM32_V2_SECTION_SIZE) {
+        vm->last_error = VM_ERROR_INVALID_ADDRESS;
+        snprintf(vm->error_message, sizeof(vm->error_message), 
+                "Invalid section table in program file");
+        return -1;
+    }
+    return (int)section_count;
+}
+
+// Load a VM32 v2 binary from memory: walk the section table, copy the code
+// and data sections into their segments, clear the zero-fill sections and,
+// in debug mode, load the debug sections. Unknown section types are skipped.
+static int vm_load_sections(VM *vm, const uint8_t *program, uint32_t size) {
+    int section_count = vm_check_section_table(vm, program, size);
+    if (section_count < 0) {
+        return VM_ERROR_INVALID_ADDRESS;
+    }
+    
+    const uint8_t *strings = NULL, *symbols = NULL, *lines = NULL;
+    uint32_t strings_size = 0, symbols_size = 0, lines_size = 0;
+    
+    for (int i = 0; i < section_count; i++) {
+        const uint8_t *entry = program + VM32_V2_HEADER_SIZE + i * VM32_V2_SECTION_SIZE;
+        uint32_t type = *((uint32_t*)entry);
+        uint32_t address = *((uint32_t*)(entry + 4));
+        uint32_t offset = *((uint32_t*)(entry + 8));
+        uint32_t section_size = *((uint32_t*)(entry + 12));
+        
+        if (type != VM32_SECTION_ZERO && (offset > size || section_size > size - offset)) {
+            vm->last_error = VM_ERROR_INVALID_ADDRESS;
+            snprintf(vm->error_message, sizeof(vm->error_message), 
+                    "Section %d extends past the end of the program file", i);
+            return VM_ERROR_INVALID_ADDRESS;
+        }
+        
+        switch (type) {
+            case VM32_SECTION_CODE:
+            case VM32_SECTION_DATA:
+                if (vm_check_section(vm, type, address, section_size) != VM_ERROR_NONE) {
+                    return VM_ERROR_SEGMENTATION_FAULT;
+                }
+                memcpy(vm->memory + address, program + offset, section_size);
+                break;
+            case VM32_SECTION_ZERO:
+                if (vm_check_section(vm, type, address, section_size) != VM_ERROR_NONE) {
+                    return VM_ERROR_SEGMENTATION_FAULT;
+                }
+                memset(vm->memory + address, 0, section_size);
+                break;
+            case VM32_SECTION_STRINGS:
+                strings = program + offset;
+                strings_size = section_size;
+                break;
+            case VM32_SECTION_SYMBOLS:
+                symbols = program + offset;
+                symbols_size = section_size;
+                break;
+            case VM32_SECTION_LINES:
+                lines = program + offset;
+                lines_size = section_size;
+                break;
+            default:
+                break;
+        }
+    }
+    
+    // Load debug symbols if present and debug mode is enabled
+    if (strings && vm->debug_mode) {
+        if (vm->debug_info) {
+            free_debug_info(vm);
+        }
+        load_debug_sections(vm, strings, strings_size, symbols, symbols_size, lines, lines_size);
+    }
+    
+    // Set PC to the entry point
+    vm->registers[R3_PC] = *((uint32_t*)(program + 12));
+    
+    return VM_ERROR_NONE;
+}
+
+// Load a VM32 v2 binary from an open file. Only the section table and the
+// code and data sections are read; the debug sections (embedded, or in the
+// .vmdbg file named by a build ID) are loaded on first use by debug_get_info.
+static int vm_load_sections_file(VM *vm, FILE *file, const char *filename, long file_size) {
+    uint8_t header[VM32_V2_HEADER_SIZE];
+    if (file_size < VM32_V2_HEADER_SIZE || fseek(file, 0, SEEK_SET) != 0 ||
+        fread(header, 1, VM32_V2_HEADER_SIZE, file) != VM32_V2_HEADER_SIZE) {
+        vm->last_error = VM_ERROR_IO_ERROR;
+        snprintf(vm->error_message, sizeof(vm->error_message), 
+                "Failed to read VM32 header: %s", filename);
+        return VM_ERROR_IO_ERROR;
+    }
+    
+    int section_count = vm_check_section_table(vm, header, (uint32_t)file_size);
+    if (section_count < 0) {
+        return VM_ERROR_INVALID_ADDRESS;
+    }
+    
+    uint8_t *table = (uint8_t *)malloc(section_count * VM32_V2_SECTION_SIZE + 1);
+    if (!table || fread(table, 1, section_count * VM32_V2_SECTION_SIZE, file) != 
+                  (size_t)section_count * VM32_V2_SECTION_SIZE) {
+        free(table);
+        vm->last_error = VM_ERROR_IO_ERROR;
+        snprintf(vm->error_message, sizeof(vm->error_message), 
+                "Failed to read section table: %s", filename);
+        return VM_ERROR_IO_ERROR;
+    }
+    
+    int has_debug_sections = 0;
+    int result = VM_ERROR_NONE;
+    
+    for (int i = 0; i < section_count && result == VM_ERROR_NONE; i++) {
+        const uint8_t *entry = table + i * VM32_V2_SECTION_SIZE;
+        uint32_t type = *((uint32_t*)entry);
+        uint32_t address = *((uint32_t*)(entry + 4));
+        uint32_t offset = *((uint32_t*)(entry + 8));
+        uint32_t section_size = *((uint32_t*)(entry + 12));
+        
+        if (type != VM32_SECTION_ZERO && (offset > file_size || section_size > file_size - offset)) {
+            vm->last_error = VM_ERROR_INVALID_ADDRESS;
+            snprintf(vm->error_message, sizeof(vm->error_message), 
+                    "Section %d extends past the end of the program file", i);
+            result = VM_ERROR_INVALID_ADDRESS;
+            break;
+        }
+        
+        switch (type) {
+            case VM32_SECTION_CODE:
+            case VM32_SECTION_DATA: {
+                result = vm_check_section(vm, type, address, section_size);
+                if (result != VM_ERROR_NONE) {
+                    break;
+                }
+                printf("  %s segment: 0x%04X - %d bytes\n", 
+                       type == VM32_SECTION_CODE ? "Code" : "Data", address, section_size);
+                
+                fseek(file, offset, SEEK_SET);
+                size_t bytes_read = fread(vm->memory + address, 1, section_size, file);
+                if (bytes_read != section_size) {
+                    vm->last_error = VM_ERROR_IO_ERROR;
+                    snprintf(vm->error_message, sizeof(vm->error_message), 
+                            "Failed to read section %d: %zu of %d bytes", i, bytes_read, section_size);
+                    result = VM_ERROR_IO_ERROR;
+                }
+                break;
+            }
+            case VM32_SECTION_ZERO:
+                result = vm_check_section(vm, type, address, section_size);
+                if (result != VM_ERROR_NONE) {
+                    break;
+                }
+                printf("  Zero fill: 0x%04X - %d bytes\n", address, section_size);
+                memset(vm->memory + address, 0, section_size);
+                break;
+            case VM32_SECTION_STRINGS:
+                has_debug_sections = 1;
+                break;
+            case VM32_SECTION_BUILD_ID:
+                if (section_size == VM32_BUILD_ID_SIZE) {
+                    fseek(file, offset, SEEK_SET);
+                    vm->has_build_id = fread(vm->build_id, 1, VM32_BUILD_ID_SIZE, file) == VM32_BUILD_ID_SIZE;
+                }
+                break;
+            default:
+                break;
+        }
+    }
+    free(table);
+    
+    if (result != VM_ERROR_NONE) {
+        return result;
+    }
+    
+    // Remember where the debug information lives
+    if (vm->debug_info) {
+        free_debug_info(vm);
+    }
+    free(vm->debug_file);
+    vm->debug_file = NULL;
+    vm->debug_load_attempted = false;
+    if (has_debug_sections) {
+        vm->debug_file = strdup(filename);
+    } else if (vm->has_build_id) {
+        vm->debug_file = debug_sidecar_path(filename);
+    }
+    
+    // Set PC to the entry point
+    vm->registers[R3_PC] = *((uint32_t*)(header + 12));
+    
+    return VM_ERROR_NONE;
+}
+
 // Load a program into memory
 int vm_load_program(VM *vm, const uint8_t *program, uint32_t size) {
     if (!vm || !program) {
@@ -216,6 +439,11 @@ int vm_load_program(VM *vm, const uint8_t *program, uint32_t size) {
         uint16_t version_minor = *((uint16_t*)(program + 6));
         uint32_t header_size = *((uint32_t*)(program + 8));
         
+        // v2: section table
+        if (version_major >= 2) {
+            return vm_load_sections(vm, program, size);
+        }
+        
         // Basic validation
         if (header_size > size) {
             vm->last_error = VM_ERROR_INVALID_ADDRESS;
@@ -269,7 +497,8 @@ int vm_load_program(VM *vm, const uint8_t *program, uint32_t size) {
         if (symbol_size > 0 && vm->debug_mode) {
             load_debug_symbols(vm, 
                               program + header_size + code_size + data_size, 
-                              symbol_size);
+                              symbol_size,
+                              version_minor >= 1 ? DEBUG_FORMAT_RANGES : DEBUG_FORMAT_PER_ADDRESS);
         }
         
         // Set PC to start of code segment
@@ -330,6 +559,15 @@ int vm_load_program_file(VM *vm, const char *filename) {
         // Parse header info
         uint16_t major_ver = *((uint16_t*)(header_buffer + 4));
         uint16_t minor_ver = *((uint16_t*)(header_buffer + 6));
+        
+        // v2: section table
+        if (major_ver >= 2) {
+            printf("Loading sectioned format binary (v%d.%d)\n", major_ver, minor_ver);
+            int result = vm_load_sections_file(vm, file, filename, file_size);
+            fclose(file);
+            return result;
+        }
+        
         uint32_t header_size = *((uint32_t*)(header_buffer + 8));
         uint32_t code_base = *((uint32_t*)(header_buffer + 12));
         uint32_t code_size = *((uint32_t*)(header_buffer + 16));
@@ -418,7 +656,8 @@ int vm_load_program_file(VM *vm, const char *filename) {
                     }
                     
                     // Load new debug info
-                    load_debug_symbols(vm, symbol_buffer, symbol_size);
+                    load_debug_symbols(vm, symbol_buffer, symbol_size,
+                                       minor_ver >= 1 ? DEBUG_FORMAT_RANGES : DEBUG_FORMAT_PER_ADDRESS);
                     free(symbol_buffer);
                 }
             }
@@ -0,0 +1,50 @@
+"""
+Exit status of the assembler's command line, which make relies on to stop
+when a program does not assemble.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ASSEMBLER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assembler', 'assembler.py')
+
+class AssemblerExitStatusTest(unittest.TestCase):
+    def assemble(self, source, *options):
+        """Run the assembler on source; returns (exit status, path of the output binary)."""
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        directory = temporary.name
+        source_file = os.path.join(directory, "program.asm")
+        output_file = os.path.join(directory, "program.bin")
+        with open(source_file, 'w') as f:
+            f.write(source)
+        options = [option.replace('{dir}', directory) for option in options]
+        result = subprocess.run([sys.executable, ASSEMBLER, '-q', *options, '-o', output_file, source_file],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return result.returncode, output_file
+
+    def test_valid_source_exits_zero(self):
+        status, output_file = self.assemble(".text\nstart:\n    LOAD R0, #1\n    HALT\n")
+        self.assertEqual(status, 0)
+        self.assertTrue(os.path.exists(output_file))
+
+    def test_invalid_source_exits_nonzero(self):
+        status, output_file = self.assemble(".text\nstart:\n    BOGUS R0, #1\n    JMP missing_label\n")
+        self.assertNotEqual(status, 0)
+        self.assertFalse(os.path.exists(output_file))
+
+    def test_invalid_source_with_depfile_exits_nonzero(self):
+        status, output_file = self.assemble(".text\n    LOAD R0, [\n", '--depfile', '{dir}/program.bin.d')
+        self.assertNotEqual(status, 0)
+        self.assertFalse(os.path.exists(output_file))
+        self.assertFalse(os.path.exists(output_file + '.d'))
+
+    def test_invalid_object_exits_nonzero(self):
+        status, _ = self.assemble(".text\n    BOGUS R0\n", '-c')
+        self.assertNotEqual(status, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Assembler Benchmark for VM
+
+This script generates a large synthetic assembly source and measures how
+many source lines per second the assembler processes. Pass --compare with
+the path of another assembler.py (e.g. an older revision extracted with
+`git show <rev>:assembler/assembler.py`) to benchmark both side by side.
+--workload data generates a data-heavy source (large .space buffers and
+long .byte/.word tables) instead, and --memory reports the peak memory
+allocated during one extra, untimed run.
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import os
+import sys
+import time
+import tracemalloc
+
+ASSEMBLER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assembler', 'assembler.py')
+
+def load_assembler(path, name):
+    """Load an assembler.py module from an explicit path."""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def generate_source(num_lines):
+    """Generate a synthetic program with a realistic mix of instructions and data."""
+    body = [
+        "    LOAD R5, #{i}          ; immediate load",
+        "    LOAD R6, [buffer_{b}]",
+        "    LOAD R7, [R6+4]",
+        "    ADD R5, R6",
+        "    STOREB R7, [R10]",
+        "    CMP R5, #0x1F",
+        "    JNZ block_{n}",
+        "    LOAD R0, msg_{b}",
+        "    SYSCALL #2",
+        "    MOVE R8, R5",
+        "    LOAD R9, [BP-8]",
+        "    CALL block_{n}",
+    ]
+    lines = [".text", "start:"]
+    blocks = 0
+    while len(lines) < num_lines:
+        lines.append(f"block_{blocks}:")
+        for template in body:
+            lines.append(template.format(i=blocks & 0xFFF, b=blocks % 64, n=blocks + 1))
+        blocks += 1
+    lines.append(f"block_{blocks}:")
+    lines.append("    HALT")
+
+    # A small data section referenced by the code
+    lines.append(".data")
+    for b in range(64):
+        lines.append(f"msg_{b}: .asciiz \"message {b}, done\\n\"")
+        lines.append(f"buffer_{b}: .word 0x1234, {b}")
+    return "\n".join(lines) + "\n", len(lines)
+
+def generate_data_source(num_lines):
+    """Generate a program that is mostly initialized and reserved data."""
+    lines = [".text", "start:", "    LOAD R0, table_0", "    HALT", ".data"]
+    tables = 0
+    while len(lines) < num_lines:
+        lines.append(f"table_{tables}:")
+        lines.append("    .byte " + ", ".join(str((tables + i) & 0xFF) for i in range(32)))
+        lines.append("    .word " + ", ".join(str((tables * 7 + i) & 0xFFFF) for i in range(16)))
+        lines.append(f"    .dword table_{tables}, 0x12345678, {tables}")
+        lines.append(f"    .asciiz \"record {tables}\"")
+        lines.append("    .space 4096")
+        tables += 1
+    return "\n".join(lines) + "\n", len(lines)
+
+def peak_memory(module, source, include_debug):
+    """Peak bytes allocated while assembling the source once."""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        assembler = module.Assembler()
+        tracemalloc.start()
+        assembler.assemble(source, "bench.asm", include_debug=include_debug)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return peak
+
+def bench(module, source, num_lines, repeat, include_debug):
+    """Assemble the source several times and return the best lines/sec."""
+    best = None
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(repeat):
+            assembler = module.Assembler()
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(devnull):
+                binary = assembler.assemble(source, "bench.asm", include_debug=include_debug)
+            elapsed = time.perf_counter() - start
+            if binary is None:
+                print(f"Assembly failed: {assembler.errors[:5]}", file=sys.stderr)
+                sys.exit(1)
+            best = elapsed if best is None else min(best, elapsed)
+    return num_lines / best, best
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the VM assembler')
+    parser.add_argument('-n', '--lines', type=int, default=200000, help='Number of source lines to generate (default: 200000)')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Number of runs, best is reported (default: 3)')
+    parser.add_argument('--compare', help='Path of another assembler.py to benchmark as the baseline')
+    parser.add_argument('--no-debug', action='store_true', help='Do not generate the debug symbol table')
+    parser.add_argument('--workload', choices=['code', 'data'], default='code',
+                        help='Instruction-heavy or data-heavy source (default: %(default)s)')
+    parser.add_argument('--memory', action='store_true', help='Also report peak memory allocated by the assembler')
+    args = parser.parse_args()
+
+    generate = generate_data_source if args.workload == 'data' else generate_source
+    source, num_lines = generate(args.lines)
+    include_debug = not args.no_debug
+
+    modules = []
+    if args.compare:
+        modules.append(("baseline", load_assembler(args.compare, "baseline_assembler")))
+    modules.append(("current", load_assembler(ASSEMBLER_PATH, "current_assembler")))
+    results = [(name, bench(module, source, num_lines, args.repeat, include_debug)) for name, module in modules]
+
+    print(f"Source: {num_lines} lines ({args.workload}), best of {args.repeat} run(s)")
+    for name, (rate, elapsed) in results:
+        print(f"  {name:<9} {rate:12,.0f} lines/sec  ({elapsed:.3f} s)")
+    if args.memory:
+        for name, module in modules:
+            print(f"  {name:<9} peak memory {peak_memory(module, source, include_debug) / (1024 * 1024):8.1f} MiB")
+    if len(results) == 2:
+        print(f"  speedup   {results[1][1][0] / results[0][1][0]:.2f}x")
+
+if __name__ == "__main__":
+    main()
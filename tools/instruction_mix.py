@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Instruction Mix Statistics for VM binaries
+
+This script counts the instructions in the code sections of any number of
+VM32 binaries (files, or directories searched for *.bin) and prints the
+most frequent mnemonics and addressing modes over the whole corpus. With
+-d it also writes the disassembly of every binary next to it as a .dis
+file. Binaries are processed in parallel (-j); the code sections are
+decoded with NumPy when it is installed.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assembler'))
+
+from assembler import (AddressingMode, Opcode, SectionType, disassemble, instruction_mix, load_numpy,
+                       parse_vm32)
+
+def find_binaries(paths):
+    """Expand the command line paths into a sorted list of binary files."""
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        for root, _, names in os.walk(path):
+            files.extend(os.path.join(root, name) for name in names if name.endswith('.bin'))
+    return sorted(files)
+
+def analyze(path, use_numpy=True, write_disassembly=False):
+    """Return (path, Counter of opcode/mode keys, error message or None) for one binary."""
+    try:
+        with open(path, 'rb') as f:
+            binary = f.read()
+        _, _, sections = parse_vm32(binary)
+    except (OSError, ValueError) as e:
+        return path, collections.Counter(), str(e)
+
+    mix = collections.Counter()
+    listing = []
+    for section_type, address, payload in sections:
+        if section_type != SectionType.CODE:
+            continue
+        mix.update(instruction_mix(payload, use_numpy))
+        if write_disassembly:
+            listing.extend(disassemble(payload, address, use_numpy=use_numpy))
+    if write_disassembly:
+        with open(os.path.splitext(path)[0] + '.dis', 'w') as f:
+            f.write("\n".join(listing) + "\n")
+    return path, mix, None
+
+def mnemonic(opcode):
+    """Name of an opcode, or its hex value if it is not a known instruction."""
+    try:
+        return Opcode(opcode).name
+    except ValueError:
+        return f"0x{opcode:02X}"
+
+def mode_name(mode):
+    """Name of an addressing mode, or its hex value if it is not a known mode."""
+    try:
+        return AddressingMode(mode).name
+    except ValueError:
+        return f"0x{mode:X}"
+
+def print_table(title, counts, total, top):
+    """Print the top entries of a counter with their share of the total."""
+    print(f"\n{title}:")
+    for name, count in counts.most_common(top):
+        print(f"  {name:<12} {count:12,}  {100.0 * count / total:6.2f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description='Instruction mix statistics over VM binaries')
+    parser.add_argument('paths', nargs='+', help='Binaries, or directories to search for *.bin files')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of parallel workers (default: all cores)')
+    parser.add_argument('-n', '--top', type=int, default=20, help='Number of entries per table (default: %(default)s)')
+    parser.add_argument('-d', '--disassemble', action='store_true', help='Also write <binary>.dis disassembly files')
+    parser.add_argument('--json', metavar='FILE', help="Write the per-mnemonic and per-mode counts as JSON ('-' for stdout)")
+    parser.add_argument('--no-numpy', action='store_true', help='Use the pure Python decoder even if NumPy is installed')
+    args = parser.parse_args()
+
+    files = find_binaries(args.paths)
+    if not files:
+        parser.error("no binaries found")
+    use_numpy = not args.no_numpy
+
+    with concurrent.futures.ProcessPoolExecutor(args.jobs) as pool:
+        results = list(pool.map(analyze, files, [use_numpy] * len(files), [args.disassemble] * len(files),
+                                chunksize=max(1, len(files) // 64)))
+
+    mix = collections.Counter()
+    failed = 0
+    for path, counts, error in results:
+        if error:
+            print(f"{path}: {error}", file=sys.stderr)
+            failed += 1
+        mix.update(counts)
+
+    by_mnemonic = collections.Counter()
+    by_mode = collections.Counter()
+    by_form = collections.Counter()
+    for key, count in mix.items():
+        by_mnemonic[mnemonic(key >> 4)] += count
+        by_mode[mode_name(key & 0xF)] += count
+        by_form[f"{mnemonic(key >> 4)} {mode_name(key & 0xF)}"] += count
+    total = sum(mix.values())
+
+    decoder = "NumPy" if use_numpy and load_numpy() is not None else "pure Python"
+    print(f"{len(files) - failed} binaries, {total:,} instructions ({decoder} decoder)")
+    if total:
+        print_table("Mnemonics", by_mnemonic, total, args.top)
+        print_table("Addressing modes", by_mode, total, args.top)
+        print_table("Mnemonic and mode", by_form, total, args.top)
+
+    if args.json:
+        report = {"binaries": len(files) - failed, "instructions": total,
+                  "mnemonics": dict(by_mnemonic.most_common()), "modes": dict(by_mode.most_common()),
+                  "forms": dict(by_form.most_common())}
+        if args.json == '-':
+            json.dump(report, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent=2)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
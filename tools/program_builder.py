@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Program Builder for VM test programs
+
+A small library for the tools that generate VM programs directly instead
+of going through assembly source. Instructions are encoded with the
+assembler's encoder into an array('I'), labels may be used before they are
+defined (link() fixes the references up), strings and other data go to the
+data segment, and the result is written as a VM32 binary or as a raw code
+image for the VM's legacy loader.
+
+    builder = ProgramBuilder()
+    builder.load(R0, builder.string("Hello, World!\\n"))
+    builder.syscall(2)
+    builder.emit(Opcode.HALT)
+    builder.write("hello.bin")
+
+Large programs are best built from pre-encoded words: emit_words() and
+repeat() append whole arrays at once.
+"""
+
+import os
+import sys
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assembler'))
+
+from assembler import (CODE_SEGMENT_BASE, DATA_SEGMENT_BASE, WIDE_IMMEDIATE_MODES, AddressingMode, Opcode,
+                       build_vm32, code_to_bytes, encode_instruction, immediate_fits)
+
+# Register numbers (R1 is BP, R2 SP, R3 PC, R4 SR and R15 LR)
+R0, R1, R2, R3, R4, R5, R6, R7, R8, R9, R10, R11, R12, R13, R14, R15 = range(16)
+
+# Addressing modes as plain ints, which are quicker to look up than the enum members
+IMM = int(AddressingMode.IMM)
+REG = int(AddressingMode.REG)
+MEM = int(AddressingMode.MEM)
+REGM = int(AddressingMode.REGM)
+IDX = int(AddressingMode.IDX)
+STK = int(AddressingMode.STK)
+BAS = int(AddressingMode.BAS)
+
+def encode(opcode, mode=IMM, reg1=0, reg2=0, immediate=0):
+    """Encode one instruction word; IMM, MEM, STK and BAS take a 16-bit immediate."""
+    return encode_instruction(opcode, mode, reg1, reg2, immediate)
+
+class ProgramBuilder:
+    """
+    Code words, data bytes and labels of a program being generated. An
+    immediate (or data word) given as a label name, or as a (name, addend)
+    pair, is resolved by link().
+    """
+    def __init__(self):
+        self.code = array('I')
+        self.data = bytearray()
+        self.labels = {}
+        self.strings = {}  # text -> address of its pooled copy
+        self.code_fixups = []  # (word index, mode, symbol, addend)
+        self.data_fixups = []  # (data offset, symbol, addend)
+
+    @property
+    def address(self):
+        """Address of the next instruction."""
+        return CODE_SEGMENT_BASE + len(self.code) * 4
+
+    @property
+    def data_address(self):
+        """Address of the next data byte."""
+        return DATA_SEGMENT_BASE + len(self.data)
+
+    def define(self, name, address):
+        """Define a label at an address."""
+        if name in self.labels:
+            raise ValueError(f"Duplicate label: {name}")
+        self.labels[name] = address
+        return address
+
+    def label(self, name):
+        """Define a code label at the next instruction."""
+        return self.define(name, self.address)
+
+    def data_label(self, name):
+        """Define a data label at the next data byte."""
+        return self.define(name, self.data_address)
+
+    # Code
+
+    def emit(self, opcode, mode=IMM, reg1=0, reg2=0, immediate=0):
+        """Append one instruction and return its address."""
+        code = self.code
+        index = len(code)
+        if not isinstance(immediate, int):
+            symbol, addend = (immediate, 0) if isinstance(immediate, str) else immediate
+            self.code_fixups.append((index, mode, symbol, addend))
+            immediate = 0
+        elif not immediate_fits(mode, immediate):
+            raise ValueError(f"Immediate {immediate} does not fit {AddressingMode(mode).name} mode")
+        code.append(encode_instruction(opcode, mode, reg1, reg2, immediate))
+        return CODE_SEGMENT_BASE + index * 4
+
+    def emit_words(self, words):
+        """Append pre-encoded instruction words (an array('I') is appended in one step)."""
+        address = self.address
+        if isinstance(words, array) and words.typecode == self.code.typecode:
+            self.code.extend(words)
+        else:
+            self.code.extend(array('I', words))
+        return address
+
+    def repeat(self, words, count):
+        """Append a block of pre-encoded words count times."""
+        return self.emit_words(array('I', words) * count)
+
+    def pad_to(self, address, word=None):
+        """Fill the code with NOPs (or a given word) up to an address."""
+        if address < self.address:
+            raise ValueError(f"Code is already past 0x{address:04X}")
+        if word is None:
+            word = encode(Opcode.NOP)
+        return self.repeat([word], (address - self.address) // 4)
+
+    def load(self, reg, value):
+        """LOAD reg, #value (a number, or the address of a label)."""
+        return self.emit(Opcode.LOAD, IMM, reg, 0, value)
+
+    def move(self, dest, src):
+        """MOVE dest, src."""
+        return self.emit(Opcode.MOVE, REG, dest, src)
+
+    def syscall(self, number):
+        """SYSCALL #number."""
+        return self.emit(Opcode.SYSCALL, IMM, 0, 0, number)
+
+    def jump(self, opcode, target):
+        """A jump or call to a label or address."""
+        return self.emit(opcode, IMM, 0, 0, target)
+
+    def print_string(self, text):
+        """
+        Print a string with SYSCALL #2. The string is stored in the data
+        segment once, however often it is printed.
+        """
+        address = self.strings.get(text)
+        if address is None:
+            address = self.strings[text] = self.string(text)
+        self.load(R0, address)
+        return self.syscall(2)
+
+    # Data
+
+    def data_bytes(self, value, label=None):
+        """Append bytes to the data segment and return their address."""
+        if label:
+            self.data_label(label)
+        address = self.data_address
+        self.data += value
+        return address
+
+    def string(self, text, label=None):
+        """Append a zero-terminated string and return its address."""
+        return self.data_bytes(text.encode('utf-8') + b"\0", label)
+
+    def dword(self, value, label=None):
+        """Append a 32-bit word (a number, or the address of a label)."""
+        if label:
+            self.data_label(label)
+        address = self.data_address
+        if not isinstance(value, int):
+            symbol, addend = (value, 0) if isinstance(value, str) else value
+            self.data_fixups.append((len(self.data), symbol, addend))
+            value = 0
+        self.data += (value & 0xFFFFFFFF).to_bytes(4, 'little')
+        return address
+
+    def align_data(self, alignment=4):
+        """Pad the data segment with zeros to a multiple of alignment."""
+        self.data += bytes(-len(self.data) % alignment)
+        return self.data_address
+
+    # Output
+
+    def resolve(self, symbol, addend):
+        """Address of a label plus an addend."""
+        try:
+            return self.labels[symbol] + addend
+        except KeyError:
+            raise ValueError(f"Undefined label: {symbol}") from None
+
+    def link(self):
+        """Store every label reference; raises ValueError for undefined labels or values that do not fit."""
+        code = self.code
+        for index, mode, symbol, addend in self.code_fixups:
+            value = self.resolve(symbol, addend)
+            if not immediate_fits(mode, value):
+                raise ValueError(f"Address of {symbol} does not fit {AddressingMode(mode).name} mode")
+            if mode in WIDE_IMMEDIATE_MODES:
+                code[index] = (code[index] & 0xFFFF0000) | (value & 0xFFFF)
+            else:
+                code[index] = (code[index] & 0xFFFFF000) | (value & 0xFFF)
+        for offset, symbol, addend in self.data_fixups:
+            value = self.resolve(symbol, addend)
+            self.data[offset:offset + 4] = (value & 0xFFFFFFFF).to_bytes(4, 'little')
+        self.code_fixups = []
+        self.data_fixups = []
+
+    def code_bytes(self):
+        """The linked code as a raw little-endian image."""
+        self.link()
+        return code_to_bytes(self.code)
+
+    def to_vm32(self):
+        """The linked program as a VM32 binary."""
+        self.link()
+        return build_vm32(self.code, self.data)
+
+    def to_bytes(self, raw=False):
+        """
+        The program as a VM32 binary, or as a raw code image for the legacy
+        loader (which only loads code, so the data segment must be empty).
+        """
+        if not raw:
+            return self.to_vm32()
+        if self.data:
+            raise ValueError("A raw image cannot hold a data segment")
+        return self.code_bytes()
+
+    def write(self, path=None, raw=False):
+        """Write the program to a file, or to stdout when path is None or '-'."""
+        binary = self.to_bytes(raw)
+        if path is None or path == '-':
+            sys.stdout.buffer.write(binary)
+            sys.stdout.buffer.flush()
+        else:
+            with open(path, 'wb') as f:
+                f.write(binary)
+        return len(binary)